@@ -1,35 +1,238 @@
-import os
-from typing import List, Dict, Any, ClassVar, Type
+from typing import List, Dict, Any, ClassVar, Type, Iterator, Optional
 import time
 import re
+import datetime
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from pydantic import BaseModel, Field
 
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain.chains import LLMChain
 from langchain.tools.base import BaseTool
+from langchain_core.tools import render_text_description
 from langchain.prompts import PromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 import json
 
+from code_evaluator import CodeEvaluator
+
+# Shared pool for work that runs after the student has already received a response
+background_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="viva-background")
+
+# Gemini context caching needs an explicitly versioned model
+CONTEXT_CACHE_MODEL = "gemini-1.5-flash-002"
+CONTEXT_CACHE_TTL_SECONDS = 3600
+# Gemini 1.5 rejects cached contents below this many tokens
+CONTEXT_CACHE_MIN_TOKENS = 32768
+
+# The part of the agent prompt shared by every session, the one worth caching
+AGENT_SHARED_PREFIX_TEMPLATE = """
+    You are an AI assistant conducting a technical viva examination. Your goal is to assess the student's knowledge through questions and practical tasks.
+    
+    You have access to the following tools:
+    {tools}
+    
+    Use the following format for your internal reasoning process:
+    
+    Question: the input question you must answer
+    Thought: you should always think about what to do
+    Action: the action to take, should be one of [{tool_names}]
+    Action Input: the input to the action MUST be a valid JSON object with ALL required fields for the tool
+    Observation: the result of the action
+    Thought: I now know the final answer
+    Final Answer: <your actual response to the student>
+    
+    CRITICAL INSTRUCTIONS:
+    1. You MUST use the task_generator tool {total_tasks} times during the examination, but ONLY when instructed
+    2. Always follow the current state of the exam given with each student response
+    3. Ask ONLY ONE question at a time, and wait for the student's response
+    4. Your Final Answer must ONLY contain the question text with no reasoning/explanation
+    5. Do NOT include multiple questions in a single response
+    6. Avoid any Typing Mistakes or spelling errors made by the student since it is an oral examination.
+    6. Do NOT end the interview prematurely
+    7. ONLY USE ONE TOOL PER STUDENT RESPONSE - you must return your answer after a single tool use
+    8. STOP after using one tool and DO NOT continue the thought process or use additional tools
+    
+    For viva_question_generator tool, ALWAYS include all required fields:
+    - conversation_history: string of conversation so far
+    - subject: string of the subject being examined
+    - syllabus: string of the syllabus content
+    - difficulty: integer difficulty level
+    - teacher_notes: string of additional notes
+        
+    For task_generator tool, ALWAYS include all required fields:
+    - conversation_history: string of conversation so far
+    - subject: string of the subject being examined 
+    - syllabus: string of the syllabus content
+    - difficulty: integer difficulty level
+    - teacher_notes: string of additional notes
+    """
+
+# The part of the agent prompt that stays the same for the whole session
+AGENT_SESSION_TEMPLATE = """
+    Student: {student_name}
+    Student Information: {student_info}
+    Subject: {subject}
+    Syllabus: {syllabus}
+    Difficulty Level: {difficulty}
+    teacher_notes: {teacher_notes}
+    """
+
+# The part of the agent prompt that changes on every turn
+AGENT_DYNAMIC_SUFFIX_TEMPLATE = """
+    Current state of the exam: {current_state}
+    
+    Conversation history:
+    {conversation_history}
+    
+    Current user input: {input}
+    
+    {agent_scratchpad}
+    """
+
+# State given to the examiner when nothing special (task, conclusion) is due
+DEFAULT_EXAM_STATE = "Continue the examination with appropriate theoretical questions."
+
+# Words ignored by the cheap relevance check for speculative questions
+STOP_WORDS = {
+    "a", "an", "the", "and", "or", "but", "if", "of", "to", "in", "on", "for", "with", "by", "at", "from",
+    "is", "are", "was", "were", "be", "been", "it", "its", "this", "that", "these", "those", "as", "so",
+    "can", "could", "would", "should", "do", "does", "did", "you", "your", "i", "we", "they", "he", "she",
+    "what", "which", "how", "why", "when", "where", "who", "explain", "describe", "about", "between", "me"
+}
+
+# Answers that mean the next question has to adapt, so a pre-generated one won't fit
+NON_ANSWER_PATTERN = re.compile(r"\b(don'?t know|not sure|no idea|can'?t remember|skip|pass)\b", re.IGNORECASE)
+
+
+def content_words(text: str) -> set:
+    """Lowercased words of a text without stop words, used for cheap relevance checks"""
+    return {w for w in re.findall(r"[a-z0-9_]+", text.lower()) if len(w) > 2 and w not in STOP_WORDS}
+
+
+# Gemini context caches of prompt prefixes, shared by all sessions of the process:
+# (api key, prefix digest) -> Future of (cache name or None, time until which the entry holds)
+_context_caches: Dict[tuple, Future] = {}
+_context_cache_lock = threading.Lock()
+
+
+def get_context_cache(api_key: str, prefix: str) -> Optional[str]:
+    """
+    Name of the process-wide context cache of a prompt prefix for an API key, or None
+
+    A cache belongs to the project of the key that created it, so every key gets its
+    own, created on first use and again once its TTL runs out. A prefix below Gemini's
+    minimum cacheable size is counted once and then always sent inline.
+    """
+    # A token spans at least one character, so a shorter prefix cannot reach the
+    # minimum and is sent inline without asking the API
+    if len(prefix) < CONTEXT_CACHE_MIN_TOKENS:
+        return None
+
+    key = (api_key, hashlib.sha256(prefix.encode("utf-8")).hexdigest())
+    with _context_cache_lock:
+        entry = _context_caches.get(key)
+        # Leave a minute of margin so a turn never starts on a cache about to expire
+        if entry is not None and (not entry.done() or entry.result()[1] > time.time() + 60):
+            owner = False
+        else:
+            entry = _context_caches[key] = Future()
+            owner = True
+
+    # Only the first caller talks to the API, the others wait for its result
+    # without blocking the lookups of other keys and prefixes
+    if not owner:
+        return entry.result()[0]
+    result = _create_context_cache(api_key, prefix)
+    entry.set_result(result)
+    return result[0]
+
+
+def _create_context_cache(api_key: str, prefix: str) -> tuple:
+    """Create the context cache of a prompt prefix: (cache name or None, valid until)"""
+    try:
+        import google.generativeai as genai
+        from google.generativeai import caching
+    except ImportError:
+        return None, float("inf")
+
+    name, valid_until = None, time.time() + CONTEXT_CACHE_TTL_SECONDS
+    try:
+        genai.configure(api_key=api_key)
+        model = genai.GenerativeModel(f"models/{CONTEXT_CACHE_MODEL}")
+        tokens = model.count_tokens(prefix).total_tokens
+        if tokens < CONTEXT_CACHE_MIN_TOKENS:
+            print(f"Prompt prefix has {tokens} tokens, below the {CONTEXT_CACHE_MIN_TOKENS} "
+                  f"Gemini caches; sending it inline")
+            valid_until = float("inf")
+        else:
+            cache = caching.CachedContent.create(
+                model=f"models/{CONTEXT_CACHE_MODEL}",
+                display_name="viva-agent-prefix",
+                system_instruction=prefix,
+                ttl=datetime.timedelta(seconds=CONTEXT_CACHE_TTL_SECONDS),
+            )
+            print(f"Created context cache {cache.name} for the shared prompt prefix")
+            name = cache.name
+    except Exception as e:
+        # Retried when the entry expires
+        print(f"Context caching unavailable, sending the prompt prefix inline: {e}")
+    return name, valid_until
+
+
+# Gemini chat models bound to one API key: (model, temperature, mime type, api key) -> model
+_keyed_llms: Dict[tuple, ChatGoogleGenerativeAI] = {}
+_keyed_llm_lock = threading.Lock()
+
+
+def llm_for_key(llm, api_key: str):
+    """
+    The chat model with the same settings as llm that calls Gemini with api_key
+
+    The key is bound to each model instead of set in os.environ, so background
+    jobs and sessions rotating keys concurrently never change each other's key.
+    Other chat models, e.g. injected benchmark stand-ins, are returned as is.
+    """
+    if not isinstance(llm, ChatGoogleGenerativeAI):
+        return llm
+    if llm.google_api_key is not None and llm.google_api_key.get_secret_value() == api_key:
+        return llm
+    key = (llm.model, llm.temperature, llm.response_mime_type, api_key)
+    with _keyed_llm_lock:
+        if key not in _keyed_llms:
+            _keyed_llms[key] = ChatGoogleGenerativeAI(
+                model=llm.model,
+                temperature=llm.temperature,
+                google_api_key=api_key,
+                response_mime_type=llm.response_mime_type,
+            )
+        return _keyed_llms[key]
+
+
 # API Key Management Class
 class APIKeyManager:
     def __init__(self, api_keys: List[str]):
         self.api_keys = api_keys
         self.current_index = 0
         self.last_rotation_time = time.time()
+        # Shared by the request threads and the background executor
+        self._lock = threading.Lock()
         
     def get_current_key(self) -> str:
         """Get the current API key"""
-        return self.api_keys[self.current_index]
+        with self._lock:
+            return self.api_keys[self.current_index]
     
     def rotate_key(self, force: bool = False) -> str:
         """Rotate to the next API key"""
-        current_time = time.time()
-        # Rotate if forced or if more than 5 minutes have passed
-        if force or (current_time - self.last_rotation_time > 300):
-            self.current_index = (self.current_index + 1) % len(self.api_keys)
-            self.last_rotation_time = current_time
-        return self.get_current_key()
+        with self._lock:
+            current_time = time.time()
+            # Rotate if forced or if more than 5 minutes have passed
+            if force or (current_time - self.last_rotation_time > 300):
+                self.current_index = (self.current_index + 1) % len(self.api_keys)
+                self.last_rotation_time = current_time
+            return self.api_keys[self.current_index]
 
 
 # Tool Definitions
@@ -77,8 +280,7 @@ class VivaQuestionGeneratorTool(BaseTool):
             teacher_notes = str(teacher_notes) if teacher_notes else ""
         
 
-        api_key = self._api_key_manager.rotate_key()
-        os.environ["GOOGLE_API_KEY"] = api_key
+        llm = llm_for_key(self._llm, self._api_key_manager.rotate_key())
         
         template = """
          You are an expert interviewer conducting a viva examination. Your goal is to ask **one short, conceptual oral examination type question** that tests the student's **understanding and critical thinking Remember you don't have the ability to see or examine the practicals done by student so only ask questions related to theory and concepts and do not ask the use to demonstrate , write any answer **.
@@ -121,7 +323,7 @@ class VivaQuestionGeneratorTool(BaseTool):
             template=template
         )
         
-        chain = LLMChain(llm=self._llm, prompt=prompt)
+        chain = LLMChain(llm=llm, prompt=prompt)
         
         try:
             return chain.run(
@@ -133,8 +335,8 @@ class VivaQuestionGeneratorTool(BaseTool):
             )
         except Exception as e:
             # If error occurs, force rotate key and try again
-            api_key = self._api_key_manager.rotate_key(force=True)
-            os.environ["GOOGLE_API_KEY"] = api_key
+            llm = llm_for_key(self._llm, self._api_key_manager.rotate_key(force=True))
+            chain = LLMChain(llm=llm, prompt=prompt)
             return chain.run(
                 conversation_history=conversation_history, 
                 subject=subject,
@@ -240,8 +442,7 @@ class TaskGeneratorTool(BaseTool):
                      
         
         # Rotate API key if needed
-        api_key = self._api_key_manager.rotate_key()
-        os.environ["GOOGLE_API_KEY"] = api_key
+        llm = llm_for_key(self._llm, self._api_key_manager.rotate_key())
         
         template = """
       You are an expert **technical interviewer** designing **subject-specific practical tasks** for a viva examination.
@@ -284,7 +485,7 @@ class TaskGeneratorTool(BaseTool):
             template=template
         )
         
-        chain = LLMChain(llm=self._llm, prompt=prompt)
+        chain = LLMChain(llm=llm, prompt=prompt)
         
         try:
             return chain.run(
@@ -297,8 +498,8 @@ class TaskGeneratorTool(BaseTool):
             )
         except Exception as e:
             # If error occurs, force rotate key and try again
-            api_key = self._api_key_manager.rotate_key(force=True)
-            os.environ["GOOGLE_API_KEY"] = api_key
+            llm = llm_for_key(self._llm, self._api_key_manager.rotate_key(force=True))
+            chain = LLMChain(llm=llm, prompt=prompt)
             return chain.run(
                 conversation_history=conversation_history, 
                 subject=subject,
@@ -372,6 +573,45 @@ class EndInterviewTool(BaseTool):
     
     def _run(self, action_input: str) -> str:
         """Generate a conclusion for the viva examination"""
+        inputs = self._prepare_inputs(action_input)
+        # Rotate API key if needed
+        return self._conclude(inputs, self._api_key_manager.rotate_key())
+    
+    def _conclude(self, inputs: dict, api_key: str) -> str:
+        """Generate the whole conclusion with an API key, retrying once with the next key"""
+        chain = LLMChain(llm=llm_for_key(self._llm, api_key), prompt=self._get_prompt())
+        
+        try:
+            return chain.run(**inputs)
+        except Exception as e:
+            # If error occurs, force rotate key and try again
+            api_key = self._api_key_manager.rotate_key(force=True)
+            chain = LLMChain(llm=llm_for_key(self._llm, api_key), prompt=self._get_prompt())
+            return chain.run(**inputs)
+    
+    def stream_conclusion(self, action_input: str) -> Iterator[str]:
+        """Stream the conclusion for the viva examination chunk by chunk"""
+        inputs = self._prepare_inputs(action_input)
+        prompt_text = self._get_prompt().format(**inputs)
+        # Rotate API key if needed
+        llm = llm_for_key(self._llm, self._api_key_manager.rotate_key())
+        
+        emitted = False
+        try:
+            for chunk in llm.stream(prompt_text):
+                text = getattr(chunk, "content", chunk)
+                if text:
+                    emitted = True
+                    yield text
+        except Exception as e:
+            print(f"Error streaming conclusion: {e}")
+            # Part of the conclusion already reached the student, so don't start over
+            if emitted:
+                return
+            yield self._conclude(inputs, self._api_key_manager.rotate_key(force=True))
+    
+    def _prepare_inputs(self, action_input: str) -> dict:
+        """Extract and normalise the prompt inputs for the conclusion"""
         # Process the action_input to extract parameters
         params = self._extract_params(action_input)
         conversation_history = params.get("conversation_history", "")
@@ -386,10 +626,14 @@ class EndInterviewTool(BaseTool):
         if not isinstance(subject, str):
             subject = str(subject) if subject else "Computer Science"
         
-        # Rotate API key if needed
-        api_key = self._api_key_manager.rotate_key()
-        os.environ["GOOGLE_API_KEY"] = api_key
-        
+        return {
+            "student_name": student_name,
+            "subject": subject,
+            "conversation_history": conversation_history
+        }
+    
+    def _get_prompt(self) -> PromptTemplate:
+        """Build the prompt used for the conclusion"""
         template = """
         You are concluding a technical viva examination.
         
@@ -407,28 +651,10 @@ class EndInterviewTool(BaseTool):
         Return only the conclusion message without any formatting symbols or additional explanations.
         """
         
-        prompt = PromptTemplate(
+        return PromptTemplate(
             input_variables=["student_name", "subject", "conversation_history"],
             template=template
         )
-        
-        chain = LLMChain(llm=self._llm, prompt=prompt)
-        
-        try:
-            return chain.run(
-                student_name=student_name,
-                subject=subject,
-                conversation_history=conversation_history
-            )
-        except Exception as e:
-            # If error occurs, force rotate key and try again
-            api_key = self._api_key_manager.rotate_key(force=True)
-            os.environ["GOOGLE_API_KEY"] = api_key
-            return chain.run(
-                student_name=student_name,
-                subject=subject,
-                conversation_history=conversation_history
-            )
     
     def _extract_params(self, action_input: str) -> dict:
         """Extract parameters from the action_input string"""
@@ -471,9 +697,85 @@ class EndInterviewTool(BaseTool):
         return {}
 
 
+# Generates the detailed evaluation report once the viva is over
+class EvaluationReportGenerator:
+    def __init__(self, llm, api_key_manager):
+        self._llm = llm
+        self._api_key_manager = api_key_manager
+    
+    def generate(self, student_name: str, subject: str, syllabus: str, teacher_notes: str,
+                 conversation_history: str, task_results: str = "") -> dict:
+        """Generate the evaluation report for a completed viva examination"""
+        llm = llm_for_key(self._llm, self._api_key_manager.rotate_key())
+        
+        template = """
+        You are evaluating a completed technical viva examination.
+        
+        Student Name: {student_name}
+        Subject: {subject}
+        Syllabus: {syllabus}
+        Teacher's Notes: {teacher_notes}
+        
+        Full conversation between the examiner and the student:
+        {conversation_history}
+        
+        Automated grading of the practical tasks (if any): {task_results}
+        
+        Assess the student's answers and tasks and return a JSON object with exactly these keys:
+        - "overall_score": integer from 0 to 100
+        - "summary": 2-3 sentence overview of the student's performance
+        - "strengths": list of short strings
+        - "weaknesses": list of short strings
+        - "question_feedback": list of objects with "question", "assessment" and "score" (0-10)
+        - "task_feedback": list of objects with "task", "assessment" and "score" (0-10)
+        - "recommendations": list of short strings on what the student should study next
+        
+        Return only the JSON object without any additional text.
+        """
+        
+        prompt = PromptTemplate(
+            input_variables=["student_name", "subject", "syllabus", "teacher_notes", "conversation_history", "task_results"],
+            template=template
+        )
+        
+        chain = LLMChain(llm=llm, prompt=prompt)
+        inputs = {
+            "student_name": student_name,
+            "subject": subject,
+            "syllabus": syllabus,
+            "teacher_notes": teacher_notes,
+            "conversation_history": conversation_history,
+            "task_results": task_results or "No automated results"
+        }
+        
+        try:
+            raw_report = chain.run(**inputs)
+        except Exception as e:
+            # If error occurs, force rotate key and try again
+            llm = llm_for_key(self._llm, self._api_key_manager.rotate_key(force=True))
+            raw_report = LLMChain(llm=llm, prompt=prompt).run(**inputs)
+        
+        return self._parse_report(raw_report)
+    
+    def _parse_report(self, raw_report: str) -> dict:
+        """Parse the JSON report, keeping the raw text if the model did not return valid JSON"""
+        cleaned_report = raw_report.strip()
+        if "```" in cleaned_report:
+            cleaned_report = re.sub(r'```(?:json)?\n?', '', cleaned_report).replace('```', '').strip()
+        
+        try:
+            report = json.loads(cleaned_report)
+            if isinstance(report, dict):
+                return report
+        except json.JSONDecodeError as e:
+            print(f"Report JSON parse error: {e}")
+        
+        return {"summary": raw_report.strip()}
+
+
 # Main Viva Agent Class
 class VivaExaminationAgent:
-    def __init__(self, gemini_api_keys: List[str], config: Dict[str, Any]):
+    def __init__(self, gemini_api_keys: List[str], config: Dict[str, Any], llm=None):
         self.api_key_manager = APIKeyManager(gemini_api_keys)
         self.student_name = config.get('student_name', 'Student')
         self.student_info = config.get('student_info', '')
@@ -484,15 +786,21 @@ class VivaExaminationAgent:
         self.total_tasks = config.get('tasks', 2)
         self.completed_tasks = 0
         self.max_questions = config.get('max_questions', 10)  # Default to 10 if not specified
+        # Number of next-question candidates generated while the student answers (0 disables it)
+        self.speculative_candidates = config.get('speculative_candidates', 0)
+        self.speculative_min_relevance = config.get('speculative_min_relevance', 0.2)
+        self.speculation = None
 
         self.conversation_history = []
         self.current_task = None
+        self.report_future = None
+        self.task_results = []
         
         # Initialize Gemini LLM
         api_key = self.api_key_manager.get_current_key()
-        os.environ["GOOGLE_API_KEY"] = api_key
         
-        self.llm = ChatGoogleGenerativeAI(
+        # A pre-built chat model can be injected, e.g. a scripted stand-in for benchmarks
+        self.llm = llm or ChatGoogleGenerativeAI(
             model="gemini-1.5-flash",
             temperature=0.7,
             google_api_key=api_key,
@@ -503,6 +811,12 @@ class VivaExaminationAgent:
         self.viva_question_tool = VivaQuestionGeneratorTool(self.llm, self.api_key_manager)
         self.task_generator_tool = TaskGeneratorTool(self.llm, self.api_key_manager)
         self.end_interview_tool = EndInterviewTool(self.llm, self.api_key_manager)
+        self.report_generator = EvaluationReportGenerator(self.llm, self.api_key_manager)
+        
+        # Local grader for code/SQL tasks; fixtures come from the teacher or one LLM call per task
+        self.code_evaluator = CodeEvaluator(fixture_factory=self._generate_task_fixture)
+        for task_description, fixture in config.get('task_fixtures', {}).items():
+            self.code_evaluator.register_fixture(task_description, fixture)
         
         # List of tools
         self.tools = [
@@ -511,68 +825,63 @@ class VivaExaminationAgent:
             self.end_interview_tool
         ]
         
-        # This is the critical fix for your issue
-        agent_prompt = PromptTemplate(
-    template="""
-    You are an AI assistant conducting a technical viva examination. Your goal is to assess the student's knowledge through questions and practical tasks.
-    
-    Student: {student_name}
-    Student Information: {student_info}
-    Subject: {subject}
-    Syllabus: {syllabus}
-    Difficulty Level: {difficulty}
-    teacher_notes: {teacher_notes}
-    Current user input: {input}
+        # The constant parts of the agent prompt are rendered once. The part shared by all
+        # sessions goes to a process-wide Gemini context cache when it is large enough to be
+        # cached, so each turn only sends the session details and the dynamic suffix
+        self.shared_prompt_prefix = self._build_shared_prompt_prefix()
+        self.session_prompt = self._build_session_prompt()
+        self.context_caching = llm is None and config.get('context_caching', True)
+        self.context_cache_name = None
+        self.agent_api_key = None
+        self._build_agent()
     
-    Conversation history:
-    {conversation_history}
-    
-    Current state of the exam: {current_state}
-    
-    You have access to the following tools:
-    {tools}
-    
-    Use the following format for your internal reasoning process:
-    
-    Question: the input question you must answer
-    Thought: you should always think about what to do
-    Action: the action to take, should be one of [{tool_names}]
-    Action Input: the input to the action MUST be a valid JSON object with ALL required fields for the tool
-    Observation: the result of the action
-    Thought: I now know the final answer
-    Final Answer: <your actual response to the student>
+    def _build_shared_prompt_prefix(self) -> str:
+        """Render the part of the agent prompt that is the same for every session"""
+        return AGENT_SHARED_PREFIX_TEMPLATE.format(
+            tools=render_text_description(self.tools),
+            tool_names=", ".join(tool.name for tool in self.tools),
+            total_tasks=self.total_tasks
+        )
     
-    CRITICAL INSTRUCTIONS:
-    1. You MUST use the task_generator tool {total_tasks} times during the examination, but ONLY when instructed
-    2. Currently {current_state}
-    3. Ask ONLY ONE question at a time, and wait for the student's response
-    4. Your Final Answer must ONLY contain the question text with no reasoning/explanation
-    5. Do NOT include multiple questions in a single response
-    6. Avoid any Typing Mistakes or spelling errors made by the student since it is an oral examination.
-    6. Do NOT end the interview prematurely
-    7. ONLY USE ONE TOOL PER STUDENT RESPONSE - you must return your answer after a single tool use
-    8. STOP after using one tool and DO NOT continue the thought process or use additional tools
+    def _build_session_prompt(self) -> str:
+        """Render the session-constant part of the agent prompt once"""
+        return AGENT_SESSION_TEMPLATE.format(
+            student_name=self.student_name,
+            student_info=self.student_info,
+            subject=self.subject,
+            syllabus=self.syllabus,
+            difficulty=self.difficulty,
+            teacher_notes=self.teacher_notes
+        )
     
-    For viva_question_generator tool, ALWAYS include all required fields:
-    - conversation_history: string of conversation so far
-    - subject: string of the subject being examined
-    - syllabus: string of the syllabus content
-    - difficulty: integer difficulty level
-    - teacher_notes: string of additional notes
+    def _build_agent(self):
+        """Build the agent executor for the current API key, on its context cache if there is one"""
+        api_key = self.api_key_manager.get_current_key()
+        cache_name = get_context_cache(api_key, self.shared_prompt_prefix) if self.context_caching else None
         
-    For task_generator tool, ALWAYS include all required fields:
-    - conversation_history: string of conversation so far
-    - subject: string of the subject being examined 
-    - syllabus: string of the syllabus content
-    - difficulty: integer difficulty level
-    - teacher_notes: string of additional notes
-    
-    {agent_scratchpad}
-    """,
-    input_variables=["student_name", "student_info", "subject", "conversation_history", "current_state", "input", "agent_scratchpad", "tools", "tool_names","syllabus","difficulty","teacher_notes","total_tasks"],
-)
+        # Escape braces so the pre-rendered parts are not parsed as template variables again
+        session_prompt = self.session_prompt.replace("{", "{{").replace("}", "}}")
+        if cache_name:
+            agent_llm = ChatGoogleGenerativeAI(
+                model=CONTEXT_CACHE_MODEL,
+                temperature=0.7,
+                google_api_key=api_key,
+                response_mime_type="application/json",
+                cached_content=cache_name,
+            )
+            prompt_prefix = ""
+        else:
+            agent_llm = llm_for_key(self.llm, api_key)
+            prompt_prefix = self.shared_prompt_prefix.replace("{", "{{").replace("}", "}}")
+        
+        agent_prompt = PromptTemplate(
+            template=prompt_prefix + session_prompt + AGENT_DYNAMIC_SUFFIX_TEMPLATE,
+            input_variables=["conversation_history", "current_state", "input", "agent_scratchpad"],
+            # Already part of the shared prefix, create_react_agent only requires them to exist
+            partial_variables={"tools": "", "tool_names": ""},
+        )
         self.agent = create_react_agent(
-            llm=self.llm,
+            llm=agent_llm,
             tools=self.tools,
             prompt=agent_prompt,
         )
@@ -589,6 +898,15 @@ class VivaExaminationAgent:
     tool_input_override=self._fix_tool_input,
     handle_tool_error=lambda tool_error: f"Tool error occurred. Generating a simple question instead."
 )
+        self.agent_api_key = api_key
+        self.context_cache_name = cache_name
+    
+    def _refresh_agent(self):
+        """Rebuild the agent when the API key rotated or the context cache it uses expired"""
+        api_key = self.api_key_manager.get_current_key()
+        if api_key != self.agent_api_key or (self.context_caching and
+                get_context_cache(api_key, self.shared_prompt_prefix) != self.context_cache_name):
+            self._build_agent()
     
         # Fix 1: Complete the _fix_tool_input method which is cut off
     def _fix_tool_input(self, action_input: Any) -> Any:
@@ -651,13 +969,13 @@ class VivaExaminationAgent:
         
         return action_input
     
-    def get_conversation_history_text(self) -> str:
-     """Get formatted conversation history"""
+    def get_conversation_history_text(self, limit: int = 10) -> str:
+     """Get formatted conversation history, limited to the last `limit` entries (None for all)"""
      if not self.conversation_history:
         return "No conversation yet."
     
     # Use the last few exchanges to prevent context overflow
-     recent_history = self.conversation_history[-10:] if len(self.conversation_history) > 10 else self.conversation_history
+     recent_history = self.conversation_history[-limit:] if limit and len(self.conversation_history) > limit else self.conversation_history
     
      history_text = ""
      for entry in recent_history:
@@ -691,7 +1009,7 @@ class VivaExaminationAgent:
                 return f"IMPORTANT: Use the task_generator tool now. {remaining_tasks} tasks remaining that must be assigned."
         
         # Default state
-        return "Continue the examination with appropriate theoretical questions."
+        return DEFAULT_EXAM_STATE
     
     def extract_task_description(self) -> str:
         """Extract the most recent task description from conversation history"""
@@ -706,7 +1024,8 @@ class VivaExaminationAgent:
         if "```" in message:
             parts = message.split("```")
             if len(parts) >= 3:  # At least one complete code block
-                return parts[1].strip()
+                # Drop the language identifier of fenced blocks like ```python
+                return re.sub(r'^[A-Za-z0-9_+-]*\n', '', parts[1], count=1).strip()
         
         # If no code blocks but SQL keywords exist, return the whole message
         if any(kw in message.upper() for kw in ["SELECT", "INSERT", "UPDATE", "DELETE", "CREATE", "ALTER"]):
@@ -718,6 +1037,141 @@ class VivaExaminationAgent:
             
         return message.strip()
     
+    def start_speculation(self):
+        """Generate candidate next questions in the background while the student answers"""
+        self.discard_speculation()
+        if self.speculative_candidates <= 0:
+            return
+        
+        question_input = json.dumps({
+            "conversation_history": self.get_conversation_history_text(),
+            "subject": self.subject,
+            "syllabus": self.syllabus,
+            "difficulty": self.difficulty,
+            "teacher_notes": self.teacher_notes
+        })
+        self.speculation = {
+            # Candidates are only valid for the answer to the question that was just asked
+            "history_length": len(self.conversation_history),
+            "question": self.conversation_history[-1]['content'] if self.conversation_history else "",
+            "futures": [
+                background_executor.submit(self.viva_question_tool._run, question_input)
+                for _ in range(self.speculative_candidates)
+            ]
+        }
+    
+    def discard_speculation(self):
+        """Drop any pending speculative candidates"""
+        if self.speculation:
+            for future in self.speculation["futures"]:
+                future.cancel()
+        self.speculation = None
+    
+    def take_speculative_question(self, answer: str) -> str:
+        """Pick a finished speculative candidate that fits the student's answer, or None"""
+        speculation = self.speculation
+        self.speculation = None
+        # Exactly one message (the answer) must have been added since the candidates were requested
+        if not speculation or speculation["history_length"] != len(self.conversation_history) - 1:
+            return None
+        
+        candidates = []
+        for future in speculation["futures"]:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                candidates.append(self.clean_response(future.result()))
+            else:
+                future.cancel()
+        
+        # A struggling student needs an adapted question, which the candidates couldn't anticipate
+        answer_words = content_words(answer)
+        if not candidates or len(answer_words) < 3 or NON_ANSWER_PATTERN.search(answer):
+            return None
+        
+        question_words = content_words(speculation["question"])
+        context_words = answer_words | question_words
+        best_question, best_score = None, 0.0
+        for candidate in candidates:
+            candidate_words = content_words(candidate)
+            if len(candidate) < 10 or not candidate_words:
+                continue
+            # Skip candidates that just repeat the question the student answered
+            if len(candidate_words & question_words) / len(candidate_words | question_words) > 0.7:
+                continue
+            score = len(candidate_words & context_words) / len(candidate_words)
+            if score > best_score:
+                best_question, best_score = candidate, score
+        
+        if best_score < self.speculative_min_relevance:
+            return None
+        print(f"Using speculative question (relevance {best_score:.2f})")
+        return best_question
+    
+    def assign_task(self, task_description: str):
+        """Remember the task the student is working on and prepare its test fixture in the background"""
+        self.current_task = task_description
+        background_executor.submit(self.code_evaluator.get_fixture, task_description)
+    
+    def evaluate_task_submission(self, message: str) -> dict:
+        """Grade the student's answer to the current task locally, returns None if it can't be graded"""
+        if not self.current_task:
+            return None
+        
+        task_description = self.current_task
+        self.current_task = None
+        try:
+            evaluation = self.code_evaluator.evaluate(task_description, self.extract_code_submission(message))
+        except Exception as e:
+            print(f"Error evaluating task submission: {str(e)}")
+            return None
+        
+        if evaluation:
+            self.task_results.append({"task": task_description, "evaluation": evaluation})
+        return evaluation
+    
+    def _generate_task_fixture(self, task_description: str) -> dict:
+        """Ask the LLM once for deterministic test cases for a task, returns None for non-code tasks"""
+        template = """
+        You are writing automated tests for a practical task given in a viva examination.
+        
+        Task: {task_description}
+        
+        If the task asks the student to write a Python function, return a JSON object:
+        {{"language": "python", "entry_point": "<function name the student is asked to write>",
+          "cases": [{{"args": [<positional arguments>], "expected": <expected return value>}}]}}
+        
+        If the task asks the student to write a SQL query, return a JSON object:
+        {{"language": "sql", "setup": "<SQLite CREATE TABLE and INSERT statements for sample data>",
+          "expected_rows": [[<row values>]], "ordered": <true only if the task requires an ORDER BY>}}
+        
+        If the task cannot be checked automatically (theory, design, explanation), return {{"language": "none"}}.
+        
+        Use 3-6 small, unambiguous cases that only use JSON values. Return only the JSON object.
+        """
+        
+        prompt = PromptTemplate(input_variables=["task_description"], template=template)
+        chain = LLMChain(llm=llm_for_key(self.llm, self.api_key_manager.get_current_key()), prompt=prompt)
+        
+        try:
+            raw_fixture = chain.run(task_description=task_description)
+        except Exception as e:
+            # If error occurs, force rotate key and try again
+            llm = llm_for_key(self.llm, self.api_key_manager.rotate_key(force=True))
+            raw_fixture = LLMChain(llm=llm, prompt=prompt).run(task_description=task_description)
+        
+        raw_fixture = re.sub(r'```(?:json)?\n?', '', raw_fixture).replace('```', '').strip()
+        try:
+            fixture = json.loads(raw_fixture)
+        except json.JSONDecodeError as e:
+            print(f"Fixture JSON parse error: {e}")
+            return None
+        
+        if not isinstance(fixture, dict):
+            return None
+        if fixture.get("language") == "python" and fixture.get("entry_point") and fixture.get("cases"):
+            return fixture
+        if fixture.get("language") == "sql" and "expected_rows" in fixture:
+            return fixture
+        return None
     
     def clean_response(self, response: str) -> str:
       """Clean the response from any tool artifacts or debugging info"""
@@ -763,9 +1217,40 @@ class VivaExaminationAgent:
     
       return response.strip() 
     
+    def is_viva_over(self) -> bool:
+        """Whether the maximum number of questions has been asked"""
+        num_assistant_messages = sum(1 for entry in self.conversation_history if entry['role'] == 'Assistant')
+        return num_assistant_messages >= self.max_questions
+    
+    def end_viva(self):
+        """Stop background question generation and start building the evaluation report"""
+        self.discard_speculation()
+        self.start_report_generation()
+    
+    def process_message_stream(self, message: str) -> dict:
+        """
+        Process a message like process_message, with the reply as a "stream" of text chunks
+        instead of a "message"
+
+        The closing message is streamed as the model writes it, other replies come as one
+        chunk. The evaluation report starts when the viva ends, whether or not the stream
+        is read.
+        """
+        if not self.is_viva_over():
+            result = self.process_message(message)
+            reply = result.pop("message")
+            return {**result, "stream": iter([reply])}
+        
+        self.conversation_history.append({
+            "role": "User",
+            "content": message
+        })
+        self.end_viva()
+        return {"stream": self.stream_conclusion(), "isTask": False, "isComplete": True}
+    
         # Fix 2: Update process_message method to include total_tasks parameter
     def process_message(self, message: str) -> dict:
-     """Process an incoming message from the student"""
+     """Process an incoming message from the student, see process_message_stream to stream the closing message"""
     # Add message to conversation history
      self.conversation_history.append({
         "role": "User",
@@ -773,48 +1258,51 @@ class VivaExaminationAgent:
     })
         
     # Check if we've reached the maximum questions
-     num_assistant_messages = sum(1 for entry in self.conversation_history if entry['role'] == 'Assistant')
-     if num_assistant_messages >= self.max_questions:
-        # Use end_interview tool directly
-        end_input = {
-            "conversation_history": self.get_conversation_history_text(),
-            "student_name": self.student_name,
-            "subject": self.subject
-        }
-        conclusion = self.end_interview_tool._run(json.dumps(end_input))
-        
-        # Add response to conversation history
-        self.conversation_history.append({
-            "role": "Assistant",
-            "content": conclusion
-        })
-        return {"message": conclusion, "isTask": False}
+     if self.is_viva_over():
+        # Use end_interview tool directly; the detailed report doesn't wait for the conclusion
+        self.end_viva()
+        return {"message": "".join(self.stream_conclusion()), "isTask": False, "isComplete": True}
         
     # Determine current state
      current_state = self.determine_current_state()
+     
+    # Grade a pending task submission locally before the examiner responds
+     evaluation = self.evaluate_task_submission(message)
+     if evaluation:
+        current_state += (f" The student's submission for the last task was graded automatically: "
+                          f"{self.code_evaluator.summarize(evaluation)}. Briefly acknowledge the result before continuing.")
      print(f"Current state: {current_state}")
+     
+    # Reuse a question pre-generated while the student was answering, if one still fits
+     if current_state == DEFAULT_EXAM_STATE and not evaluation:
+        speculative_question = self.take_speculative_question(message)
+        if speculative_question:
+            self.conversation_history.append({
+                "role": "Assistant",
+                "content": speculative_question
+            })
+            self.start_speculation()
+            return {"message": speculative_question, "isTask": False}
+     self.discard_speculation()
         
     # Prepare inputs for the agent
+    # Student, subject, syllabus and notes are already in the session part of the prompt
      inputs = {
-        "student_name": self.student_name,
-        "student_info": self.student_info,
-        "subject": self.subject,
         "conversation_history": self.get_conversation_history_text(),
-        "syllabus": self.syllabus,
-        "difficulty": self.difficulty,
-        "teacher_notes": self.teacher_notes,
         "current_state": current_state,
-        "input": message,
-        "total_tasks": self.total_tasks,
-        "tasks": self.total_tasks
+        "input": message
     }
     
     # Execute the agent to get response
      try:
+        self._refresh_agent()
         response = self.agent_executor.invoke(inputs)
         
         # Extract the response from the agent
         agent_response = response.get("output", "")
+        # With max_iterations=1 the executor reports hitting the limit instead of an answer
+        if agent_response.startswith("Agent stopped"):
+            agent_response = ""
         cleaned_response = self.clean_response(agent_response)
         
         # Check if task_generator tool was used
@@ -822,7 +1310,8 @@ class VivaExaminationAgent:
         used_tool = None
         if "intermediate_steps" in response:
             for step in response["intermediate_steps"]:
-                if len(step) >= 2 and hasattr(step[0], 'tool'):
+                # "_Exception" steps carry the parser's error message, never show it to the student
+                if len(step) >= 2 and hasattr(step[0], 'tool') and step[0].tool != "_Exception":
                     used_tool = step[0].tool
                     if used_tool == "task_generator":
                         is_task = True
@@ -849,7 +1338,15 @@ class VivaExaminationAgent:
             "content": cleaned_response
         })
         
-        return {"message": cleaned_response, "isTask": is_task}
+        if is_task:
+            self.assign_task(cleaned_response)
+        else:
+            self.start_speculation()
+        
+        result = {"message": cleaned_response, "isTask": is_task}
+        if evaluation:
+            result["evaluation"] = evaluation
+        return result
         
      except Exception as e:
         print(f"Error processing message: {str(e)}")
@@ -878,6 +1375,61 @@ class VivaExaminationAgent:
                 })
                 return {"message": error_msg, "isTask": False}
         
+    def stream_conclusion(self) -> Iterator[str]:
+        """
+        Stream the closing message to the student
+
+        Its conversation history entry is added right away and filled in as the
+        stream is read, so it exists even if the caller never reads the stream.
+        """
+        end_input = {
+            "conversation_history": self.get_conversation_history_text(),
+            "student_name": self.student_name,
+            "subject": self.subject
+        }
+        entry = {"role": "Assistant", "content": ""}
+        self.conversation_history.append(entry)
+        return self._stream_into(entry, json.dumps(end_input))
+    
+    def _stream_into(self, entry: dict, end_input: str) -> Iterator[str]:
+        """Yield the conclusion chunks, appending them to a conversation history entry"""
+        for chunk in self.end_interview_tool.stream_conclusion(end_input):
+            entry["content"] = (entry["content"] + chunk).lstrip()
+            yield chunk
+        entry["content"] = entry["content"].strip()
+    
+    def start_report_generation(self):
+        """Build the detailed evaluation report in the background so ending the viva never waits on it"""
+        if self.report_future is None:
+            self.report_future = background_executor.submit(
+                self.report_generator.generate,
+                student_name=self.student_name,
+                subject=self.subject,
+                syllabus=self.syllabus,
+                teacher_notes=self.teacher_notes,
+                conversation_history=self.get_conversation_history_text(limit=None),
+                task_results="\n".join(
+                    f"- {result['task']}: {self.code_evaluator.summarize(result['evaluation'])}"
+                    for result in self.task_results
+                )
+            )
+        return self.report_future
+    
+    def get_report(self, timeout: float = 0) -> dict:
+        """Get the evaluation report, waiting at most `timeout` seconds for it to finish"""
+        if self.report_future is None:
+            return {"status": "not_started"}
+        
+        try:
+            report = self.report_future.result(timeout=timeout)
+        except FutureTimeoutError:
+            return {"status": "pending"}
+        except Exception as e:
+            print(f"Error generating evaluation report: {str(e)}")
+            return {"status": "failed", "error": str(e)}
+        
+        return {"status": "ready", "report": report}
+        
         # Rest of the exception handling code remains the same
     def start_viva(self) -> dict:  # Changed return type to dict
         """Start the viva examination with an introduction"""
@@ -923,6 +1475,7 @@ class VivaExaminationAgent:
                 "role": "Assistant",
                 "content": intro_message
             })
+            self.start_speculation()
             
             return {"message": intro_message, "isTask": False}
         except Exception as e:
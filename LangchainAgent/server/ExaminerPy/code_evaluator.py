@@ -0,0 +1,444 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import hmac
+import secrets
+import shutil
+import signal
+import sqlite3
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Future
+from typing import List, Dict, Any, Callable, Optional
+
+SQL_KEYWORDS = ["SELECT", "INSERT", "UPDATE", "DELETE", "CREATE", "ALTER", "WITH", "DROP"]
+
+# Authorizer actions a submission may not use: ATTACH (also used by VACUUM INTO) and
+# DETACH open files on the host, PRAGMA can change how the database is stored
+SQL_DENIED_ACTIONS = {sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH, sqlite3.SQLITE_PRAGMA}
+
+# Harness executed in the sandboxed interpreter. It reads the submission and the test inputs
+# from stdin so nothing from the student ends up on the command line. It only reports the
+# outputs of the submission: the expected values never reach the child process, and the
+# parent compares them itself. Outputs go to a dedicated pipe rather than stdout, tagged
+# with a nonce of the run, so whatever the submission prints cannot pass for a result.
+PYTHON_HARNESS = """
+import os, sys, json, io, contextlib, traceback
+payload = json.loads(sys.stdin.read())
+os.chdir(payload["workdir"])
+# Limits are set here rather than in a preexec_fn, which is not safe in a threaded server
+try:
+    import resource
+    for name, limit in payload["limits"].items():
+        resource.setrlimit(getattr(resource, name), (limit, limit))
+except ImportError:
+    pass
+result_file = os.fdopen(payload["result_fd"], "w")
+def report(error, outputs):
+    result_file.write(json.dumps({"nonce": payload["nonce"], "error": error, "outputs": outputs}))
+    result_file.close()
+namespace = {"__name__": "__submission__"}
+outputs = []
+try:
+    with contextlib.redirect_stdout(io.StringIO()):
+        exec(compile(payload["code"], "<submission>", "exec"), namespace)
+except BaseException:
+    report(traceback.format_exc(limit=2), [])
+    sys.exit(0)
+func = namespace.get(payload["entry_point"]) if payload["entry_point"] else None
+for case in payload["cases"]:
+    try:
+        if func is None:
+            raise NameError("function %r is not defined" % payload["entry_point"])
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            actual = func(*case["args"], **case["kwargs"])
+        if actual is None and case["stdout"]:
+            actual = stdout.getvalue().strip()
+        # Round-trip through JSON so tuples compare equal to the lists stored in the fixture
+        actual = json.loads(json.dumps(actual))
+    except BaseException as e:
+        outputs.append({"error": "%s: %s" % (type(e).__name__, e)})
+        continue
+    outputs.append({"actual": actual})
+report(None, outputs)
+"""
+
+# Unprivileged user (nobody) the sandboxes run submissions as
+SANDBOX_UID = 65534
+
+# Run by the unshare sandbox as root in new mount, pid and network namespaces: builds a root
+# of read-only system directories and the empty working directory, then drops to
+# SANDBOX_UID in it. Arguments: root mount point, working directory, paths to expose, "--",
+# the command
+UNSHARE_SANDBOX_SCRIPT = """
+root=$1; work=$2; shift 2
+mount -t tmpfs -o size=1m,mode=0755 sandbox "$root" || exit 1
+while [ "$1" != "--" ]; do
+    if [ -L "$1" ]; then
+        ln -s "$(readlink "$1")" "$root$1"
+    elif [ -e "$1" ]; then
+        if [ -d "$1" ]; then mkdir -p "$root$1"; else mkdir -p "$root${1%/*}" && touch "$root$1"; fi
+        mount --bind "$1" "$root$1" && mount -o remount,bind,ro "$root$1" || exit 1
+    fi
+    shift
+done
+shift
+mkdir -p "$root/work" "$root/proc" "$root/dev"
+mount --bind "$work" "$root/work" && mount -t proc proc "$root/proc" || exit 1
+touch "$root/dev/null" && mount --bind /dev/null "$root/dev/null" || exit 1
+exec chroot --userspec=$SANDBOX_UID:$SANDBOX_UID --groups=$SANDBOX_UID "$root" "$@"
+"""
+
+
+def detect_sandbox() -> Optional[str]:
+    """
+    Best available isolation for Python submissions: "bwrap" (bubblewrap), "unshare"
+    (util-linux, needs root) or None when neither can run here
+    """
+    if shutil.which("bwrap"):
+        return "bwrap"
+    if hasattr(os, "geteuid") and os.geteuid() == 0 and all(
+            shutil.which(tool) for tool in ("unshare", "chroot", "setpriv")):
+        return "unshare"
+    return None
+
+
+def sandbox_paths() -> List[str]:
+    """Host paths exposed read-only to submissions: system libraries and the interpreter"""
+    paths = ["/usr", "/bin", "/lib", "/lib32", "/lib64", "/etc/ld.so.cache"]
+    for prefix in (sys.base_prefix, sys.prefix):
+        if prefix not in paths:
+            paths.append(prefix)
+    return paths
+
+
+class CodeEvaluator:
+    """Grades viva task submissions locally against cached per-task test fixtures.
+
+    A fixture is a dict in one of two shapes:
+
+    Python::
+
+        {"language": "python", "entry_point": "reverse_words",
+         "cases": [{"args": ["a b"], "expected": "b a"}]}
+
+    SQL::
+
+        {"language": "sql", "setup": "CREATE TABLE t(x); INSERT INTO t VALUES (1);",
+         "expected_rows": [[1]], "ordered": false}
+
+    Fixtures are keyed by the task description. When no fixture was registered for a task,
+    `fixture_factory` (e.g. a single LLM call) is asked once and the result is cached, so
+    every later submission for that task is graded without another LLM round-trip.
+
+    Python submissions run in a sandbox with no network, no view of the host's files and
+    no permission to start processes: `sandbox` is "bwrap", "unshare" or "none" (no
+    isolation, for trusted local use only). The default is the CODE_SANDBOX environment
+    variable, or the best one available (see detect_sandbox). Without a sandbox Python
+    submissions are not run and evaluate returns None, so the caller grades with the LLM.
+    """
+
+    def __init__(self, fixture_factory: Optional[Callable[[str], Optional[dict]]] = None,
+                 timeout: float = 5.0, memory_limit_mb: int = 256, sql_max_steps: int = 5_000_000,
+                 sandbox: Optional[str] = None):
+        self.fixture_factory = fixture_factory
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.sql_max_steps = sql_max_steps
+        self.sandbox = sandbox or os.environ.get("CODE_SANDBOX") or detect_sandbox()
+        if self.sandbox not in ("bwrap", "unshare", "none", None):
+            raise ValueError(f"Unknown sandbox '{self.sandbox}', expected bwrap, unshare or none")
+        if self.sandbox is None:
+            print("No sandbox (bwrap, or unshare as root) available: Python tasks are graded by the LLM")
+        self._fixtures: Dict[str, Optional[dict]] = {}
+        # Fixtures being created, so concurrent callers wait instead of asking the factory again
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def task_key(task_description: str) -> str:
+        """Stable cache key for a task description"""
+        normalized = " ".join(task_description.lower().split())
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def register_fixture(self, task_description: str, fixture: dict):
+        """Register a known fixture (e.g. supplied by the teacher) for a task"""
+        with self._lock:
+            self._fixtures[self.task_key(task_description)] = fixture
+
+    def get_fixture(self, task_description: str) -> Optional[dict]:
+        """Get the cached fixture for a task, creating it with the fixture factory on first use"""
+        key = self.task_key(task_description)
+        with self._lock:
+            if key in self._fixtures:
+                return self._fixtures[key]
+            pending = self._pending.get(key)
+            if pending is None:
+                future = self._pending[key] = Future()
+        if pending is not None:
+            return pending.result()
+
+        fixture = None
+        if self.fixture_factory is not None:
+            try:
+                fixture = self.fixture_factory(task_description)
+            except Exception as e:
+                print(f"Error creating fixture for task: {str(e)}")
+
+        with self._lock:
+            # Cache failures too, so a task without usable fixtures is not retried every submission
+            fixture = self._fixtures.setdefault(key, fixture)
+            del self._pending[key]
+        future.set_result(fixture)
+        return fixture
+
+    def detect_language(self, code: str) -> str:
+        """Guess whether a submission is SQL or Python"""
+        stripped = code.lstrip().upper()
+        if any(stripped.startswith(kw) for kw in SQL_KEYWORDS):
+            return "sql"
+        return "python"
+
+    def evaluate(self, task_description: str, code: str) -> Optional[dict]:
+        """
+        Evaluate a submission for a task.
+
+        Returns None when no fixture is available for the task (the caller should fall back to
+        the LLM), otherwise a dict with language, passed, total, score, error and details.
+        """
+        fixture = self.get_fixture(task_description)
+        if not fixture:
+            return None
+
+        language = fixture.get("language") or self.detect_language(code)
+        if language != "sql" and self.sandbox is None:
+            return None
+        start = time.perf_counter()
+        if language == "sql":
+            result = self.evaluate_sql(code, fixture)
+        else:
+            result = self.evaluate_python(code, fixture)
+        result["language"] = language
+        result["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return result
+
+    def _limits(self) -> Dict[str, int]:
+        """Resource limits the harness sets on itself: CPU time, memory, no file writes or new processes"""
+        cpu_seconds = max(1, int(self.timeout))
+        return {
+            "RLIMIT_CPU": cpu_seconds,
+            "RLIMIT_AS": self.memory_limit_mb * 1024 * 1024,
+            "RLIMIT_FSIZE": 0,
+            "RLIMIT_NPROC": 0
+        }
+
+    def _sandbox_command(self, root: str, workdir: str) -> tuple:
+        """Command running the harness in the sandbox, and the harness's working directory in it"""
+        # -I: isolated mode, ignores PYTHON* env vars and the user site directory
+        python = [sys.executable, "-I", "-c", PYTHON_HARNESS]
+        if self.sandbox == "bwrap":
+            command = ["bwrap", "--unshare-all", "--unshare-user", "--uid", str(SANDBOX_UID),
+                       "--gid", str(SANDBOX_UID), "--die-with-parent", "--new-session"]
+            for path in sandbox_paths():
+                command += ["--ro-bind-try", path, path]
+            command += ["--proc", "/proc", "--dev", "/dev", "--bind", workdir, "/work",
+                        "--clearenv", "--setenv", "PATH", "/usr/bin:/bin", "--"]
+            return command + python, "/work"
+        if self.sandbox == "unshare":
+            command = ["unshare", "--net", "--ipc", "--uts", "--pid", "--fork", "--kill-child",
+                       "--mount", "--mount-proc", "--", "sh", "-c", UNSHARE_SANDBOX_SCRIPT,
+                       "sandbox", root, workdir, *sandbox_paths(), "--", "setpriv", "--no-new-privs"]
+            return command + python, "/work"
+        return python, workdir
+
+    @staticmethod
+    def _kill_group(process: subprocess.Popen):
+        """Kill whatever is left of a submission's process group"""
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def evaluate_python(self, code: str, fixture: dict) -> dict:
+        """Run a Python submission against the fixture's test cases in a sandboxed, resource-limited subprocess"""
+        cases = fixture.get("cases", [])
+        nonce = secrets.token_hex(16)
+        read_fd, write_fd = os.pipe()
+
+        # Read the result pipe while the child runs, so a large result cannot fill it and block
+        result_chunks = []
+        def read_result():
+            with os.fdopen(read_fd, "rb") as result_pipe:
+                result_chunks.append(result_pipe.read())
+        reader = threading.Thread(target=read_result, daemon=True)
+        reader.start()
+
+        with tempfile.TemporaryDirectory(prefix="viva-eval-") as tmpdir:
+            # An empty working directory, and the mount point of the sandbox's root
+            workdir, root = os.path.join(tmpdir, "work"), os.path.join(tmpdir, "root")
+            os.mkdir(workdir, 0o755)
+            os.mkdir(root)
+            command, sandbox_workdir = self._sandbox_command(root, workdir)
+            payload = json.dumps({
+                "code": code,
+                "entry_point": fixture.get("entry_point"),
+                # Only the inputs: the expected values stay in this process
+                "cases": [{"args": case.get("args", []), "kwargs": case.get("kwargs", {}),
+                           "stdout": "expected_output" in case} for case in cases],
+                "nonce": nonce,
+                "result_fd": write_fd,
+                "workdir": sandbox_workdir,
+                "limits": self._limits()
+            })
+
+            # Files rather than pipes, so a process left behind by the submission cannot
+            # keep this side waiting for the end of its output
+            with open(os.path.join(tmpdir, "payload.json"), "w+") as stdin, \
+                    open(os.path.join(tmpdir, "stderr.txt"), "w+") as stderr_file:
+                stdin.write(payload)
+                stdin.seek(0)
+                try:
+                    process = subprocess.Popen(
+                        command,
+                        stdin=stdin,
+                        stdout=subprocess.DEVNULL,
+                        stderr=stderr_file,
+                        cwd=workdir,
+                        env={"PATH": os.environ.get("PATH", ""), "SANDBOX_UID": str(SANDBOX_UID)},
+                        pass_fds=(write_fd,),
+                        # Its own process group, so everything it started can be killed with it
+                        start_new_session=True
+                    )
+                except OSError as e:
+                    os.close(write_fd)
+                    return self._result(cases, [], error=f"Could not start the sandbox: {e}")
+                os.close(write_fd)
+
+                try:
+                    process.wait(timeout=self.timeout)
+                except subprocess.TimeoutExpired:
+                    return self._result(cases, [], error=f"Timed out after {self.timeout} seconds")
+                finally:
+                    # Leftover processes would keep the result pipe open
+                    self._kill_group(process)
+                    process.wait()
+                    reader.join(timeout=1)
+                stderr_file.seek(0)
+                stderr = stderr_file.read().strip()[-500:]
+        if process.returncode != 0:
+            return self._result(cases, [], error=stderr or f"Process exited with code {process.returncode}")
+        try:
+            output = json.loads(result_chunks[0].decode("utf-8"))
+            if not hmac.compare_digest(str(output.get("nonce")), nonce):
+                raise ValueError("result not written by the harness")
+        except (IndexError, UnicodeDecodeError, ValueError, AttributeError):
+            return self._result(cases, [], error=stderr or "The submission did not let the tests finish")
+
+        results = []
+        for case, case_output in zip(cases, output.get("outputs") or []):
+            expected = case.get("expected", case.get("expected_output"))
+            if not isinstance(case_output, dict) or "actual" not in case_output:
+                error = case_output.get("error") if isinstance(case_output, dict) else None
+                results.append({"passed": False, "error": str(error or "No output")})
+                continue
+            actual = case_output["actual"]
+            results.append({"passed": actual == expected, "actual": actual, "expected": expected})
+        return self._result(cases, results, error=output.get("error"))
+
+    def evaluate_sql(self, code: str, fixture: dict) -> dict:
+        """Run a SQL submission against an in-memory SQLite database seeded by the fixture"""
+        connection = sqlite3.connect(":memory:")
+        deadline = time.monotonic() + self.timeout
+        # Abort runaway queries; the handler is polled every 10k virtual machine instructions
+        steps = [0]
+
+        def check_budget():
+            steps[0] += 10_000
+            return 1 if steps[0] > self.sql_max_steps or time.monotonic() > deadline else 0
+
+        connection.set_progress_handler(check_budget, 10_000)
+
+        try:
+            if fixture.get("setup"):
+                connection.executescript(fixture["setup"])
+
+            # Only the trusted fixture setup may touch anything but the in-memory database
+            connection.setlimit(sqlite3.SQLITE_LIMIT_ATTACHED, 0)
+            connection.set_authorizer(self._authorize_sql)
+
+            statements = self._split_sql(code)
+            if not statements:
+                return self._result([None], [], error="No SQL statement found")
+
+            cursor = connection.cursor()
+            for statement in statements[:-1]:
+                cursor.execute(statement)
+            cursor.execute(statements[-1])
+            rows = [list(row) for row in cursor.fetchall()]
+
+            # Statements that modify data are checked through a follow-up query
+            if fixture.get("check_query"):
+                rows = [list(row) for row in connection.execute(fixture["check_query"]).fetchall()]
+        except sqlite3.Error as e:
+            return self._result([None], [], error=f"{type(e).__name__}: {e}")
+        finally:
+            connection.close()
+
+        expected = [list(row) for row in fixture.get("expected_rows", [])]
+        if fixture.get("ordered", False):
+            passed = rows == expected
+        else:
+            passed = sorted(map(repr, rows)) == sorted(map(repr, expected))
+
+        return self._result([None], [{"passed": passed, "actual": rows, "expected": expected}])
+
+    @staticmethod
+    def _authorize_sql(action, arg1, arg2, database, source):
+        """SQLite authorizer of submissions: no attached files, pragmas or extension loading"""
+        if action in SQL_DENIED_ACTIONS:
+            return sqlite3.SQLITE_DENY
+        if action == sqlite3.SQLITE_FUNCTION and arg2 == "load_extension":
+            return sqlite3.SQLITE_DENY
+        return sqlite3.SQLITE_OK
+
+    def _split_sql(self, code: str) -> List[str]:
+        """Split a script into complete statements without breaking on semicolons inside strings"""
+        statements = []
+        current = ""
+        for part in code.split(";"):
+            current += part + ";"
+            if sqlite3.complete_statement(current):
+                if current.strip(" \n\t;"):
+                    statements.append(current.strip())
+                current = ""
+        if current.strip(" \n\t;"):
+            statements.append(current.strip())
+        return statements
+
+    def _result(self, cases: List[Any], results: List[dict], error: Optional[str] = None) -> dict:
+        total = len(cases)
+        passed = sum(1 for r in results if r.get("passed"))
+        return {
+            "passed": passed,
+            "total": total,
+            "score": round(passed / total * 100) if total else 0,
+            "error": error,
+            "details": results
+        }
+
+    def summarize(self, result: dict) -> str:
+        """One-line summary of an evaluation result that can be passed to the examiner prompt"""
+        summary = f"{result['passed']}/{result['total']} automated checks passed ({result['language']})"
+        if result.get("error"):
+            summary += f"; error: {result['error'].strip().splitlines()[-1]}"
+        else:
+            failed = [d for d in result["details"] if not d.get("passed")]
+            if failed and "actual" in failed[0]:
+                summary += f"; e.g. expected {failed[0]['expected']!r} but got {failed[0]['actual']!r}"
+            elif failed and failed[0].get("error"):
+                summary += f"; e.g. {failed[0]['error']}"
+        return summary
@@ -0,0 +1,249 @@
+"""
+Benchmark the agent plumbing of VivaExaminationAgent and DoctorAgent without Gemini quota.
+
+Recorded conversations in benchmarks/conversations/ are replayed against a ScriptedChatModel
+with a configurable per-call latency, so the numbers reflect the agent/executor/tool overhead
+plus the simulated model time. Example:
+
+    python benchmarks/bench_agents.py --latency 0.05 --malformed-rate 0.2 --repeat 3
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from fake_chat_model import ScriptedChatModel
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+CONVERSATIONS_DIR = Path(__file__).resolve().parent / "conversations"
+
+# Both agents live in a module called assistant.py, so they are loaded under distinct names
+AGENT_MODULES = {
+    "viva": SERVER_DIR / "ExaminerPy" / "assistant.py",
+    "doctor": SERVER_DIR / "python" / "assistant.py",
+}
+
+
+class StageTimer(BaseCallbackHandler):
+    """Collects LLM and tool latencies, LLM call counts and ReAct parse errors per turn"""
+
+    def __init__(self):
+        self._starts = {}
+        self.turn = self._empty_turn()
+        self.background = self._empty_turn()
+        self.in_turn = False
+        self.turn_thread = None
+
+    def _empty_turn(self) -> Dict[str, Any]:
+        return {"llm_calls": 0, "llm_ms": [], "tool_ms": [], "parse_errors": 0}
+
+    def begin_turn(self):
+        self.turn = self._empty_turn()
+        self.in_turn = True
+        self.turn_thread = threading.get_ident()
+
+    def end_turn(self) -> Dict[str, Any]:
+        self.in_turn = False
+        return self.turn
+
+    def _current(self) -> Dict[str, Any]:
+        # Work on other threads or outside a turn (evaluation report, task fixtures, speculative
+        # questions) does not block the student and is kept apart
+        if self.in_turn and threading.get_ident() == self.turn_thread:
+            return self.turn
+        return self.background
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._record("llm", run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._record("llm", run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._record("tool", run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._record("tool", run_id)
+
+    def on_agent_action(self, action, *, run_id, **kwargs):
+        # handle_parsing_errors turns unparseable model output into an "_Exception" action
+        if action.tool == "_Exception":
+            self._current()["parse_errors"] += 1
+
+    def _record(self, stage: str, run_id):
+        start = self._starts.pop(run_id, None)
+        if start is None:
+            return
+        stats = self._current()
+        stats[f"{stage}_ms"].append((time.perf_counter() - start) * 1000)
+        if stage == "llm":
+            stats["llm_calls"] += 1
+
+
+def load_agent_module(kind: str):
+    path = AGENT_MODULES[kind]
+    # The viva agent imports its sibling modules (code_evaluator) by name
+    if str(path.parent) not in sys.path:
+        sys.path.insert(0, str(path.parent))
+    spec = importlib.util.spec_from_file_location(f"{kind}_assistant", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_agent(recording: Dict[str, Any], llm: ScriptedChatModel):
+    """Create the agent for a recording and return it with its start and send callables"""
+    module = load_agent_module(recording["agent"])
+    config = dict(recording.get("config", {}))
+
+    if recording["agent"] == "viva":
+        agent = module.VivaExaminationAgent(["benchmark-key"], config, llm=llm)
+        return agent, agent.start_viva, agent.process_message
+
+    image_analysis = recording.get("image_analysis", "No visual analysis available")
+    agent = module.DoctorAgent(["benchmark-key"], config, llm=llm)
+    return agent, agent.start_session, lambda message: agent.process_patient_message(message, image_analysis)
+
+
+def run_conversation(recording: Dict[str, Any], args) -> List[Dict[str, Any]]:
+    """Replay one recorded conversation and return per-turn measurements"""
+    timer = StageTimer()
+    llm = ScriptedChatModel(
+        script=recording["script"],
+        latency=args.latency,
+        jitter=args.jitter,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed,
+        callbacks=[timer],
+    )
+
+    agent, start, send = build_agent(recording, llm)
+    agent.agent_executor.verbose = args.verbose
+    agent.agent_executor.callbacks = [timer]
+    for tool in agent.tools:
+        tool.callbacks = [timer]
+
+    # The agents print debug output on every turn, which would dominate the timings
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    turns = []
+    with output:
+        for message in [None] + recording["turns"]:
+            timer.begin_turn()
+            started = time.perf_counter()
+            response = start() if message is None else send(message)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            turn = timer.end_turn()
+            turn["turn_ms"] = elapsed_ms
+            turn["response"] = response.get("message", "")
+            turns.append(turn)
+
+        # Let background work (evaluation report, task fixtures) finish so call counts are stable
+        if getattr(agent, "report_future", None) is not None:
+            agent.report_future.result(timeout=60)
+
+    if args.verbose:
+        for turn in turns:
+            print(f"  -> {turn['response'][:100]!r}")
+    return turns, timer.background
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def summarize(name: str, runs) -> Dict[str, Any]:
+    turns = [turn for run_turns, _ in runs for turn in run_turns]
+    background = [bg for _, bg in runs]
+    total_seconds = sum(turn["turn_ms"] for turn in turns) / 1000
+    turn_ms = [turn["turn_ms"] for turn in turns]
+    llm_ms = [ms for turn in turns for ms in turn["llm_ms"]]
+    tool_ms = [ms for turn in turns for ms in turn["tool_ms"]]
+    # Time spent in agent plumbing: everything that is not waiting on the model
+    overhead_ms = [turn["turn_ms"] - sum(turn["llm_ms"]) for turn in turns]
+
+    return {
+        "conversation": name,
+        "turns": len(turns),
+        "turns_per_second": len(turns) / total_seconds if total_seconds else 0.0,
+        "llm_calls_per_turn": sum(turn["llm_calls"] for turn in turns) / len(turns),
+        "background_llm_calls": sum(bg["llm_calls"] for bg in background),
+        "parse_errors": sum(turn["parse_errors"] for turn in turns),
+        "turn_ms_p50": percentile(turn_ms, 0.5),
+        "turn_ms_p95": percentile(turn_ms, 0.95),
+        "llm_ms_mean": statistics.mean(llm_ms) if llm_ms else 0.0,
+        "tool_ms_mean": statistics.mean(tool_ms) if tool_ms else 0.0,
+        "overhead_ms_mean": statistics.mean(overhead_ms) if overhead_ms else 0.0,
+    }
+
+
+def print_table(rows: List[Dict[str, Any]]):
+    columns = [
+        ("conversation", "conversation", "{}"),
+        ("turns", "turns", "{}"),
+        ("turns/s", "turns_per_second", "{:.2f}"),
+        ("llm/turn", "llm_calls_per_turn", "{:.2f}"),
+        ("bg llm", "background_llm_calls", "{}"),
+        ("parse err", "parse_errors", "{}"),
+        ("turn p50 ms", "turn_ms_p50", "{:.1f}"),
+        ("turn p95 ms", "turn_ms_p95", "{:.1f}"),
+        ("llm ms", "llm_ms_mean", "{:.1f}"),
+        ("tool ms", "tool_ms_mean", "{:.1f}"),
+        ("overhead ms", "overhead_ms_mean", "{:.1f}"),
+    ]
+    cells = [[fmt.format(row[key]) for _, key, fmt in columns] for row in rows]
+    widths = [max(len(title), *(len(c[i]) for c in cells)) for i, (title, _, _) in enumerate(columns)]
+    print("  ".join(title.ljust(w) for (title, _, _), w in zip(columns, widths)))
+    for c in cells:
+        print("  ".join(value.ljust(w) for value, w in zip(c, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the viva and doctor agents with a scripted model")
+    parser.add_argument("conversations", nargs="*", type=Path,
+                        help="Recorded conversation files (default: all in benchmarks/conversations)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per LLM call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds added to the latency")
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                        help="Probability of replacing a ReAct agent response with malformed output")
+    parser.add_argument("--repeat", type=int, default=1, help="Times to replay each conversation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Show agent output and responses")
+    args = parser.parse_args()
+
+    paths = args.conversations or sorted(CONVERSATIONS_DIR.glob("*.json"))
+    rows = []
+    for path in paths:
+        recording = json.loads(path.read_text(encoding="utf-8"))
+        runs = [run_conversation(recording, args) for _ in range(args.repeat)]
+        rows.append(summarize(path.stem, runs))
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
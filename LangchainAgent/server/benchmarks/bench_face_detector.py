@@ -0,0 +1,123 @@
+"""
+Compare face detector configurations on speed and recall.
+
+Each configuration is precision:input_size[:backend[:target]], e.g. uint8:300 or
+fp32:240x180:opencv:opencl (see face_detector.get_face_detector). Recall and precision
+are measured against --labels, a JSON file mapping image file names to lists of
+[x, y, x1, y1] boxes, or, without labels, against the detections of the first
+configuration. The fastest configuration meeting --min-recall is reported. Example:
+
+    python benchmarks/bench_face_detector.py uint8:300 uint8:240 uint8:160 fp32:300 --min-recall 0.9
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+PROCTORING_DIR = Path(__file__).resolve().parent.parent / "python" / "Proctoring-AI"
+sys.path.insert(0, str(PROCTORING_DIR))
+
+import cv2
+
+from face_detector import find_faces_batch, get_face_detector
+from face_tracker import box_iou
+
+DEFAULT_CONFIGS = ["uint8:300", "uint8:240", "uint8:160", "fp32:300"]
+
+
+def parse_config(spec):
+    """'uint8:240x180:opencv:cpu' -> get_face_detector keyword arguments"""
+    parts = spec.split(":")
+    options = {"quantized": parts[0] != "fp32", "input_size": parts[1] if len(parts) > 1 else 300}
+    if len(parts) > 2:
+        options["backend"] = parts[2]
+    if len(parts) > 3:
+        options["target"] = parts[3]
+    return options
+
+
+def match(found, expected, min_iou=0.5):
+    """Number of expected boxes matched one to one by a found box"""
+    unmatched = list(found)
+    matched = 0
+    for box in expected:
+        ious = [box_iou(box, f) for f in unmatched]
+        if ious and max(ious) >= min_iou:
+            unmatched.pop(ious.index(max(ious)))
+            matched += 1
+    return matched
+
+
+def run(spec, images, conf_threshold, repeat):
+    model = get_face_detector(**parse_config(spec))
+    detections = {name: find_faces_batch([img], model, conf_threshold)[0] for name, img in images.items()}
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for img in images.values():
+            find_faces_batch([img], model, conf_threshold)
+    ms_per_image = (time.perf_counter() - start) / (repeat * len(images)) * 1000
+    return detections, ms_per_image
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speed and recall of face detector configurations")
+    parser.add_argument("configs", nargs="*", default=DEFAULT_CONFIGS,
+                        help="precision:input_size[:backend[:target]]. Default: %(default)s")
+    parser.add_argument("--images", type=Path, default=PROCTORING_DIR / "face_detection" / "faces")
+    parser.add_argument("--labels", type=Path, help="JSON of ground truth face boxes per image file name")
+    parser.add_argument("--conf-threshold", type=float, default=0.5)
+    parser.add_argument("--min-recall", type=float, default=0.9,
+                        help="Recall the fastest configuration is picked for")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    images = {p.name: cv2.imread(str(p)) for p in sorted(args.images.glob("*")) if p.is_file()}
+    images = {name: img for name, img in images.items() if img is not None}
+    if not images:
+        parser.error(f"No images in {args.images}")
+    labels = json.loads(args.labels.read_text()) if args.labels else None
+
+    results = []
+    for spec in args.configs:
+        try:
+            detections, ms_per_image = run(spec, images, args.conf_threshold, args.repeat)
+        except (cv2.error, ValueError) as e:
+            results.append({"config": spec, "error": str(e).strip().splitlines()[-1]})
+            continue
+        if labels is None:
+            # Without ground truth, the first working configuration is the reference
+            labels = {name: faces for name, faces in detections.items()}
+            reference = spec
+        expected = sum(len(labels.get(name, [])) for name in images)
+        found = sum(len(faces) for faces in detections.values())
+        matched = sum(match(detections[name], labels.get(name, [])) for name in images)
+        results.append({
+            "config": spec,
+            "ms_per_image": ms_per_image,
+            "faces": found,
+            "recall": matched / expected if expected else 1.0,
+            "precision": matched / found if found else 1.0,
+        })
+
+    ok = [r for r in results if "error" not in r and r["recall"] >= args.min_recall]
+    best = min(ok, key=lambda r: r["ms_per_image"])["config"] if ok else None
+
+    if args.json:
+        print(json.dumps({"images": len(images), "results": results, "fastest": best}, indent=2))
+        return
+    truth = args.labels if args.labels else f"detections of {reference}" if labels else "nothing"
+    print(f"{len(images)} images, recall against {truth}")
+    print(f"{'config':<28}{'ms/image':>10}{'faces':>7}{'recall':>8}{'precision':>11}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['config']:<28}  unavailable: {r['error']}")
+            continue
+        print(f"{r['config']:<28}{r['ms_per_image']:>10.2f}{r['faces']:>7}{r['recall']:>8.2f}{r['precision']:>11.2f}")
+    print(f"Fastest with recall >= {args.min_recall}: {best or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Check the facial landmark backends against TensorFlow and compare their cost.
+
+Every backend runs on the same 128x128 face crops (faces found in --images). Landmarks
+are compared with the reference backend in crop pixels; the run fails when an fp32
+backend differs by more than --tolerance, or an int8 one by more than --int8-tolerance.
+Startup time and memory are measured in a fresh process per backend. Example:
+
+    python benchmarks/bench_landmarks.py tensorflow opencv onnxruntime onnxruntime:int8
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+PROCTORING_DIR = Path(__file__).resolve().parent.parent / "python" / "Proctoring-AI"
+sys.path.insert(0, str(PROCTORING_DIR))
+
+DEFAULT_BACKENDS = ["tensorflow", "opencv", "onnxruntime", "opencv:int8", "onnxruntime:int8"]
+
+
+def parse_backend(spec):
+    """'onnxruntime:int8' -> ('onnxruntime', True)"""
+    backend, _, variant = spec.partition(":")
+    return backend, variant == "int8"
+
+
+def load(spec):
+    from face_landmarks import get_landmark_model
+    backend, quantized = parse_backend(spec)
+    return get_landmark_model(backend=backend, quantized=quantized)
+
+
+def measure_startup(spec):
+    """Import and load time, and peak memory, of a backend in a fresh interpreter"""
+    code = (
+        "import json, resource, sys, time\n"
+        f"sys.path.insert(0, {str(PROCTORING_DIR)!r})\n"
+        f"sys.path.insert(0, {str(Path(__file__).resolve().parent)!r})\n"
+        "start = time.perf_counter()\n"
+        "from bench_landmarks import load\n"
+        f"model = load({spec!r})\n"
+        "print(json.dumps({'startup_s': time.perf_counter() - start,\n"
+        "                  'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def face_crops(image_dir, limit):
+    import cv2
+    from face_detector import find_faces, get_face_detector
+    from face_landmarks import crop_face
+
+    face_model = get_face_detector()
+    crops = []
+    for path in sorted(Path(image_dir).glob("*")):
+        img = cv2.imread(str(path))
+        if img is None:
+            continue
+        crops.extend(crop_face(img, face)[0] for face in find_faces(img, face_model))
+    return np.stack(crops[:limit]) if crops else None
+
+
+def landmarks(model, crops):
+    """Landmarks of the crops in crop pixels, shape (N, 68, 2)"""
+    return np.asarray(model.predict(crops)).reshape(len(crops), -1)[:, :136].reshape(len(crops), 68, 2) * 128
+
+
+def per_face_ms(model, crops, batch_size, repeat):
+    batches = [crops[i:i + batch_size] for i in range(0, len(crops), batch_size)]
+    model.predict(batches[0])
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for batch in batches:
+            model.predict(batch)
+    return (time.perf_counter() - start) / (repeat * len(crops)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity and latency of the facial landmark backends")
+    parser.add_argument("backends", nargs="*", default=DEFAULT_BACKENDS,
+                        help="backend[:int8], the first one is the reference. Default: all")
+    parser.add_argument("--images", type=Path, default=PROCTORING_DIR / "face_detection" / "faces",
+                        help="Directory of face images")
+    parser.add_argument("--limit", type=int, default=64, help="Most faces used")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="Largest landmark difference in crop pixels for fp32 backends")
+    parser.add_argument("--int8-tolerance", type=float, default=3.0,
+                        help="Largest landmark difference in crop pixels for int8 backends")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    crops = face_crops(args.images, args.limit)
+    if crops is None:
+        parser.error(f"No faces found in {args.images}")
+
+    results = []
+    reference = reference_spec = None
+    failed = False
+    for spec in args.backends:
+        row = {"backend": spec, **measure_startup(spec)}
+        results.append(row)
+        if "error" in row:
+            continue
+        model = load(spec)
+        marks = landmarks(model, crops)
+        if reference is None:
+            reference, reference_spec = marks, spec
+        diff = np.abs(marks - reference)
+        row["max_diff_px"] = float(diff.max())
+        row["mean_diff_px"] = float(diff.mean())
+        tolerance = args.int8_tolerance if parse_backend(spec)[1] else args.tolerance
+        row["parity"] = row["max_diff_px"] <= tolerance
+        failed |= not row["parity"]
+        row["ms_per_face_b1"] = per_face_ms(model, crops, 1, args.repeat)
+        row["ms_per_face_b8"] = per_face_ms(model, crops, 8, args.repeat)
+
+    if args.json:
+        print(json.dumps({"faces": len(crops), "results": results}, indent=2))
+    else:
+        print(f"{len(crops)} faces, reference: {reference_spec}")
+        print(f"{'backend':<18}{'startup s':>10}{'rss MB':>9}{'max px':>9}{'mean px':>9}"
+              f"{'ms/face b1':>12}{'ms/face b8':>12}  parity")
+        for row in results:
+            if "error" in row:
+                print(f"{row['backend']:<18}  unavailable: {row['error']}")
+                continue
+            print(f"{row['backend']:<18}{row['startup_s']:>10.2f}{row['max_rss_mb']:>9.0f}"
+                  f"{row['max_diff_px']:>9.3f}{row['mean_diff_px']:>9.3f}"
+                  f"{row['ms_per_face_b1']:>12.3f}{row['ms_per_face_b8']:>12.3f}  {'ok' if row['parity'] else 'FAIL'}")
+    sys.exit(1 if failed or reference is None else 0)
+
+
+if __name__ == "__main__":
+    main()
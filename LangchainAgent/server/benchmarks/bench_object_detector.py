@@ -0,0 +1,66 @@
+"""
+Compare per-frame and batched person/phone detection throughput.
+
+Frames from --images stand in for the streams of concurrent sessions. Each batch size
+runs the same frames through object_detector.detect_objects_batch; batch size 1 is the
+per-frame path. Example:
+
+    python benchmarks/bench_object_detector.py --backend ultralytics --batch-sizes 1 4 8 16
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+PROCTORING_DIR = Path(__file__).resolve().parent.parent / "python" / "Proctoring-AI"
+sys.path.insert(0, str(PROCTORING_DIR))
+
+import cv2
+
+from object_detector import detect_objects_batch, get_object_detector
+
+
+def frames_per_second(detector, frames, batch_size, repeat):
+    batches = [frames[i:i + batch_size] for i in range(0, len(frames), batch_size)]
+    detect_objects_batch(batches[0], detector=detector)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for batch in batches:
+            detect_objects_batch(batch, detector=detector)
+    return repeat * len(frames) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-frame vs batched object detection throughput")
+    parser.add_argument("--backend", default=None, help="ultralytics or keras. Default: OBJECT_DETECTOR_BACKEND")
+    parser.add_argument("--weights", default=None)
+    parser.add_argument("--input-size", type=int, default=None)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--images", type=Path, default=PROCTORING_DIR / "face_detection" / "faces")
+    parser.add_argument("--frames", type=int, default=32, help="Frames per round, images are repeated")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    images = [cv2.imread(str(p)) for p in sorted(args.images.glob("*")) if p.is_file()]
+    images = [img for img in images if img is not None]
+    if not images:
+        parser.error(f"No images in {args.images}")
+    frames = [images[i % len(images)] for i in range(args.frames)]
+
+    detector = get_object_detector(args.backend, args.weights, args.input_size)
+    results = [{"batch_size": b, "fps": frames_per_second(detector, frames, b, args.repeat)}
+               for b in args.batch_sizes]
+
+    if args.json:
+        print(json.dumps({"backend": detector.backend, "frames": len(frames), "results": results}, indent=2))
+        return
+    print(f"{detector.backend}, {len(frames)} frames, input {detector.input_size}")
+    print(f"{'batch':>6}{'frames/s':>10}{'speedup':>9}")
+    for r in results:
+        print(f"{r['batch_size']:>6}{r['fps']:>10.1f}{r['fps'] / results[0]['fps']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
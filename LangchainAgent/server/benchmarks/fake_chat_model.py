@@ -0,0 +1,92 @@
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import Field, PrivateAttr
+
+# Marker that only appears in the ReAct agent prompts (viva and doctor)
+REACT_PROMPT_MARKER = "Use the following format for your internal reasoning process"
+
+# Outputs the ReAct parser rejects, used to exercise handle_parsing_errors
+MALFORMED_REACT_OUTPUTS = [
+    "I think the student understands this well, so I'll ask something harder next.",
+    "Thought: I should use a tool\nAction: viva_question_generator",
+    "Action Input: {\"subject\": \"unknown\"}",
+    "Final answer without the expected prefix",
+]
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for ChatGoogleGenerativeAI.
+
+    Each call picks the first marker of `script` that occurs in the prompt and replays that
+    marker's responses in order (cycling when they run out). Prompts matching no marker get
+    `default_responses`. Every call sleeps for `latency` seconds (+/- `jitter`) to model the
+    network round-trip, and ReAct agent calls are replaced by malformed output with probability
+    `malformed_rate`.
+    """
+
+    script: Dict[str, List[str]] = Field(default_factory=dict)
+    default_responses: List[str] = Field(default_factory=lambda: ["Could you tell me more about that?"])
+    latency: float = 0.0
+    jitter: float = 0.0
+    malformed_rate: float = 0.0
+    seed: int = 0
+
+    _positions: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _rng: Any = PrivateAttr(default=None)
+    _call_count: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-chat"
+
+    @property
+    def call_count(self) -> int:
+        return self._call_count
+
+    def _next_response(self, prompt: str) -> Tuple[str, float]:
+        with self._lock:
+            self._call_count += 1
+            marker = next((m for m in self.script if m in prompt), None)
+            responses = self.script[marker] if marker else self.default_responses
+            position = self._positions.get(marker, 0)
+            self._positions[marker] = position + 1
+            response = responses[position % len(responses)]
+
+            if REACT_PROMPT_MARKER in prompt and self._rng.random() < self.malformed_rate:
+                response = self._rng.choice(MALFORMED_REACT_OUTPUTS)
+
+            delay = self.latency
+            if self.jitter:
+                delay = max(0.0, delay + self._rng.uniform(-self.jitter, self.jitter))
+        return response, delay
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        prompt = "\n".join(str(message.content) for message in messages)
+        response, delay = self._next_response(prompt)
+        if delay:
+            time.sleep(delay)
+
+        # Honour stop sequences the way the real API does (the ReAct agent stops at "\nObservation")
+        for stop_sequence in stop or []:
+            if stop_sequence in response:
+                response = response[:response.index(stop_sequence)]
+
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=response))])
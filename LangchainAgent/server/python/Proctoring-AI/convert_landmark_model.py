@@ -0,0 +1,152 @@
+"""
+Export the facial landmark SavedModel to ONNX, and optionally to int8
+
+The exported models are used by the 'opencv' and 'onnxruntime' backends of
+face_landmarks.get_landmark_model. Needs tensorflow and tf2onnx, plus
+onnxruntime for --int8:
+
+    python convert_landmark_model.py --int8 --calibration-dir face_detection/faces
+"""
+import argparse
+import glob
+import os
+import cv2
+import numpy as np
+from face_detector import find_faces, get_face_detector
+from face_landmarks import crop_face, pose_model
+
+# The SavedModel maps a resize to 128x128 over the uint8 'image_tensor' batch.
+# The crops already are 128x128, so the export starts at the stacked float32
+# images and stays a plain CNN that OpenCV's DNN module can run.
+INPUT_TENSOR = 'map/TensorArrayStack/TensorArrayGatherV3:0'
+OUTPUT_TENSOR = 'layer6/final_dense:0'
+
+
+def export_onnx(saved_model, onnx_file, opset=13):
+    """
+    Freeze the SavedModel and convert it to ONNX
+
+    Parameters
+    ----------
+    saved_model : string
+        Path to the landmark SavedModel
+    onnx_file : string
+        Path of the ONNX model to write
+    opset : int, optional
+        ONNX opset. The default is 13.
+
+    Returns
+    -------
+    None.
+
+    """
+    import tensorflow as tf
+    import tf2onnx
+
+    graph = tf.Graph()
+    with tf.compat.v1.Session(graph=graph) as sess:
+        tf.compat.v1.saved_model.loader.load(sess, ['serve'], saved_model)
+        frozen = tf.compat.v1.graph_util.convert_variables_to_constants(
+            sess, graph.as_graph_def(), [OUTPUT_TENSOR.split(':')[0]])
+
+    tf2onnx.convert.from_graph_def(
+        frozen,
+        input_names=[INPUT_TENSOR],
+        output_names=[OUTPUT_TENSOR],
+        shape_override={INPUT_TENSOR: [-1, 128, 128, 3]},
+        tensors_to_rename={INPUT_TENSOR: 'image', OUTPUT_TENSOR: 'output'},
+        opset=opset,
+        output_path=onnx_file)
+
+
+def calibration_crops(image_dir, limit=200):
+    """
+    Get 128x128 face crops of the images in a directory to calibrate int8 ranges
+
+    Parameters
+    ----------
+    image_dir : string
+        Directory with jpg/png images containing faces
+    limit : int, optional
+        Most crops returned. The default is 200.
+
+    Returns
+    -------
+    crops : list of np.uint8
+        RGB face crops, as fed to the landmark model
+
+    """
+    face_model = get_face_detector()
+    crops = []
+    paths = sorted(glob.glob(os.path.join(image_dir, '*.jpg')) + glob.glob(os.path.join(image_dir, '*.png')))
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        for face in find_faces(img, face_model):
+            crops.append(crop_face(img, face)[0])
+        if len(crops) >= limit:
+            break
+    return crops[:limit]
+
+
+def quantize_int8(onnx_file, int8_file, crops):
+    """
+    Statically quantize the ONNX model to int8 (QDQ format, per channel weights)
+
+    Parameters
+    ----------
+    onnx_file : string
+        fp32 ONNX model
+    int8_file : string
+        Path of the int8 model to write
+    crops : list of np.uint8
+        Face crops used to calibrate activation ranges
+
+    Returns
+    -------
+    None.
+
+    """
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    class CropReader(CalibrationDataReader):
+        def __init__(self):
+            self.batches = iter([{'image': crop[np.newaxis].astype(np.float32)} for crop in crops])
+
+        def get_next(self):
+            return next(self.batches, None)
+
+    quantize_static(onnx_file, int8_file, CropReader(),
+                    quant_format=QuantFormat.QDQ,
+                    per_channel=True,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the facial landmark model to ONNX")
+    parser.add_argument("--saved-model", default=pose_model, help="Landmark SavedModel directory")
+    parser.add_argument("--output", default=None, help="ONNX file. The default is <saved-model>.onnx")
+    parser.add_argument("--opset", type=int, default=13)
+    parser.add_argument("--int8", action="store_true", help="Also write an int8 model, <output>_int8.onnx")
+    parser.add_argument("--calibration-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                  'face_detection', 'faces'),
+                        help="Face images used to calibrate the int8 model")
+    args = parser.parse_args()
+
+    onnx_file = args.output or os.path.normpath(args.saved_model) + '.onnx'
+    export_onnx(args.saved_model, onnx_file, args.opset)
+    print(f"Wrote {onnx_file}")
+
+    if args.int8:
+        crops = calibration_crops(args.calibration_dir)
+        if not crops:
+            parser.error(f"No faces found in {args.calibration_dir} to calibrate with")
+        int8_file = onnx_file[:-len('.onnx')] + '_int8.onnx'
+        quantize_int8(onnx_file, int8_file, crops)
+        print(f"Wrote {int8_file}, calibrated on {len(crops)} faces")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,12 @@ Created on Thu Jul 30 19:21:18 2020
 
 import cv2
 import numpy as np
-from face_detector import get_face_detector, find_faces
-from face_landmarks import get_landmark_model, detect_marks
+from face_detector import find_faces
+from face_landmarks import detect_marks_batch
+from model_registry import get_model
+from overlay import render
 
-def eye_on_mask(mask, side, shape):
+def eye_on_mask(mask, side, shape, origin=(0, 0)):
     """
     Create ROI on mask of the size of eyes and also find the extreme points of each eye
 
@@ -22,17 +24,19 @@ def eye_on_mask(mask, side, shape):
         the facial landmark numbers of eyes
     shape : Array of uint32
         Facial landmarks
+    origin : tuple, optional
+        (x, y) of the mask's top left corner in the frame, when the mask only
+        covers a crop of it. The default is (0, 0).
 
     Returns
     -------
     mask : np.uint8
         Mask with region of interest drawn
     [l, t, r, b] : list
-        left, top, right, and bottommost points of ROI
+        left, top, right, and bottommost points of ROI, relative to origin
 
     """
-    points = [shape[i] for i in side]
-    points = np.array(points, dtype=np.int32)
+    points = np.array([shape[i] for i in side], dtype=np.int32) - np.array(origin, dtype=np.int32)
     mask = cv2.fillConvexPoly(mask, points, 255)
     l = points[0][0]
     t = (points[1][1]+points[2][1])//2
@@ -40,6 +44,85 @@ def eye_on_mask(mask, side, shape):
     b = (points[4][1]+points[5][1])//2
     return mask, [l, t, r, b]
 
+def eye_crop(img, side, shape):
+    """
+    Crop one eye out of the frame as a gray image
+
+    Only the bounding box of the eye landmarks (plus padding) is converted
+    and masked, instead of the whole frame.
+
+    Parameters
+    ----------
+    img : np.uint8
+        Frame the landmarks belong to. It is not modified.
+    side : list of int
+        the facial landmark numbers of the eye
+    shape : Array of uint32
+        Facial landmarks
+
+    Returns
+    -------
+    eye_gray : np.uint8
+        Gray eye ROI, pixels away from the eye are white
+    eye_mask : np.uint8
+        The eye opening (landmark polygon) in the ROI
+    origin : tuple
+        (x, y) of the ROI's top left corner in the frame
+    end_points : list
+        left, top, right, and bottommost points of the eye in ROI coordinates
+    None is returned when the eye lies outside the frame.
+
+    """
+    points = np.array([shape[i] for i in side], dtype=np.int32)
+    h, w = img.shape[:2]
+    x0 = max(int(points[:, 0].min()) - roi_padding, 0)
+    y0 = max(int(points[:, 1].min()) - roi_padding, 0)
+    x1 = min(int(points[:, 0].max()) + roi_padding + 1, w)
+    y1 = min(int(points[:, 1].max()) + roi_padding + 1, h)
+    if x1 <= x0 or y1 <= y0:
+        return None
+
+    # cvtColor of the slice allocates a small gray image; the frame is never copied
+    eye_gray = cv2.cvtColor(img[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+    eye_mask = np.zeros(eye_gray.shape, dtype=np.uint8)
+    eye_mask, end_points = eye_on_mask(eye_mask, side, shape, (x0, y0))
+    eye_gray[cv2.dilate(eye_mask, kernel) == 0] = 255
+    return eye_gray, eye_mask, (x0, y0), end_points
+
+def threshold_eye(eye_gray, threshold=75):
+    """Threshold a gray eye ROI so the eyeball is white, see process_thresh"""
+    _, thresh = cv2.threshold(eye_gray, threshold, 255, cv2.THRESH_BINARY)
+    return process_thresh(thresh)
+
+def eye_roi(img, side, shape, threshold=75):
+    """
+    Crop one eye out of the frame and threshold it to find the eyeball
+
+    Returns
+    -------
+    thresh : np.uint8
+        Processed thresholded eye ROI, the eyeball is white
+    origin : tuple
+        (x, y) of the ROI's top left corner in the frame
+    end_points : list
+        left, top, right, and bottommost points of the eye in ROI coordinates
+    None is returned when the eye lies outside the frame.
+
+    """
+    crop = eye_crop(img, side, shape)
+    if crop is None:
+        return None
+    eye_gray, _, origin, end_points = crop
+    return threshold_eye(eye_gray, threshold), origin, end_points
+
+def otsu_threshold(eye_gray, eye_mask):
+    """Otsu's threshold between the dark iris and the sclera of an eye, None for an empty eye"""
+    pixels = eye_gray[eye_mask > 0]
+    if pixels.size == 0:
+        return None
+    threshold, _ = cv2.threshold(pixels, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return threshold
+
 def find_eyeball_position(end_points, cx, cy):
     """Find and return the eyeball positions, i.e. left or right or top or normal"""
     x_ratio = (end_points[0] - cx)/(cx - end_points[2])
@@ -54,22 +137,18 @@ def find_eyeball_position(end_points, cx, cy):
         return 0
 
     
-def contouring(thresh, mid, img, end_points, right=False):
+def contouring(thresh, origin, end_points):
     """
-    Find the largest contour on an image divided by a midpoint and subsequently the eye position
+    Find the largest contour on an eye ROI and subsequently the eye position
 
     Parameters
     ----------
     thresh : Array of uint8
-        Thresholded image of one side containing the eyeball
-    mid : int
-        The mid point between the eyes
-    img : Array of uint8
-        Original Image
+        Thresholded ROI of one eye containing the eyeball
+    origin : tuple
+        (x, y) of the ROI's top left corner in the frame
     end_points : list
-        List containing the exteme points of eye
-    right : boolean, optional
-        Whether calculating for right eye or left eye. The default is False.
+        List containing the exteme points of eye in ROI coordinates
 
     Returns
     -------
@@ -79,6 +158,9 @@ def contouring(thresh, mid, img, end_points, right=False):
             1 for left
             2 for right
             3 for up
+    pupil : tuple
+        (x, y) of the eyeball center in the frame
+    None when no eyeball is found.
 
     """
     cnts, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_NONE)
@@ -87,11 +169,8 @@ def contouring(thresh, mid, img, end_points, right=False):
         M = cv2.moments(cnt)
         cx = int(M['m10']/M['m00'])
         cy = int(M['m01']/M['m00'])
-        if right:
-            cx += mid
-        cv2.circle(img, (cx, cy), 4, (0, 0, 255), 2)
         pos = find_eyeball_position(end_points, cx, cy)
-        return pos
+        return pos, (cx + origin[0], cy + origin[1])
     except:
         pass
     
@@ -149,23 +228,138 @@ def print_eye_pos(img, left, right):
         cv2.putText(img, text, (30, 30), font,  
                    1, (0, 255, 255), 2, cv2.LINE_AA) 
 
-face_model = get_face_detector()
-landmark_model = get_landmark_model()
 left = [36, 37, 38, 39, 40, 41]
 right = [42, 43, 44, 45, 46, 47]
 
-cv2.namedWindow("image")
 kernel = np.ones((9, 9), np.uint8)
+# Pixels kept around the eye landmarks: the reach of the 9x9 mask dilation
+# plus that of the erode/dilate in process_thresh
+roi_padding = 10
 
-def nothing(x):
-    pass
 
-cv2.createTrackbar("threshold", "image", 75, 255, nothing)
-def track_eye(frame):
+class EyeSession:
+    """
+    Pupil threshold calibrated to one candidate's eyes and lighting
+
+    The fixed threshold of 75 only separates the pupil from the sclera under
+    some lighting. Instead, the Otsu threshold of the eye openings is taken
+    on the first calibration_frames frames, and their median is used from
+    then on. The threshold is refreshed with one more Otsu sample, smoothed
+    into it, every refresh_every frames and right after a frame where no
+    pupil was found, so it follows lighting changes for the cost of an
+    occasional histogram of two small ROIs.
+
+    Parameters
+    ----------
+    calibration_frames : int, optional
+        Frames sampled before the threshold is fixed. The default is 10.
+    refresh_every : int, optional
+        Frames between refreshes of the calibrated threshold. The default is 100.
+    smoothing : float, optional
+        Weight of a refresh sample. The default is 0.3.
+    min_threshold : int, optional
+        Lowest threshold used. The default is 20.
+    max_threshold : int, optional
+        Highest threshold used. The default is 200.
+
+    """
+
+    def __init__(self, calibration_frames=10, refresh_every=100, smoothing=0.3,
+                 min_threshold=20, max_threshold=200):
+        self.calibration_frames = calibration_frames
+        self.refresh_every = refresh_every
+        self.smoothing = smoothing
+        self.min_threshold = min_threshold
+        self.max_threshold = max_threshold
+        self.threshold = 75
+        self.samples = []
+        self.calibrated = False
+        self.frames_since_sample = 0
+        self.missed = False
+        self.missed_frames = 0
+
+    def needs_sample(self):
+        """Whether the next frame's eyes should be sampled"""
+        return not self.calibrated or self.missed or self.frames_since_sample >= self.refresh_every
+
+    def add_sample(self, threshold):
+        """Fold an Otsu threshold into the calibration"""
+        threshold = min(max(threshold, self.min_threshold), self.max_threshold)
+        if not self.calibrated:
+            self.samples.append(threshold)
+            self.threshold = float(np.median(self.samples))
+            if len(self.samples) >= self.calibration_frames:
+                self.samples = []
+                self.calibrated = True
+        else:
+            self.threshold += self.smoothing * (threshold - self.threshold)
+        self.frames_since_sample = 0
+        self.missed = False
+
+    def threshold_for(self, crops):
+        """
+        Threshold to use for the eyes of a frame, sampling them if due
+
+        Parameters
+        ----------
+        crops : list of tuple
+            Eye crops of the frame, as returned by eye_crop
+
+        Returns
+        -------
+        threshold : float
+
+        """
+        if self.needs_sample():
+            samples = [otsu_threshold(eye_gray, eye_mask) for eye_gray, eye_mask, _, _ in crops]
+            samples = [s for s in samples if s is not None]
+            if samples:
+                self.add_sample(float(np.mean(samples)))
+        return self.threshold
+
+    def update(self, found):
+        """Count an analyzed frame; found is whether a pupil contour was found on it"""
+        self.frames_since_sample += 1
+        if not found:
+            self.missed = True
+            self.missed_frames += 1
+
+def primary_face_index(marks_list):
+    """Index of the largest face, taken as the candidate's, or None when there are no landmarks"""
+    primary, largest = None, -1.0
+    for i, marks in enumerate(marks_list):
+        if marks is None:
+            continue
+        marks = np.asarray(marks)
+        area = float(np.prod(marks.max(axis=0) - marks.min(axis=0)))
+        if area > largest:
+            primary, largest = i, area
+    return primary
+
+def track_eye_marks(img, marks_list, threshold=75, session=None):
     """
-    Track eye movements in a single frame
+    Find where the eyes are looking from already detected facial landmarks
+
+    Parameters
+    ----------
+    img : np.uint8
+        Frame the landmarks belong to. Nothing is drawn on it, see overlay.draw_eyes.
+    marks_list : list of Array of uint32
+        Facial landmarks of every face in the frame
+    threshold : int, optional
+        Gray level below which eye pixels count as the eyeball. The default is 75.
+    session : EyeSession, optional
+        Pupil threshold calibrated to the candidate, used instead of
+        threshold. Only the candidate's face (see primary_face_index)
+        calibrates and updates it. The default is None.
+
+    Returns
+    -------
+    eye_results : dict
+        Looking left/right/up/normal flags, the eyeball position of each eye
+        and the (x, y) 'pupils' found
+
     """
-    # Initialize all variables at the start
     eyeball_pos_left = 0
     eyeball_pos_right = 0
     eye_results = {
@@ -176,74 +370,121 @@ def track_eye(frame):
         'positions': {
             'left': 0,
             'right': 0
-        }
+        },
+        'pupils': []
     }
 
+    primary = primary_face_index(marks_list) if session is not None else None
+    for i, shape in enumerate(marks_list):
+        left_eye = eye_crop(img, left, shape)
+        right_eye = eye_crop(img, right, shape)
+        if session is not None:
+            if i == primary:
+                threshold = session.threshold_for([c for c in (left_eye, right_eye) if c is not None])
+            else:
+                threshold = session.threshold
+
+        # Get eye positions with error handling
+        left_pos = right_pos = None
+        try:
+            if left_eye is not None:
+                eye_gray, _, origin, end_points = left_eye
+                left_pos = contouring(threshold_eye(eye_gray, threshold), origin, end_points)
+            if left_pos is not None:
+                eyeball_pos_left, pupil = left_pos
+                eye_results['pupils'].append(pupil)
+        except Exception as e:
+            print(f"Left eye detection error: {str(e)}")
+            
+        try:
+            if right_eye is not None:
+                eye_gray, _, origin, end_points = right_eye
+                right_pos = contouring(threshold_eye(eye_gray, threshold), origin, end_points)
+            if right_pos is not None:
+                eyeball_pos_right, pupil = right_pos
+                eye_results['pupils'].append(pupil)
+        except Exception as e:
+            print(f"Right eye detection error: {str(e)}")
+
+        if session is not None and i == primary:
+            session.update(left_pos is not None and right_pos is not None)
+        
+        # Update eye_results based on positions
+        if eyeball_pos_left == eyeball_pos_right and eyeball_pos_left != 0:
+            eye_results['looking_normal'] = False
+            
+            if eyeball_pos_left == 1:
+                eye_results['looking_left'] = True
+            elif eyeball_pos_left == 2:
+                eye_results['looking_right'] = True
+            elif eyeball_pos_left == 3:
+                eye_results['looking_up'] = True
+        
+        # Always update positions in results
+        eye_results['positions']['left'] = eyeball_pos_left
+        eye_results['positions']['right'] = eyeball_pos_right
+
+    return eye_results
+
+def track_eye(frame, annotate=False):
+    """
+    Track eye movements in a single frame, returning (frame, results); the
+    frame is an annotated copy when annotate is set
+    """
     try:
-        img = frame.copy()
-        rects = find_faces(img, face_model)
+        rects = find_faces(frame, get_model("face_detector"))
         
         # If no faces detected, return early with default values
         if not rects:
-            return frame, eye_results
-
-        for rect in rects:
-            shape = detect_marks(img, landmark_model, rect)
-            mask = np.zeros(img.shape[:2], dtype=np.uint8)
-            mask, end_points_left = eye_on_mask(mask, left, shape)
-            mask, end_points_right = eye_on_mask(mask, right, shape)
-            mask = cv2.dilate(mask, kernel, 5)
-            
-            eyes = cv2.bitwise_and(img, img, mask=mask)
-            mask = (eyes == [0, 0, 0]).all(axis=2)
-            eyes[mask] = [255, 255, 255]
-            mid = int((shape[42][0] + shape[39][0]) // 2)
-            eyes_gray = cv2.cvtColor(eyes, cv2.COLOR_BGR2GRAY)
-            
-            threshold = 75
-            _, thresh = cv2.threshold(eyes_gray, threshold, 255, cv2.THRESH_BINARY)
-            thresh = process_thresh(thresh)
-            
-            # Get eye positions with error handling
-            try:
-                left_pos = contouring(thresh[:, 0:mid], mid, img, end_points_left)
-                if left_pos is not None:
-                    eyeball_pos_left = left_pos
-            except Exception as e:
-                print(f"Left eye detection error: {str(e)}")
-                
-            try:
-                right_pos = contouring(thresh[:, mid:], mid, img, end_points_right, True)
-                if right_pos is not None:
-                    eyeball_pos_right = right_pos
-            except Exception as e:
-                print(f"Right eye detection error: {str(e)}")
-            
-            # Update eye_results based on positions
-            if eyeball_pos_left == eyeball_pos_right and eyeball_pos_left != 0:
-                eye_results['looking_normal'] = False
-                
-                text = 'Normal'
-                if eyeball_pos_left == 1:
-                    eye_results['looking_left'] = True
-                    text = 'Looking left'
-                elif eyeball_pos_left == 2:
-                    eye_results['looking_right'] = True
-                    text = 'Looking right'
-                elif eyeball_pos_left == 3:
-                    eye_results['looking_up'] = True
-                    text = 'Looking up'
-                    
-                font = cv2.FONT_HERSHEY_SIMPLEX 
-                cv2.putText(img, text, (30, 30), font, 1, (0, 255, 255), 2, cv2.LINE_AA)
-            
-            # Always update positions in results
-            eye_results['positions']['left'] = eyeball_pos_left
-            eye_results['positions']['right'] = eyeball_pos_right
+            return frame, track_eye_marks(frame, [])
 
-        return img, eye_results
+        marks_list = detect_marks_batch([(frame, rect) for rect in rects], get_model("landmark_model"))
+        eye_results = track_eye_marks(frame, marks_list)
+        if annotate:
+            return render(frame, {'faces': rects, 'eyes': eye_results}), eye_results
+        return frame, eye_results
         
     except Exception as e:
         print(f"Error in eye tracking: {str(e)}")
         # Return original frame and default results if anything fails
-        return frame, eye_results
\ No newline at end of file
+        return frame, track_eye_marks(frame, [])
+
+def nothing(x):
+    pass
+
+def eye_tracker_demo(video_path=0):
+    """
+    Show the eye positions on a webcam or video, with a trackbar for the threshold
+
+    Parameters
+    ----------
+    video_path : int or string, optional
+        Camera index or video file. The default is 0.
+
+    Returns
+    -------
+    None.
+
+    """
+    face_model = get_model("face_detector")
+    landmark_model = get_model("landmark_model")
+    cap = cv2.VideoCapture(video_path)
+    cv2.namedWindow("image")
+    cv2.createTrackbar("threshold", "image", 75, 255, nothing)
+
+    while(True):
+        ret, img = cap.read()
+        if not ret:
+            break
+        rects = find_faces(img, face_model)
+        marks_list = detect_marks_batch([(img, rect) for rect in rects], landmark_model)
+        threshold = cv2.getTrackbarPos("threshold", "image")
+        eyes = track_eye_marks(img, marks_list, threshold)
+        cv2.imshow("image", render(img, {'eyes': eyes}, copy=False))
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+    cap.release()
+    cv2.destroyAllWindows()
+
+if __name__ == "__main__":
+    eye_tracker_demo()
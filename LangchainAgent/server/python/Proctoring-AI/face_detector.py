@@ -8,12 +8,79 @@ Created on Wed Jul 29 17:52:00 2020
 import cv2
 import numpy as np
 import os
+import threading
+from model_registry import register_model
+
+DEFAULT_INPUT_SIZE = (300, 300)
+
+DETECTOR_BACKENDS = {
+    'default': cv2.dnn.DNN_BACKEND_DEFAULT,
+    'opencv': cv2.dnn.DNN_BACKEND_OPENCV,
+    'inference_engine': cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE,
+    'cuda': cv2.dnn.DNN_BACKEND_CUDA
+}
+DETECTOR_TARGETS = {
+    'cpu': cv2.dnn.DNN_TARGET_CPU,
+    'opencl': cv2.dnn.DNN_TARGET_OPENCL,
+    'opencl_fp16': cv2.dnn.DNN_TARGET_OPENCL_FP16,
+    'cuda': cv2.dnn.DNN_TARGET_CUDA,
+    'cuda_fp16': cv2.dnn.DNN_TARGET_CUDA_FP16
+}
+
+class FaceDetector:
+    """
+    OpenCV DNN face detection network with the settings it is run with
+
+    Parameters
+    ----------
+    net : dnn_Net
+        Face detection network
+    input_size : tuple, optional
+        (width, height) frames are resized to. The default is DEFAULT_INPUT_SIZE.
+    can_batch : bool, optional
+        Whether the network takes multi-image blobs, otherwise batches are
+        run one image at a time. The default is True.
+
+    """
+
+    def __init__(self, net, input_size=DEFAULT_INPUT_SIZE, can_batch=True):
+        self.net = net
+        self.input_size = input_size
+        self.can_batch = can_batch
+        # A dnn_Net keeps its input and activations between setInput and forward,
+        # and the shared detector is called from many proctoring workers
+        self._lock = threading.Lock()
+
+    def forward(self, blob):
+        """Detections [image_id, label, confidence, x, y, x1, y1] of a blob batch"""
+        with self._lock:
+            if self.can_batch or len(blob) == 1:
+                self.net.setInput(blob)
+                return self.net.forward().reshape(-1, 7)
+
+            outputs = []
+            for i in range(len(blob)):
+                self.net.setInput(blob[i:i + 1])
+                res = self.net.forward().reshape(-1, 7)
+                res[:, 0] = i
+                outputs.append(res)
+        return np.concatenate(outputs)
+
 
 def get_face_detector(modelFile=None,
                       configFile=None,
-                      quantized=False):
+                      quantized=None,
+                      input_size=None,
+                      backend=None,
+                      target=None):
     """
-    Get the face detection caffe model of OpenCV's DNN module
+    Get the face detection model of OpenCV's DNN module
+
+    Unset options are read from the environment, so deployments can pick
+    the detector without code changes:
+    FACE_DETECTOR_PRECISION ('uint8' or 'fp32'), FACE_DETECTOR_INPUT_SIZE
+    (e.g. '300' or '320x240'), FACE_DETECTOR_BACKEND and FACE_DETECTOR_TARGET
+    (keys of DETECTOR_BACKENDS and DETECTOR_TARGETS).
     
     Parameters
     ----------
@@ -21,14 +88,35 @@ def get_face_detector(modelFile=None,
         Path to model file. The default is "models/res10_300x300_ssd_iter_140000.caffemodel" or models/opencv_face_detector_uint8.pb" based on quantization.
     configFile : string, optional
         Path to config file. The default is "models/deploy.prototxt" or "models/opencv_face_detector.pbtxt" based on quantization.
-    quantization: bool, optional
-        Determines whether to use quantized tf model or unquantized caffe model. The default is False.
+    quantized : bool, optional
+        Determines whether to use quantized (uint8) tf model or unquantized (fp32) caffe model. The default is True.
+    input_size : int or tuple, optional
+        Side or (width, height) frames are resized to before detection.
+        Smaller is faster but misses small faces. The default is 300.
+    backend : string, optional
+        OpenCV DNN backend. The default is 'opencv'.
+    target : string, optional
+        OpenCV DNN target device. The default is 'cpu'.
     
     Returns
     -------
-    model : dnn_Net
+    model : FaceDetector
 
     """
+    if quantized is None:
+        quantized = os.environ.get('FACE_DETECTOR_PRECISION', 'uint8').lower() != 'fp32'
+    if input_size is None:
+        input_size = os.environ.get('FACE_DETECTOR_INPUT_SIZE', DEFAULT_INPUT_SIZE)
+    input_size = parse_input_size(input_size)
+    if backend is None:
+        backend = os.environ.get('FACE_DETECTOR_BACKEND', 'opencv')
+    if target is None:
+        target = os.environ.get('FACE_DETECTOR_TARGET', 'cpu')
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown DNN backend '{backend}', expected one of {list(DETECTOR_BACKENDS)}")
+    if target not in DETECTOR_TARGETS:
+        raise ValueError(f"Unknown DNN target '{target}', expected one of {list(DETECTOR_TARGETS)}")
+
         # Get the directory where face_detector.py is located
     current_dir = os.path.dirname(os.path.abspath(__file__))
     models_dir = os.path.join(current_dir, 'models')
@@ -45,7 +133,66 @@ def get_face_detector(modelFile=None,
         if configFile == None:
             configFile = os.path.join(models_dir, "deploy.prototxt")
         model = cv2.dnn.readNetFromCaffe(configFile, modelFile)
-    return model
+
+    model.setPreferableBackend(DETECTOR_BACKENDS[backend])
+    model.setPreferableTarget(DETECTOR_TARGETS[target])
+    # OpenCV's import of the quantized TF graph only runs with a batch size of one,
+    # the caffe model batches fine
+    return FaceDetector(model, input_size, can_batch=not quantized)
+
+def parse_input_size(input_size):
+    """300, '300', (320, 240) or '320x240' -> (width, height)"""
+    if isinstance(input_size, str):
+        input_size = [int(v) for v in input_size.lower().split('x')]
+    elif isinstance(input_size, int):
+        input_size = [input_size]
+    input_size = tuple(input_size)
+    return input_size * 2 if len(input_size) == 1 else input_size
+
+register_model("face_detector", get_face_detector)
+
+def find_faces_batch(imgs, model, conf_threshold=0.5):
+    """
+    Find the faces in several images with a single forward pass
+
+    The images may have different sizes, e.g. frames from different
+    candidates. They are resized into one blob batch of the detector's input
+    size (300x300 by default) and the detections are filtered and scaled back
+    with NumPy instead of a Python loop per detection.
+
+    Parameters
+    ----------
+    imgs : list of np.uint8
+        Images to find faces from
+    model : FaceDetector
+        Face detection model
+    conf_threshold : float, optional
+        Minimum detection confidence. The default is 0.5.
+
+    Returns
+    -------
+    faces : list of list
+        For each image, the list of coordinates of the faces detected in it
+
+    """
+    if len(imgs) == 0:
+        return []
+
+    input_size = model.input_size
+    blob = cv2.dnn.blobFromImages([cv2.resize(img, input_size) for img in imgs],
+                                  1.0, input_size, (104.0, 177.0, 123.0))
+    # Rows are [image_id, label, confidence, x, y, x1, y1] for the whole batch
+    res = model.forward(blob)
+    res = res[res[:, 2] > conf_threshold]
+
+    sizes = np.array([[img.shape[1], img.shape[0]] * 2 for img in imgs], dtype=np.float32)
+    image_ids = res[:, 0].astype(int)
+    boxes = (res[:, 3:7] * sizes[image_ids]).astype(int)
+
+    faces = [[] for _ in imgs]
+    for image_id, box in zip(image_ids.tolist(), boxes.tolist()):
+        faces[image_id].append(box)
+    return faces
 
 def find_faces(img, model):
     """
@@ -55,7 +202,7 @@ def find_faces(img, model):
     ----------
     img : np.uint8
         Image to find faces from
-    model : dnn_Net
+    model : FaceDetector
         Face detection model
 
     Returns
@@ -64,19 +211,7 @@ def find_faces(img, model):
         List of coordinates of the faces detected in the image
 
     """
-    h, w = img.shape[:2]
-    blob = cv2.dnn.blobFromImage(cv2.resize(img, (300, 300)), 1.0,
-	(300, 300), (104.0, 177.0, 123.0))
-    model.setInput(blob)
-    res = model.forward()
-    faces = []
-    for i in range(res.shape[2]):
-        confidence = res[0, 0, i, 2]
-        if confidence > 0.5:
-            box = res[0, 0, i, 3:7] * np.array([w, h, w, h])
-            (x, y, x1, y1) = box.astype("int")
-            faces.append([x, y, x1, y1])
-    return faces
+    return find_faces_batch([img], model)[0]
 
 def draw_faces(img, faces):
     """
@@ -1,40 +1,115 @@
 import cv2
 import numpy as np
-import tensorflow as tf
-# Replace the direct keras import with one of these alternatives
-try:
-    from tensorflow import keras
-except:
-    # Alternative 1: Use standalone keras
-    import keras
-    # Alternative 2: Use keras from tensorflow.keras
-    # from tensorflow import keras as keras
 import os
+import threading
+from micro_batch import MicroBatcher
+from model_registry import register_model
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 models_dir = os.path.join(current_dir, 'models')
 pose_model = os.path.join(models_dir, 'pose_model')
+# pose_model exported by convert_landmark_model.py, in fp32 and int8
+pose_model_onnx = os.path.join(models_dir, 'pose_model.onnx')
+pose_model_int8 = os.path.join(models_dir, 'pose_model_int8.onnx')
 
+LANDMARK_BACKENDS = ('tensorflow', 'opencv', 'onnxruntime')
 
-def get_landmark_model(saved_model=pose_model):
+
+class TensorFlowLandmarkModel:
+    """The landmark SavedModel run through its 'predict' signature"""
+
+    backend = 'tensorflow'
+
+    def __init__(self, saved_model=pose_model):
+        # TensorFlow takes seconds to import; only pay for it when this backend is used
+        import tensorflow as tf
+        self._tf = tf
+        self.model = tf.saved_model.load(saved_model)
+        self._predict = self.model.signatures["predict"]
+
+    def predict(self, face_imgs):
+        """Raw model output for a (N, 128, 128, 3) uint8 RGB batch"""
+        predictions = self._predict(self._tf.constant(face_imgs, dtype=self._tf.uint8))
+        return np.array(predictions['output'])
+
+
+class OpenCVLandmarkModel:
+    """The ONNX export of the landmark model run by OpenCV's DNN module"""
+
+    backend = 'opencv'
+
+    def __init__(self, onnx_file=pose_model_onnx):
+        self.net = cv2.dnn.readNetFromONNX(onnx_file)
+        # A dnn_Net keeps its input and activations between setInput and forward
+        self._lock = threading.Lock()
+
+    def predict(self, face_imgs):
+        """Raw model output for a (N, 128, 128, 3) uint8 RGB batch"""
+        with self._lock:
+            self.net.setInput(face_imgs.astype(np.float32))
+            return self.net.forward()
+
+
+class OnnxRuntimeLandmarkModel:
+    """The ONNX export of the landmark model run by ONNX Runtime on the CPU"""
+
+    backend = 'onnxruntime'
+
+    def __init__(self, onnx_file=pose_model_onnx):
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(onnx_file, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, face_imgs):
+        """Raw model output for a (N, 128, 128, 3) uint8 RGB batch"""
+        return self.session.run(None, {self.input_name: face_imgs.astype(np.float32)})[0]
+
+
+def get_landmark_model(saved_model=pose_model, backend=None, quantized=None):
     """
     Get the facial landmark model. 
     Original repository: https://github.com/yinguobing/cnn-facial-landmark
 
+    The same network can run on TensorFlow, or from its ONNX export (see
+    convert_landmark_model.py) on OpenCV's DNN module or ONNX Runtime, which
+    start faster and need far less memory than TensorFlow.
+
     Parameters
     ----------
     saved_model : string, optional
         Path to facial landmarks model. The default is 'models/pose_model'.
+        For the ONNX backends the .onnx file next to it is used.
+    backend : string, optional
+        'tensorflow', 'opencv' or 'onnxruntime'. The default is the
+        LANDMARK_BACKEND environment variable, or 'tensorflow'.
+    quantized : bool, optional
+        Use the int8 ONNX model. The default is the LANDMARK_QUANTIZED
+        environment variable, or False.
 
     Returns
     -------
-    model : Tensorflow model
-        Facial landmarks model
+    model : landmark model
+        Facial landmarks model, model.predict takes a batch of face crops
 
     """
-    #model = keras.models.load_model(saved_model)
-    model = tf.saved_model.load(saved_model)
-    return model
+    if backend is None:
+        backend = os.environ.get('LANDMARK_BACKEND', 'tensorflow')
+    if quantized is None:
+        quantized = os.environ.get('LANDMARK_QUANTIZED', '0').lower() in ('1', 'true', 'yes')
+    if backend not in LANDMARK_BACKENDS:
+        raise ValueError(f"Unknown landmark backend '{backend}', expected one of {LANDMARK_BACKENDS}")
+
+    if backend == 'tensorflow':
+        if quantized:
+            raise ValueError("The quantized landmark model needs the 'opencv' or 'onnxruntime' backend")
+        return TensorFlowLandmarkModel(saved_model)
+
+    onnx_file = os.path.normpath(saved_model) + ('_int8.onnx' if quantized else '.onnx')
+    if backend == 'opencv':
+        return OpenCVLandmarkModel(onnx_file)
+    return OnnxRuntimeLandmarkModel(onnx_file)
+
+register_model("landmark_model", get_landmark_model)
 
 def get_square_box(box):
     """Get a square box out of the given box, by expanding it."""
@@ -76,26 +151,25 @@ def move_box(box, offset):
         bottom_y = box[3] + offset[1]
         return [left_x, top_y, right_x, bottom_y]
 
-def detect_marks(img, model, face):
+def crop_face(img, face):
     """
-    Find the facial landmarks in an image from the faces
+    Cut out the square, RGB 128x128 input of the landmark model for a face
 
     Parameters
     ----------
     img : np.uint8
-        The image in which landmarks are to be found
-    model : Tensorflow model
-        Loaded facial landmark model
+        The image the face was found in
     face : list
-        Face coordinates (x, y, x1, y1) in which the landmarks are to be found
+        Face coordinates (x, y, x1, y1)
 
     Returns
     -------
-    marks : numpy array
-        facial landmark points
+    face_img : np.uint8
+        128x128 RGB crop of the face
+    facebox : list
+        Square box (x, y, x1, y1) the crop was taken from
 
     """
-
     offset_y = int(abs((face[3] - face[1]) * 0.1))
     box_moved = move_box(face, [0, offset_y])
     facebox = get_square_box(box_moved)
@@ -114,21 +188,93 @@ def detect_marks(img, model, face):
                      facebox[0]: facebox[2]]
     face_img = cv2.resize(face_img, (128, 128))
     face_img = cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB)
+    return face_img, facebox
+
+def detect_marks_batch(items, model):
+    """
+    Find the facial landmarks of many faces with a single forward pass
+
+    The faces may come from different images (frames of several candidates),
+    their crops are stacked into one tensor so the backend's per call overhead
+    is paid once per batch instead of once per face.
+
+    Parameters
+    ----------
+    items : list of tuple
+        (img, face) pairs, face being the coordinates (x, y, x1, y1) in img
+    model : landmark model
+        Loaded facial landmark model, see get_landmark_model
+
+    Returns
+    -------
+    marks : list of numpy array
+        facial landmark points of each face, in the order of items
+
+    """
+    if not items:
+        return []
+
+    crops = [crop_face(img, face) for img, face in items]
+    face_imgs = np.stack([face_img for face_img, _ in crops])
     
     # # Actual detection.
-    predictions = model.signatures["predict"](
-        tf.constant([face_img], dtype=tf.uint8))
+    predictions = model.predict(face_imgs)
 
     # Convert predictions to landmarks.
-    marks = np.array(predictions['output']).flatten()[:136]
-    marks = np.reshape(marks, (-1, 2))
+    outputs = np.asarray(predictions).reshape(len(items), -1)[:, :136]
+    outputs = outputs.reshape(len(items), -1, 2)
     
-    marks *= (facebox[2] - facebox[0])
-    marks[:, 0] += facebox[0]
-    marks[:, 1] += facebox[1]
-    marks = marks.astype(np.uint)
+    marks_list = []
+    for marks, (_, facebox) in zip(outputs, crops):
+        marks = marks * (facebox[2] - facebox[0])
+        marks[:, 0] += facebox[0]
+        marks[:, 1] += facebox[1]
+        marks_list.append(marks.astype(np.uint))
+    return marks_list
+
+def detect_marks(img, model, face):
+    """
+    Find the facial landmarks in an image from the faces
+
+    Parameters
+    ----------
+    img : np.uint8
+        The image in which landmarks are to be found
+    model : landmark model
+        Loaded facial landmark model
+    face : list
+        Face coordinates (x, y, x1, y1) in which the landmarks are to be found
 
-    return marks
+    Returns
+    -------
+    marks : numpy array
+        facial landmark points
+
+    """
+    return detect_marks_batch([(img, face)], model)[0]
+
+def get_landmark_batcher(model, max_batch_size=32, max_wait_ms=5):
+    """
+    Get a micro-batcher that groups landmark requests from many threads into
+    batched forward passes
+
+    Parameters
+    ----------
+    model : landmark model
+        Loaded facial landmark model
+    max_batch_size : int, optional
+        Most faces per forward pass. The default is 32.
+    max_wait_ms : float, optional
+        How long the first request waits for others to join its batch. The default is 5.
+
+    Returns
+    -------
+    batcher : MicroBatcher
+        batcher.submit((img, face)) returns a future of the face's landmarks
+
+    """
+    return MicroBatcher(lambda items: detect_marks_batch(items, model),
+                        max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
 
 def draw_marks(image, marks, color=(0, 255, 0)):
     """
@@ -1,7 +1,12 @@
+import os
 import numpy as np
 import cv2
-from sklearn.externals import joblib
-from face_detector import get_face_detector, find_faces
+from face_detector import find_faces
+from model_registry import register_model, get_model
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+models_dir = os.path.join(current_dir, 'models')
+font = cv2.FONT_HERSHEY_SIMPLEX
 
 def calc_hist(img):
     """
@@ -25,61 +30,159 @@ def calc_hist(img):
         histogram[j] = histr
     return np.array(histogram)
 
-face_model = get_face_detector()
-clf = joblib.load('models/face_spoofing.pkl')
-cap = cv2.VideoCapture(0)
-
-sample_number = 1
-count = 0
-measures = np.zeros(sample_number, dtype=np.float)
-
-while True:
-    ret, img = cap.read()
-    faces = find_faces(img, face_model)
-
-    measures[count%sample_number]=0
-    height, width = img.shape[:2]
-    for x, y, x1, y1 in faces:
-        
-        roi = img[y:y1, x:x1]
-        point = (0,0)
-        
-        img_ycrcb = cv2.cvtColor(roi, cv2.COLOR_BGR2YCR_CB)
-        img_luv = cv2.cvtColor(roi, cv2.COLOR_BGR2LUV)
-
-        ycrcb_hist = calc_hist(img_ycrcb)
-        luv_hist = calc_hist(img_luv)
-
-        feature_vector = np.append(ycrcb_hist.ravel(), luv_hist.ravel())
-        feature_vector = feature_vector.reshape(1, len(feature_vector))
-
-        prediction = clf.predict_proba(feature_vector)
-        prob = prediction[0][1]
-
-        measures[count % sample_number] = prob
-
-        cv2.rectangle(img, (x, y), (x1, y1), (255, 0, 0), 2)
-
-        point = (x, y-5)
-
-        # print (measures, np.mean(measures))
-        if 0 not in measures:
-            text = "True"
-            if np.mean(measures) >= 0.7:
-                text = "False"
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                cv2.putText(img=img, text=text, org=point, fontFace=font, fontScale=0.9, color=(0, 0, 255),
-                            thickness=2, lineType=cv2.LINE_AA)
-            else:
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                cv2.putText(img=img, text=text, org=point, fontFace=font, fontScale=0.9,
-                            color=(0, 255, 0), thickness=2, lineType=cv2.LINE_AA)
-        
-    count+=1
-    cv2.imshow('img_rgb', img)
-    
-    if cv2.waitKey(1) & 0xFF == ord('q'):
+def get_spoofing_model(model_file=os.path.join(models_dir, 'face_spoofing.pkl')):
+    """
+    Get the face spoofing classifier
+
+    Parameters
+    ----------
+    model_file : string, optional
+        Path to the pickled classifier. The default is 'models/face_spoofing.pkl'.
+
+    Returns
+    -------
+    clf : sklearn classifier
+        Classifier of YCrCb and LUV histograms, class 1 being a spoofed face
+
+    """
+    # joblib pulls in scikit-learn while unpickling, so it is only imported when the model is used
+    import joblib
+    return joblib.load(model_file)
+
+register_model("face_spoofing", get_spoofing_model)
+
+def face_features(roi):
+    """
+    Get the feature vector of a face crop: its YCrCb and LUV histograms
+
+    Parameters
+    ----------
+    roi : Array of uint8
+        BGR crop of the face
+
+    Returns
+    -------
+    feature_vector : np.array
+        Features of shape (1, 1536)
+
+    """
+    img_ycrcb = cv2.cvtColor(roi, cv2.COLOR_BGR2YCR_CB)
+    img_luv = cv2.cvtColor(roi, cv2.COLOR_BGR2LUV)
+
+    ycrcb_hist = calc_hist(img_ycrcb)
+    luv_hist = calc_hist(img_luv)
+
+    feature_vector = np.append(ycrcb_hist.ravel(), luv_hist.ravel())
+    return feature_vector.reshape(1, len(feature_vector))
+
+def spoof_probability(img, face, model):
+    """
+    Get the probability that a face is a photograph or screen rather than a real face
+
+    Parameters
+    ----------
+    img : np.uint8
+        Frame the face is in
+    face : list
+        Face coordinates (x, y, x1, y1)
+    model : sklearn classifier
+        Face spoofing classifier
+
+    Returns
+    -------
+    probability : float
+        Probability of the face being spoofed
+
+    """
+    x, y, x1, y1 = face
+    prediction = model.predict_proba(face_features(img[y:y1, x:x1]))
+    return float(prediction[0][1])
+
+def detect_spoofing(img, faces, model=None, threshold=0.7):
+    """
+    Check whether the faces of a frame are real
+
+    Parameters
+    ----------
+    img : np.uint8
+        Frame the faces are in
+    faces : list
+        List of face coordinates (x, y, x1, y1), as returned by find_faces
+    model : sklearn classifier, optional
+        Face spoofing classifier. The default is the shared registry model.
+    threshold : float, optional
+        Probability from which a face counts as spoofed. The default is 0.7.
+
+    Returns
+    -------
+    results : list of dict
+        'face', 'probability' and 'real' for every face
+
+    """
+    if model is None:
+        model = get_model("face_spoofing")
+    results = []
+    for face in faces:
+        probability = spoof_probability(img, face, model)
+        results.append({
+            'face': face,
+            'probability': probability,
+            'real': probability < threshold
+        })
+    return results
+
+def face_spoofing_demo(video_path=0, sample_number=1):
+    """
+    Show whether the faces on a webcam or video are real
+
+    Parameters
+    ----------
+    video_path : int or string, optional
+        Camera index or video file. The default is 0.
+    sample_number : int, optional
+        Frames the spoofing probability is averaged over. The default is 1.
+
+    Returns
+    -------
+    None.
+
+    """
+    face_model = get_model("face_detector")
+    clf = get_model("face_spoofing")
+    cap = cv2.VideoCapture(video_path)
+
+    count = 0
+    measures = np.zeros(sample_number, dtype=float)
+
+    while True:
+        ret, img = cap.read()
+        if not ret:
             break
+        faces = find_faces(img, face_model)
+
+        measures[count % sample_number] = 0
+        for x, y, x1, y1 in faces:
+            measures[count % sample_number] = spoof_probability(img, (x, y, x1, y1), clf)
+
+            cv2.rectangle(img, (x, y), (x1, y1), (255, 0, 0), 2)
+
+            point = (x, y-5)
+            if 0 not in measures:
+                if np.mean(measures) >= 0.7:
+                    cv2.putText(img=img, text="False", org=point, fontFace=font, fontScale=0.9, color=(0, 0, 255),
+                                thickness=2, lineType=cv2.LINE_AA)
+                else:
+                    cv2.putText(img=img, text="True", org=point, fontFace=font, fontScale=0.9,
+                                color=(0, 255, 0), thickness=2, lineType=cv2.LINE_AA)
+
+        count += 1
+        cv2.imshow('img_rgb', img)
+
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+
+    cap.release()
+    cv2.destroyAllWindows()
 
-cap.release()
-cv2.destroyAllWindows()
+if __name__ == "__main__":
+    face_spoofing_demo()
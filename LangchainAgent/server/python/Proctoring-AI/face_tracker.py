@@ -0,0 +1,132 @@
+import numpy as np
+from face_detector import find_faces
+
+
+def box_from_marks(marks, img_shape):
+    """
+    Get a face box like the SSD detector's out of facial landmarks
+
+    The landmarks stop at the eyebrows, so the box is extended upwards to
+    cover the forehead the detector's boxes include.
+
+    Parameters
+    ----------
+    marks : numpy array
+        68 facial landmark points
+    img_shape : tuple
+        Shape of the frame, to clip the box to
+
+    Returns
+    -------
+    box : list
+        Face coordinates (x, y, x1, y1)
+
+    """
+    marks = np.asarray(marks, dtype=np.int64)
+    x, y = marks.min(axis=0)
+    x1, y1 = marks.max(axis=0)
+    y -= int((y1 - y) * 0.25)
+    h, w = img_shape[:2]
+    return [int(max(x, 0)), int(max(y, 0)), int(min(x1, w)), int(min(y1, h))]
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x, y, x1, y1) boxes"""
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    intersection = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+class FaceTracker:
+    """
+    Follow faces between frames so the SSD detector only runs occasionally
+
+    After landmarks are found on a frame, the box for the next frame is taken
+    from the landmarks' extent. The full detector runs every detect_every
+    frames, when there is no face to follow, or when a propagated box is not
+    trustworthy (it jumped, shrank to nothing or left the frame).
+
+    Parameters
+    ----------
+    face_model : FaceDetector
+        Face detection model
+    detect_every : int, optional
+        Frames between full detections. The default is 10.
+    min_iou : float, optional
+        Minimum overlap between a face's box on consecutive frames for the
+        track to be trusted. The default is 0.5.
+    min_size : int, optional
+        Smallest box side in pixels that is still tracked. The default is 20.
+
+    """
+
+    def __init__(self, face_model, detect_every=10, min_iou=0.5, min_size=20):
+        self.face_model = face_model
+        self.detect_every = detect_every
+        self.min_iou = min_iou
+        self.min_size = min_size
+        self.faces = []
+        self.frames_since_detection = None
+        self.detections = 0
+        self.tracked_frames = 0
+
+    def find_faces(self, img):
+        """
+        Get the face boxes of a frame, detecting or following them
+
+        Parameters
+        ----------
+        img : np.uint8
+            Frame to find faces in
+
+        Returns
+        -------
+        faces : list
+            List of coordinates of the faces in the frame
+
+        """
+        if (not self.faces or self.frames_since_detection is None
+                or self.frames_since_detection >= self.detect_every):
+            self.faces = find_faces(img, self.face_model)
+            self.frames_since_detection = 0
+            self.detections += 1
+        else:
+            self.frames_since_detection += 1
+            self.tracked_frames += 1
+        return list(self.faces)
+
+    def update(self, marks_list, img_shape):
+        """
+        Move the tracked boxes to where the landmarks found the faces
+
+        Parameters
+        ----------
+        marks_list : list of numpy array
+            Landmarks of each face returned by the last find_faces call
+        img_shape : tuple
+            Shape of the frame
+
+        Returns
+        -------
+        None.
+
+        """
+        faces = []
+        for previous, marks in zip(self.faces, marks_list):
+            if marks is None:
+                self.reset()
+                return
+            box = box_from_marks(marks, img_shape)
+            too_small = box[2] - box[0] < self.min_size or box[3] - box[1] < self.min_size
+            if too_small or box_iou(previous, box) < self.min_iou:
+                # Lost the face; detect again on the next frame
+                self.reset()
+                return
+            faces.append(box)
+        self.faces = faces
+
+    def reset(self):
+        """Force a full detection on the next frame"""
+        self.frames_since_detection = None
@@ -0,0 +1,82 @@
+import time
+import cv2
+import numpy as np
+
+
+class FrameCache:
+    """
+    Reuse the proctoring results of a stream while its frames stay the same
+
+    A seated candidate's webcam produces long runs of nearly identical
+    frames. Frames are compared through their downsampled grayscale
+    signature (frame_scheduler.downsample) with the signature of the frame
+    the cached results were computed on, rather than with the previous
+    frame, so slow drift still ends up as a miss. A frame matches when its
+    mean difference is within tolerance and few signature pixels changed
+    much, so a small object entering the scene (a phone) is not averaged
+    away. Results are recomputed at least every max_age seconds.
+
+    Parameters
+    ----------
+    tolerance : float, optional
+        Largest mean absolute difference, in gray levels, of a match. The default is 2.0.
+    pixel_threshold : int, optional
+        Difference, in gray levels, from which a signature pixel counts as
+        changed. The default is 12.
+    max_changed : float, optional
+        Largest fraction of changed signature pixels of a match. The default is 0.005.
+    max_age : float, optional
+        Seconds cached results are reused for at most. The default is 2.0.
+
+    """
+
+    def __init__(self, tolerance=2.0, pixel_threshold=12, max_changed=0.005, max_age=2.0):
+        self.tolerance = tolerance
+        self.pixel_threshold = pixel_threshold
+        self.max_changed = max_changed
+        self.max_age = max_age
+        self.signature = None
+        self.results = None
+        self.stored_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def matches(self, signature):
+        """Whether a signature is near enough to the one of the cached results"""
+        if self.signature is None or self.signature.shape != signature.shape:
+            return False
+        diff = cv2.absdiff(signature, self.signature)
+        if float(np.mean(diff)) > self.tolerance:
+            return False
+        return np.count_nonzero(diff > self.pixel_threshold) <= self.max_changed * diff.size
+
+    def lookup(self, signature, now=None):
+        """
+        Get the cached results for a frame
+
+        Parameters
+        ----------
+        signature : np.uint8
+            Downsampled grayscale frame, see frame_scheduler.downsample
+        now : float, optional
+            Timestamp of the frame in seconds. The default is time.monotonic().
+
+        Returns
+        -------
+        results : dict
+            The cached results, or None when the frame has to be analyzed
+
+        """
+        if now is None:
+            now = time.monotonic()
+        if self.results is not None and now - self.stored_at < self.max_age and self.matches(signature):
+            self.hits += 1
+            return self.results
+        self.misses += 1
+        return None
+
+    def store(self, signature, results, now=None):
+        """Cache the results of an analyzed frame"""
+        self.signature = signature
+        self.results = results
+        self.stored_at = time.monotonic() if now is None else now
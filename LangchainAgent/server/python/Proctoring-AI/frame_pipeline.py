@@ -0,0 +1,83 @@
+from face_detector import find_faces
+from face_landmarks import detect_marks_batch
+from eye_tracker import track_eye_marks
+from head_pose_estimation import head_pose_from_marks
+from mouth_opening_detector import mouth_status_from_marks
+from model_registry import get_model
+from overlay import render
+
+
+def analyze_frame(frame, face_model=None, landmark_model=None, tracker=None, mouth_session=None,
+                  head_pose_estimator=None, eye_session=None, annotate=False):
+    """
+    Run all landmark based proctoring checks on a frame with a single face
+    detection and landmark pass.
+
+    track_eye, detect_head_pose and process_frame each detect faces and
+    landmarks on their own; this runs the SSD face detector and the landmark
+    CNN once and hands the shared landmarks to the eye, head pose and mouth
+    analyzers.
+
+    Parameters
+    ----------
+    frame : np.uint8
+        Input frame from video/webcam
+    face_model : FaceDetector, optional
+        Face detection model. The default is the shared registry model.
+    landmark_model : landmark model, optional
+        Loaded facial landmark model. The default is the shared registry model.
+    tracker : FaceTracker, optional
+        Follows the faces of a stream between detections, so the face
+        detector only runs every few frames. The default is None, which
+        detects faces on every frame.
+    mouth_session : MouthSession, optional
+        Mouth opening thresholds calibrated to the candidate. The default is
+        None, which uses fixed thresholds.
+    head_pose_estimator : HeadPoseEstimator, optional
+        Keeps the camera matrix and the previous head poses of the stream to
+        warm start the next pose estimate. The default is None, which uses a
+        shared estimator without warm starts.
+    eye_session : EyeSession, optional
+        Pupil threshold calibrated to the candidate. The default is None,
+        which uses the fixed threshold.
+    annotate : bool, optional
+        Return an annotated copy of the frame (see overlay.render), and the
+        landmarks and nose directions it is drawn from in the results. The
+        default is False, which neither copies nor draws on the frame.
+
+    Returns
+    -------
+    tuple
+        (processed_frame, results) where results has the keys 'faces',
+        'face_count', 'eyes', 'head_pose' and 'mouth', plus 'marks' with
+        annotate
+
+    """
+    if face_model is None:
+        face_model = get_model("face_detector")
+    if landmark_model is None:
+        landmark_model = get_model("landmark_model")
+
+    if tracker is not None:
+        faces = tracker.find_faces(frame)
+    else:
+        faces = find_faces(frame, face_model)
+    marks_list = detect_marks_batch([(frame, face) for face in faces], landmark_model)
+    if tracker is not None:
+        tracker.update(marks_list, frame.shape)
+
+    eyes = track_eye_marks(frame, marks_list, session=eye_session)
+    mouth = mouth_status_from_marks(marks_list, mouth_session)
+    head_pose = head_pose_from_marks(frame, marks_list, head_pose_estimator, annotate)
+
+    results = {
+        'faces': faces,
+        'face_count': len(faces),
+        'eyes': eyes,
+        'head_pose': head_pose,
+        'mouth': mouth
+    }
+    if annotate:
+        results['marks'] = [marks.tolist() for marks in marks_list]
+        return render(frame, results), results
+    return frame, results
@@ -0,0 +1,122 @@
+import time
+import cv2
+import numpy as np
+
+# Seconds between runs of each detector while the candidate is still
+DEFAULT_INTERVALS = {
+    'landmarks': 0.1,   # face, eyes, head pose and mouth
+    'objects': 1.0,     # YOLO person and phone detection
+    'emotion': 1.0      # DeepFace emotion
+}
+
+# Intervals used for a short while after motion was seen
+BOOSTED_INTERVALS = {
+    'landmarks': 0.0,
+    'objects': 0.2,
+    'emotion': 0.5
+}
+
+SIGNATURE_SIZE = (64, 48)
+
+
+def downsample(frame, size=SIGNATURE_SIZE):
+    """
+    Shrink a frame to a small grayscale image for cheap frame comparisons
+
+    Parameters
+    ----------
+    frame : np.uint8
+        BGR frame
+    size : tuple, optional
+        (width, height) of the result. The default is (64, 48).
+
+    Returns
+    -------
+    small : np.uint8
+        Grayscale thumbnail of the frame
+
+    """
+    small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return small
+
+
+class AdaptiveScheduler:
+    """
+    Decide which detectors to run on each frame of a stream
+
+    Expensive detectors run at a low rate while the scene is still. When the
+    mean absolute difference between downsampled consecutive frames passes
+    motion_threshold, every detector switches to its boosted interval for
+    boost_seconds, so movement (turning away, picking up a phone) is
+    analyzed at full rate.
+
+    Parameters
+    ----------
+    intervals : dict, optional
+        Seconds between runs per detector name. The default is DEFAULT_INTERVALS.
+    boosted_intervals : dict, optional
+        Intervals used after motion. The default is BOOSTED_INTERVALS.
+    motion_threshold : float, optional
+        Motion score (0 to 1) that triggers the boost. The default is 0.04.
+    boost_seconds : float, optional
+        How long the boost lasts after the last motion. The default is 1.0.
+
+    """
+
+    def __init__(self, intervals=None, boosted_intervals=None, motion_threshold=0.04, boost_seconds=1.0):
+        self.intervals = dict(DEFAULT_INTERVALS if intervals is None else intervals)
+        self.boosted_intervals = dict(BOOSTED_INTERVALS if boosted_intervals is None else boosted_intervals)
+        self.motion_threshold = motion_threshold
+        self.boost_seconds = boost_seconds
+        self.last_run = {}
+        self.previous = None
+        self.boost_until = 0.0
+        self.last_motion = 0.0
+        self.last_signature = None
+
+    def motion_score(self, small):
+        """Mean absolute difference to the previous downsampled frame, from 0 to 1"""
+        if self.previous is None or self.previous.shape != small.shape:
+            score = 1.0
+        else:
+            score = float(np.mean(cv2.absdiff(small, self.previous))) / 255
+        self.previous = small
+        return score
+
+    def due(self, frame, now=None, signature=None):
+        """
+        Get the detectors to run on a frame and mark them as run
+
+        Parameters
+        ----------
+        frame : np.uint8
+            BGR frame
+        now : float, optional
+            Timestamp of the frame in seconds. The default is time.monotonic().
+        signature : np.uint8, optional
+            downsample(frame), when already computed. The default is None.
+
+        Returns
+        -------
+        detectors : set
+            Names of the detectors that should run on this frame
+
+        """
+        if now is None:
+            now = time.monotonic()
+
+        self.last_signature = downsample(frame) if signature is None else signature
+        self.last_motion = self.motion_score(self.last_signature)
+        if self.last_motion > self.motion_threshold:
+            self.boost_until = now + self.boost_seconds
+
+        intervals = self.boosted_intervals if now < self.boost_until else self.intervals
+        detectors = set()
+        for name, interval in intervals.items():
+            last = self.last_run.get(name)
+            if last is None or now - last >= interval:
+                detectors.add(name)
+                self.last_run[name] = now
+        return detectors
@@ -8,8 +8,10 @@ Created on Fri Jul 31 03:00:36 2020
 import cv2
 import numpy as np
 import math
-from face_detector import get_face_detector, find_faces
-from face_landmarks import get_landmark_model, detect_marks
+from face_detector import find_faces
+from face_landmarks import detect_marks_batch
+from model_registry import get_model
+from overlay import render
 
 def get_2d_points(img, rotation_vector, translation_vector, camera_matrix, val):
     """Return the 3D points present as 2D for making annotation box"""
@@ -124,9 +126,6 @@ def head_pose_points(img, rotation_vector, translation_vector, camera_matrix):
     
     return (x, y)
     
-face_model = get_face_detector()
-landmark_model = get_landmark_model()
-
 font = cv2.FONT_HERSHEY_SIMPLEX 
 # 3D model points.
 model_points = np.array([
@@ -138,99 +137,267 @@ model_points = np.array([
                             (150.0, -150.0, -125.0)      # Right mouth corner
                         ])
 
-def detect_head_pose(frame):
+# Landmarks matching model_points
+pose_landmarks = np.array([30, 8, 36, 45, 48, 54])
+# solvePnP returns the rotation of the model's y-up, z-towards-camera frame into the
+# camera's y-down, z-forward frame; undo that flip so a frontal face has zero angles
+model_to_camera = np.diag([1.0, -1.0, -1.0])
+
+
+def rotation_to_euler(rotation_matrices):
     """
-    Detect head pose from a single frame
-    
+    Pitch, yaw and roll in degrees of head rotations
+
+    Parameters
+    ----------
+    rotation_matrices : numpy array
+        Rotation matrices from cv2.Rodrigues, shape (3, 3) or (N, 3, 3)
+
+    Returns
+    -------
+    angles : numpy array
+        (pitch, yaw, roll), shape (3,) or (N, 3). Positive pitch is head
+        down, positive yaw is head right.
+
+    """
+    r = np.asarray(rotation_matrices) @ model_to_camera
+    pitch = np.degrees(np.arctan2(r[..., 2, 1], r[..., 2, 2]))
+    yaw = np.degrees(np.arcsin(np.clip(-r[..., 2, 0], -1.0, 1.0)))
+    roll = np.degrees(np.arctan2(r[..., 1, 0], r[..., 0, 0]))
+    return np.stack([pitch, yaw, roll], axis=-1)
+
+
+def euler_angles(rotation_vector):
+    """
+    Pitch, yaw and roll in degrees of one head rotation
+
+    Same as rotation_to_euler, with scalar math, which is several times
+    cheaper than NumPy for a single face.
+    """
+    r = cv2.Rodrigues(rotation_vector)[0]
+    # Columns 1 and 2 change sign with the model_to_camera flip
+    pitch = math.degrees(math.atan2(-r[2, 1], -r[2, 2]))
+    yaw = math.degrees(math.asin(max(-1.0, min(1.0, -r[2, 0]))))
+    roll = math.degrees(math.atan2(r[1, 0], r[0, 0]))
+    return pitch, yaw, roll
+
+
+class HeadPoseEstimator:
+    """
+    Head pose from facial landmarks for the frames of one stream
+
+    Camera intrinsics are cached per frame resolution, and solvePnP
+    (SOLVEPNP_ITERATIVE) starts from the previous frame's pose of the same
+    face, so it typically converges in a couple of iterations. Angles are read
+    directly from the rotation matrix instead of projecting points.
+
+    Parameters
+    ----------
+    pitch_threshold : float, optional
+        Degrees of pitch reported as head up/down. The default is 25.
+    yaw_threshold : float, optional
+        Degrees of yaw reported as head left/right. The default is 40.
+    warm_start : bool, optional
+        Reuse the previous pose as the initial guess. Only enable this when
+        the estimator sees consecutive frames of one stream. The default is True.
+
+    """
+
+    def __init__(self, pitch_threshold=25, yaw_threshold=40, warm_start=True):
+        self.pitch_threshold = pitch_threshold
+        self.yaw_threshold = yaw_threshold
+        self.warm_start = warm_start
+        self.dist_coeffs = np.zeros((4, 1))
+        self._camera_matrices = {}
+        self._previous = []
+
+    def camera_matrix(self, frame_shape):
+        """Approximate intrinsics for a frame size, focal length = width"""
+        size = tuple(frame_shape[:2])
+        camera_matrix = self._camera_matrices.get(size)
+        if camera_matrix is None:
+            h, w = size
+            camera_matrix = np.array([[w, 0, w / 2],
+                                      [0, w, h / 2],
+                                      [0, 0, 1]], dtype="double")
+            self._camera_matrices[size] = camera_matrix
+        return camera_matrix
+
+    def solve(self, marks, camera_matrix, face_index=0):
+        """Rotation and translation vectors of one face"""
+        image_points = np.asarray(marks, dtype="double")[pose_landmarks]
+        previous = self._previous[face_index] if self.warm_start and face_index < len(self._previous) else None
+        if previous is not None:
+            success, rotation_vector, translation_vector = cv2.solvePnP(
+                model_points, image_points, camera_matrix, self.dist_coeffs,
+                rvec=previous[0].copy(), tvec=previous[1].copy(),
+                useExtrinsicGuess=True, flags=cv2.SOLVEPNP_ITERATIVE)
+        else:
+            success, rotation_vector, translation_vector = cv2.solvePnP(
+                model_points, image_points, camera_matrix, self.dist_coeffs,
+                flags=cv2.SOLVEPNP_ITERATIVE)
+        # A pose behind the camera means the solver diverged; don't warm start from it
+        if not success or translation_vector[2, 0] <= 0:
+            return None
+        return rotation_vector, translation_vector
+
+    def direction(self, pitch, yaw):
+        """Direction label for the angles, None when facing the camera"""
+        if pitch >= self.pitch_threshold:
+            return 'Head down'
+        elif pitch <= -self.pitch_threshold:
+            return 'Head up'
+        elif yaw >= self.yaw_threshold:
+            return 'Head right'
+        elif yaw <= -self.yaw_threshold:
+            return 'Head left'
+        return None
+
+    def estimate(self, marks_list, frame_shape):
+        """
+        Head pose of every face in a frame
+
+        Parameters
+        ----------
+        marks_list : list of numpy array
+            Facial landmarks of every face in the frame
+        frame_shape : tuple
+            Shape of the frame
+
+        Returns
+        -------
+        poses : list of dict
+            Per face 'pitch', 'yaw', 'roll', 'direction', 'rotation_vector'
+            and 'translation_vector', None for faces where solvePnP failed
+
+        """
+        camera_matrix = self.camera_matrix(frame_shape)
+        solutions = [self.solve(marks, camera_matrix, i) for i, marks in enumerate(marks_list)]
+        self._previous = solutions
+        return [None if solution is None else self._pose(solution, *euler_angles(solution[0]))
+                for solution in solutions]
+
+    def estimate_batch(self, marks_lists, frame_shapes):
+        """
+        Head poses of consecutive frames of the stream
+
+        The solves run frame by frame (each warm starts from the previous
+        one), the angles of all faces are then computed in one vectorized
+        pass.
+
+        Returns
+        -------
+        poses : list of list of dict
+            One list of poses (see estimate) per frame
+
+        """
+        solutions = []
+        for marks_list, frame_shape in zip(marks_lists, frame_shapes):
+            camera_matrix = self.camera_matrix(frame_shape)
+            frame_solutions = [self.solve(marks, camera_matrix, i) for i, marks in enumerate(marks_list)]
+            self._previous = frame_solutions
+            solutions.append(frame_solutions)
+
+        valid = [s for frame_solutions in solutions for s in frame_solutions if s is not None]
+        if not valid:
+            return [[None] * len(frame_solutions) for frame_solutions in solutions]
+        rotations = np.stack([cv2.Rodrigues(rotation_vector)[0] for rotation_vector, _ in valid])
+        angles = iter(rotation_to_euler(rotations).tolist())
+        return [[None if s is None else self._pose(s, *next(angles)) for s in frame_solutions]
+                for frame_solutions in solutions]
+
+    def _pose(self, solution, pitch, yaw, roll):
+        return {
+            'pitch': pitch,
+            'yaw': yaw,
+            'roll': roll,
+            'direction': self.direction(pitch, yaw),
+            'rotation_vector': solution[0],
+            'translation_vector': solution[1]
+        }
+
+
+# Used when no per-stream estimator is given; it only shares the cached intrinsics
+default_estimator = HeadPoseEstimator(warm_start=False)
+
+
+def head_pose_from_marks(frame, marks_list, estimator=None, annotate=False):
+    """
+    Estimate head pose from already detected facial landmarks
+
     Parameters
     ----------
     frame : np.array
-        Input frame from video/webcam
-        
+        Frame the landmarks belong to. Nothing is drawn on it, see overlay.draw_head_pose.
+    marks_list : list of Array of uint32
+        Facial landmarks of every face in the frame
+    estimator : HeadPoseEstimator, optional
+        Estimator of the stream the frame belongs to, for warm started
+        solves. The default is a shared estimator without warm start.
+    annotate : bool, optional
+        Also project the direction the nose points in of every face, for
+        the overlay. The default is False.
+
     Returns
     -------
-    tuple
-        (processed_frame, head_pose_results)
+    head_pose_results : dict
+        Angles (pitch, yaw) and direction of the last face in the frame, and
+        with annotate the 'nose_lines' ((x, y), (x, y)) of every face
     """
-    # Initialize camera matrix
-    size = frame.shape
-    focal_length = size[1]
-    center = (size[1]/2, size[0]/2)
-    camera_matrix = np.array(
-                        [[focal_length, 0, center[0]],
-                        [0, focal_length, center[1]],
-                        [0, 0, 1]], dtype = "double"
-                        )
+    if estimator is None:
+        estimator = default_estimator
 
     head_pose_results = {
         'angles': None,
         'direction': None
     }
+    if annotate:
+        head_pose_results['nose_lines'] = []
 
-    faces = find_faces(frame, face_model)
-    for face in faces:
-        marks = detect_marks(frame, landmark_model, face)
-        image_points = np.array([
-                                marks[30],     # Nose tip
-                                marks[8],      # Chin
-                                marks[36],     # Left eye left corner
-                                marks[45],     # Right eye right corner
-                                marks[48],     # Left Mouth corner
-                                marks[54]      # Right mouth corner
-                            ], dtype="double")
-        
-        dist_coeffs = np.zeros((4,1))
-        (success, rotation_vector, translation_vector) = cv2.solvePnP(model_points, 
-                                                                    image_points, 
-                                                                    camera_matrix, 
-                                                                    dist_coeffs, 
-                                                                    flags=cv2.SOLVEPNP_UPNP)
-
-        # Draw face points and lines
-        (nose_end_point2D, _) = cv2.projectPoints(np.array([(0.0, 0.0, 1000.0)]), 
-                                                 rotation_vector, 
-                                                 translation_vector, 
-                                                 camera_matrix, 
-                                                 dist_coeffs)
-        
-        p1 = (int(image_points[0][0]), int(image_points[0][1]))
-        p2 = (int(nose_end_point2D[0][0][0]), int(nose_end_point2D[0][0][1]))
-        x1, x2 = head_pose_points(frame, rotation_vector, translation_vector, camera_matrix)
-
-        cv2.line(frame, p1, p2, (0, 255, 255), 2)
-        cv2.line(frame, tuple(x1), tuple(x2), (255, 255, 0), 2)
-
-        try:
-            m = (p2[1] - p1[1])/(p2[0] - p1[0])
-            ang1 = int(math.degrees(math.atan(m)))
-        except:
-            ang1 = 90
-            
-        try:
-            m = (x2[1] - x1[1])/(x2[0] - x1[0])
-            ang2 = int(math.degrees(math.atan(-1/m)))
-        except:
-            ang2 = 90
-
-        direction = None
-        if ang1 >= 48:
-            direction = 'Head down'
-            print(direction)
-            cv2.putText(frame, 'Head down', (30, 30), font, 2, (255, 255, 128), 3)
-        elif ang1 <= -48:
-            direction = 'Head up'
-            print(direction)
-            cv2.putText(frame, 'Head up', (30, 30), font, 2, (255, 255, 128), 3)
-        elif ang2 >= 48:
-            direction = 'Head right'
-            print(direction)
-            cv2.putText(frame, 'Head right', (90, 30), font, 2, (255, 255, 128), 3)
-        elif ang2 <= -48:
-            direction = 'Head left'
-            print(direction)
-            cv2.putText(frame, 'Head left', (90, 30), font, 2, (255, 255, 128), 3)
-
-        head_pose_results['angles'] = (ang1, ang2)
+    camera_matrix = estimator.camera_matrix(frame.shape)
+    for marks, pose in zip(marks_list, estimator.estimate(marks_list, frame.shape)):
+        if pose is None:
+            continue
+
+        direction = pose['direction']
+        if annotate:
+            (nose_end_point2D, _) = cv2.projectPoints(np.array([(0.0, 0.0, 1000.0)]),
+                                                     pose['rotation_vector'],
+                                                     pose['translation_vector'],
+                                                     camera_matrix,
+                                                     estimator.dist_coeffs)
+            p1 = (int(marks[30][0]), int(marks[30][1]))
+            p2 = (int(nose_end_point2D[0][0][0]), int(nose_end_point2D[0][0][1]))
+            head_pose_results['nose_lines'].append((p1, p2))
+
+        head_pose_results['angles'] = (int(round(pose['pitch'])), int(round(pose['yaw'])))
+        head_pose_results['roll'] = int(round(pose['roll']))
         head_pose_results['direction'] = direction
-    print(head_pose_results)
-    return frame, head_pose_results
\ No newline at end of file
+    return head_pose_results
+
+def detect_head_pose(frame, estimator=None, annotate=False):
+    """
+    Detect head pose from a single frame
+    
+    Parameters
+    ----------
+    frame : np.array
+        Input frame from video/webcam
+    estimator : HeadPoseEstimator, optional
+        Estimator of the stream the frame belongs to. The default is a
+        shared estimator without warm start.
+    annotate : bool, optional
+        Return an annotated copy of the frame. The default is False, which
+        returns the frame untouched.
+        
+    Returns
+    -------
+    tuple
+        (processed_frame, head_pose_results)
+    """
+    faces = find_faces(frame, get_model("face_detector"))
+    marks_list = detect_marks_batch([(frame, face) for face in faces], get_model("landmark_model"))
+    head_pose_results = head_pose_from_marks(frame, marks_list, estimator, annotate)
+    if annotate:
+        return render(frame, {'faces': faces, 'head_pose': head_pose_results}), head_pose_results
+    return frame, head_pose_results
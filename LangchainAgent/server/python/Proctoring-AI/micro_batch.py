@@ -0,0 +1,103 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+
+class MicroBatcher:
+    """
+    Collect single requests from many threads into batches for one model call
+
+    A background thread takes the first waiting request, waits up to
+    max_wait_ms for more to arrive (or until max_batch_size is reached) and
+    calls process_batch once with all of them.
+
+    Parameters
+    ----------
+    process_batch : callable
+        Takes a list of items and returns a list of results in the same order
+    max_batch_size : int, optional
+        Most items per call. The default is 32.
+    max_wait_ms : float, optional
+        How long the first item waits for others to join its batch. The default is 5.
+    timeout : float, optional
+        Seconds a call waits for its result before raising TimeoutError.
+        The default is None, which waits as long as it takes.
+
+    """
+
+    def __init__(self, process_batch, max_batch_size=32, max_wait_ms=5, timeout=None):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Queue an item and return a Future of its result"""
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=None):
+        """Process an item and wait for its result, at most timeout seconds (default self.timeout)"""
+        future = self.submit(item)
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            # Drop the item if its batch has not started yet
+            future.cancel()
+            raise
+
+    def close(self):
+        """Stop the worker once the queued items are processed"""
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                # Finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            # Skip the items whose callers timed out while they were queued
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            try:
+                results = list(self.process_batch(items))
+                if len(results) != len(batch):
+                    raise RuntimeError(f"process_batch returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
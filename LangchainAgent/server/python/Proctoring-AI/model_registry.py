@@ -0,0 +1,81 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+_loaders = {}
+_models = {}
+_load_locks = {}
+_registry_lock = threading.Lock()
+
+
+def register_model(name, loader):
+    """
+    Register how to load a model without loading it
+
+    Parameters
+    ----------
+    name : string
+        Name the model is requested with
+    loader : callable
+        Called without arguments the first time the model is requested
+
+    Returns
+    -------
+    None.
+
+    """
+    with _registry_lock:
+        _loaders[name] = loader
+        _load_locks.setdefault(name, threading.Lock())
+
+
+def get_model(name):
+    """
+    Get a model, loading it on first use
+
+    Every caller in the process shares the same instance. Concurrent first
+    requests wait for a single load, and loading one model never blocks
+    requests for another.
+
+    Parameters
+    ----------
+    name : string
+        Name the model was registered with
+
+    Returns
+    -------
+    model : object
+        Whatever the registered loader returned
+
+    """
+    model = _models.get(name)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        if name not in _loaders:
+            raise KeyError(f"No model registered under '{name}'")
+        load_lock = _load_locks[name]
+
+    with load_lock:
+        if name not in _models:
+            start = time.perf_counter()
+            _models[name] = _loaders[name]()
+            logger.info(f"Loaded model '{name}' in {time.perf_counter() - start:.2f}s")
+        return _models[name]
+
+
+def loaded_models():
+    """Names of the models loaded so far"""
+    return list(_models)
+
+
+def unload_model(name):
+    """Drop a loaded model so the next request loads it again"""
+    load_lock = _load_locks.get(name)
+    if load_lock is None:
+        return
+    with load_lock:
+        _models.pop(name, None)
@@ -6,117 +6,258 @@ Created on Fri Jul 31 01:04:44 2020
 """
 
 import cv2
-from face_detector import get_face_detector, find_faces
-from face_landmarks import get_landmark_model, detect_marks, draw_marks
+import numpy as np
+from face_detector import find_faces
+from face_landmarks import detect_marks_batch, draw_marks
+from model_registry import get_model
+from overlay import render
 import logging
-# face_model = get_face_detector()
-# landmark_model = get_landmark_model()
+
+logger = logging.getLogger(__name__)
 outer_points = [[49, 59], [50, 58], [51, 57], [52, 56], [53, 55]]
-d_outer = [0]*5
 inner_points = [[61, 67], [62, 66], [63, 65]]
-d_inner = [0]*3
+# Upper and lower lip landmark indices, as arrays for vectorized distances
+outer_top, outer_bottom = np.array(outer_points).T
+inner_top, inner_bottom = np.array(inner_points).T
+# Outer eye corners, their distance sets the scale of a face
+left_eye_corner, right_eye_corner = 36, 45
+# Uncalibrated lip distances (pixels) above which a pair counts as open
+OUTER_THRESHOLD = 20
+INNER_THRESHOLD = 15
 font = cv2.FONT_HERSHEY_SIMPLEX 
 
 
+def lip_distances(marks):
+    """
+    Vertical distances between the upper and lower lip landmarks
+
+    Parameters
+    ----------
+    marks : numpy array
+        Landmarks of one face (68, 2) or of many faces (N, 68, 2)
+
+    Returns
+    -------
+    d_outer : numpy array
+        Outer lip distances, shape (5,) or (N, 5)
+    d_inner : numpy array
+        Inner lip distances, shape (3,) or (N, 3)
+
+    """
+    # Landmarks are unsigned; a negative distance would wrap around to a huge value
+    y = np.asarray(marks)[..., 1].astype(np.int64)
+    return y[..., outer_bottom] - y[..., outer_top], y[..., inner_bottom] - y[..., inner_top]
+
+def interocular_distance(marks):
+    """Distance between the outer eye corners, shape () or (N,), in the units of the landmarks"""
+    marks = np.asarray(marks, dtype=np.float64)
+    return np.linalg.norm(marks[..., right_eye_corner, :] - marks[..., left_eye_corner, :], axis=-1)
+
+def mouth_open_batch(marks_batch, outer_threshold=OUTER_THRESHOLD, inner_threshold=INNER_THRESHOLD):
+    """
+    Score mouth opening for many faces (or frames) at once
+
+    A mouth is open when at least 4 of the 5 outer and all 3 inner lip
+    distances are above their thresholds.
+
+    Parameters
+    ----------
+    marks_batch : numpy array
+        Landmarks of N faces, shape (N, 68, 2)
+    outer_threshold : float or numpy array, optional
+        Outer lip threshold in pixels, one value, one per lip pair (5,) or
+        one per face and lip pair (N, 5). The default is 20.
+    inner_threshold : float or numpy array, optional
+        Inner lip threshold in pixels, one value, one per lip pair (3,) or
+        one per face and lip pair (N, 3). The default is 15.
+
+    Returns
+    -------
+    mouth_open : numpy array of bool
+        Whether each mouth is open, shape (N,)
+    confidence : numpy array
+        Fraction of the 8 lip pairs that are open, shape (N,)
+
+    """
+    marks_batch = np.asarray(marks_batch)
+    if marks_batch.size == 0:
+        return np.zeros(0, dtype=bool), np.zeros(0)
+    d_outer, d_inner = lip_distances(marks_batch)
+    cnt_outer = np.count_nonzero(d_outer > outer_threshold, axis=-1)
+    cnt_inner = np.count_nonzero(d_inner > inner_threshold, axis=-1)
+    mouth_open = (cnt_outer > 3) & (cnt_inner > 2)
+    return mouth_open, (cnt_outer + cnt_inner) / 8
+
+
+class MouthSession:
+    """
+    Mouth opening thresholds calibrated to one candidate
+
+    Lip distances are measured in interocular distances (between the outer
+    eye corners), so the calibration holds when the candidate moves closer
+    to or away from the camera. The candidate's face on calibration_frames
+    frames showing a single face makes up a calibration window; frames with
+    more than one face are left out, so nobody else's lips end up in it.
+
+    The resting distance of each lip pair is a low percentile of the window,
+    the frames where the mouth was most closed, so a candidate who talks
+    during calibration does not get an open mouth as their baseline. A
+    window in which the lips moved too much to contain a resting mouth
+    (spread of the inner lip distance above max_spread) is discarded and
+    collected again; the fixed pixel thresholds apply until a window passes.
+    After that a lip pair counts as open when it is outer_margin
+    (inner_margin) interocular distances wider than at rest.
+
+    Parameters
+    ----------
+    calibration_frames : int, optional
+        Single face frames in a calibration window. The default is 30.
+    outer_margin : float, optional
+        Opening above the resting outer lip distances, in interocular
+        distances. The default is 0.035, about 3 pixels for a face 85
+        pixels between the eye corners.
+    inner_margin : float, optional
+        Opening above the resting inner lip distances, in interocular
+        distances. The default is 0.025.
+    baseline_percentile : float, optional
+        Percentile of the window taken as the resting distances. The default is 20.
+    max_spread : float, optional
+        Largest difference between the 80th and 20th percentile of the mean
+        inner lip distance, in interocular distances, of a window that is
+        accepted. The default is 0.06.
+
+    """
+
+    def __init__(self, calibration_frames=30, outer_margin=0.035, inner_margin=0.025,
+                 baseline_percentile=20, max_spread=0.06):
+        self.calibration_frames = calibration_frames
+        self.outer_margin = outer_margin
+        self.inner_margin = inner_margin
+        self.baseline_percentile = baseline_percentile
+        self.max_spread = max_spread
+        self.samples_outer = []
+        self.samples_inner = []
+        # Resting lip distances in interocular distances, set by calibration
+        self.outer_rest = None
+        self.inner_rest = None
+        self.rejected_windows = 0
+        self.calibrated = False
+
+    def calibrate(self, marks_batch):
+        """Add the face of a single face frame to the calibration window, fixing the resting distances once it is full"""
+        if self.calibrated or len(marks_batch) != 1:
+            return
+        width = interocular_distance(marks_batch)
+        if width[0] < 1:
+            return
+        d_outer, d_inner = lip_distances(marks_batch)
+        self.samples_outer.extend(d_outer / width[:, None])
+        self.samples_inner.extend(d_inner / width[:, None])
+        if len(self.samples_outer) < self.calibration_frames:
+            return
+
+        samples_outer, samples_inner = np.array(self.samples_outer), np.array(self.samples_inner)
+        self.samples_outer, self.samples_inner = [], []
+        low, high = np.percentile(samples_inner.mean(axis=1), [20, 80])
+        if high - low > self.max_spread:
+            # The mouth kept moving, e.g. the candidate was talking; try the next window
+            self.rejected_windows += 1
+            logger.info(f"Mouth calibration window rejected, lip spread {high - low:.3f} "
+                        f"above {self.max_spread}")
+            return
+        self.outer_rest = np.percentile(samples_outer, self.baseline_percentile, axis=0)
+        self.inner_rest = np.percentile(samples_inner, self.baseline_percentile, axis=0)
+        self.calibrated = True
+
+    def thresholds(self, marks_batch):
+        """Outer (N, 5) and inner (N, 3) thresholds in pixels for faces, the fixed ones before calibration"""
+        if not self.calibrated:
+            return OUTER_THRESHOLD, INNER_THRESHOLD
+        width = interocular_distance(marks_batch)[:, None]
+        return (self.outer_rest + self.outer_margin) * width, (self.inner_rest + self.inner_margin) * width
+
+    def score(self, marks_batch):
+        """Mouth open flags and confidences of faces, calibrating on them first if needed"""
+        marks_batch = np.asarray(marks_batch)
+        if not self.calibrated:
+            self.calibrate(marks_batch)
+        if marks_batch.size == 0:
+            return mouth_open_batch(marks_batch)
+        return mouth_open_batch(marks_batch, *self.thresholds(marks_batch))
+
+
 def mouth_opening_detector(video_path):
+    face_model = get_model("face_detector")
+    landmark_model = get_model("landmark_model")
+    session = MouthSession()
     cap = cv2.VideoCapture(video_path)
 
     while(True):
         ret, img = cap.read()
+        if not ret:
+            break
         rects = find_faces(img, face_model)
-        for rect in rects:
-            shape = detect_marks(img, landmark_model, rect)
+        marks_list = detect_marks_batch([(img, rect) for rect in rects], landmark_model)
+        for shape in marks_list:
             draw_marks(img, shape)
-            cv2.putText(img, 'Press r to record Mouth distances', (30, 30), font,
+        if not session.calibrated:
+            cv2.putText(img, 'Calibrating: keep your mouth closed', (30, 30), font,
                         1, (0, 255, 255), 2)
-            cv2.imshow("Output", img)
-        if cv2.waitKey(1) & 0xFF == ord('r'):
-            for i in range(100):
-                for i, (p1, p2) in enumerate(outer_points):
-                    d_outer[i] += shape[p2][1] - shape[p1][1]
-                for i, (p1, p2) in enumerate(inner_points):
-                    d_inner[i] += shape[p2][1] - shape[p1][1]
-            break
-    cv2.destroyAllWindows()
-    d_outer[:] = [x / 100 for x in d_outer]
-    d_inner[:] = [x / 100 for x in d_inner]
-
-    while(True):
-        ret, img = cap.read()
-        rects = find_faces(img, face_model)
-        for rect in rects:
-            shape = detect_marks(img, landmark_model, rect)
-            cnt_outer = 0
-            cnt_inner = 0
-            draw_marks(img, shape[48:])
-            for i, (p1, p2) in enumerate(outer_points):
-                if d_outer[i] + 3 < shape[p2][1] - shape[p1][1]:
-                    cnt_outer += 1 
-            for i, (p1, p2) in enumerate(inner_points):
-                if d_inner[i] + 2 <  shape[p2][1] - shape[p1][1]:
-                    cnt_inner += 1
-            if cnt_outer > 3 and cnt_inner > 2:
-                print('Mouth open')
+        if marks_list:
+            mouth_open, _ = session.score(np.array(marks_list))
+            if mouth_open.any():
                 cv2.putText(img, 'Mouth open', (30, 30), font,
                         1, (0, 255, 255), 2)
+        cv2.imshow("Output", img)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+    cap.release()
+    cv2.destroyAllWindows()
             
 
-def process_frame(img, face_model, landmark_model):
-    """Process a single frame and return mouth status"""
+def mouth_status_from_marks(marks_list, session=None):
+    """
+    Check whether the mouth is open from already detected facial landmarks
+
+    Parameters
+    ----------
+    marks_list : list of Array of uint32
+        Facial landmarks of every face in the frame
+    session : MouthSession, optional
+        Calibrated thresholds of the candidate. The default is None, which
+        uses the fixed thresholds.
+
+    Returns
+    -------
+    result : dict
+        Mouth open flag and a simple confidence score of the last face in the frame
+
+    """
+    marks_list = [shape for shape in marks_list if shape is not None]
+    if not marks_list:
+        return {'mouth_open': False, 'confidence': 0.0}
+
+    marks_batch = np.array(marks_list)
+    if session is not None:
+        mouth_open, confidence = session.score(marks_batch)
+    else:
+        mouth_open, confidence = mouth_open_batch(marks_batch)
+
+    return {
+        'mouth_open': bool(mouth_open[-1]),
+        'confidence': float(confidence[-1])
+    }
+
+def process_frame(img, face_model, landmark_model, session=None, annotate=False):
+    """Process a single frame and return (frame, mouth status); the frame is an annotated copy when annotate is set"""
     try:
-        mouth_open = False
-        processed_frame = img.copy()
-        
-        # Initialize result with default values
-        result = {
-            'mouth_open': False,
-            'confidence': 0.0
-        }
-        
-        rects = find_faces(processed_frame, face_model)
-        if not rects:
-            return processed_frame, result
-            
-        for rect in rects:
-            shape = detect_marks(processed_frame, landmark_model, rect)
-            if shape is None:
-                continue
-                
-            draw_marks(processed_frame, shape[48:])
-            
-            # Initialize counters
-            cnt_outer = 0
-            cnt_inner = 0
-            
-            # Check outer points
-            for i, (p1, p2) in enumerate(outer_points):
-                try:
-                    if shape[p2][1] - shape[p1][1] > 20:  # Threshold value
-                        cnt_outer += 1
-                except IndexError:
-                    continue
-                    
-            # Check inner points
-            for i, (p1, p2) in enumerate(inner_points):
-                try:
-                    if shape[p2][1] - shape[p1][1] > 15:  # Threshold value
-                        cnt_inner += 1
-                except IndexError:
-                    continue
-                    
-            mouth_open = cnt_outer > 3 and cnt_inner > 2
-            if mouth_open:
-                cv2.putText(processed_frame, 'Mouth open', (30, 30), font,
-                        1, (0, 255, 255), 2)
-            
-            result = {
-                'mouth_open': mouth_open,
-                'confidence': (cnt_outer + cnt_inner) / 8  # Simple confidence score
-            }
-            
-        return processed_frame, result
+        rects = find_faces(img, face_model)
+        marks_list = detect_marks_batch([(img, rect) for rect in rects], landmark_model)
+        mouth = mouth_status_from_marks(marks_list, session)
+        if annotate:
+            return render(img, {'faces': rects, 'marks': marks_list, 'mouth': mouth}), mouth
+        return img, mouth
         
     except Exception as e:
         logger.error(f"Error in process_frame: {str(e)}")
         return img, {'mouth_open': False, 'confidence': 0.0}
-    
@@ -0,0 +1,313 @@
+import os
+import cv2
+import numpy as np
+from micro_batch import MicroBatcher
+from model_registry import register_model, get_model
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+models_dir = os.path.join(current_dir, 'models')
+
+# COCO class ids of the objects proctoring looks for
+PERSON_CLASS = 0
+PHONE_CLASS = 67
+LABELS = {PERSON_CLASS: 'Person', PHONE_CLASS: 'Phone'}
+
+OBJECT_BACKENDS = ('ultralytics', 'keras')
+DEFAULT_WEIGHTS = {'ultralytics': 'yolov8n.pt',
+                   'keras': os.path.join(models_dir, 'yolov3.weights')}
+DEFAULT_INPUT_SIZE = 320
+# Columns of the compact detection arrays the detectors return
+DETECTION_COLUMNS = ('x1', 'y1', 'x2', 'y2', 'confidence', 'class_id')
+
+
+def letterbox(frame, size=DEFAULT_INPUT_SIZE, color=(114, 114, 114)):
+    """
+    Resize a frame into a size x size square keeping its aspect ratio, padding the rest
+
+    Parameters
+    ----------
+    frame : np.uint8
+        BGR frame
+    size : int, optional
+        Side of the result. The default is 320.
+    color : tuple, optional
+        Color of the padding. The default is (114, 114, 114).
+
+    Returns
+    -------
+    img : np.uint8
+        size x size BGR image
+    scale : float
+        Factor the frame was resized by
+    pad : tuple
+        (left, top) padding in pixels
+
+    """
+    h, w = frame.shape[:2]
+    scale = min(size / h, size / w)
+    nh, nw = round(h * scale), round(w * scale)
+    top, left = (size - nh) // 2, (size - nw) // 2
+    img = np.full((size, size, 3), color, dtype=np.uint8)
+    img[top:top + nh, left:left + nw] = cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    return img, scale, (left, top)
+
+def unletterbox(boxes, scale, pad, frame_shape):
+    """Map (x1, y1, x2, y2) boxes of a letterboxed image back to the frame, in place"""
+    h, w = frame_shape[:2]
+    boxes -= np.tile(pad, 2)
+    boxes /= scale
+    np.clip(boxes, 0, [w, h, w, h], out=boxes)
+    return boxes
+
+
+class UltralyticsDetector:
+    """
+    Ultralytics YOLO (YOLOv8 nano by default) restricted to persons and phones
+
+    The class and confidence filters are passed to the model, so other
+    classes and weak boxes are dropped before NMS instead of after it. Frames are letterboxed here and passed
+    as one tensor, so a batch of frames of any sizes is a single forward pass.
+    """
+
+    backend = 'ultralytics'
+
+    def __init__(self, weights=DEFAULT_WEIGHTS['ultralytics'], input_size=DEFAULT_INPUT_SIZE):
+        # ultralytics and torch are only imported when this backend is used
+        import torch
+        from ultralytics import YOLO
+        self._torch = torch
+        self.model = YOLO(weights)
+        self.input_size = input_size
+
+    def detect_batch(self, frames, conf_threshold=0.5):
+        """Per frame, a float32 (N, 6) array of detections, see DETECTION_COLUMNS"""
+        boxed = [letterbox(frame, self.input_size) for frame in frames]
+        # BGR NHWC uint8 -> RGB NCHW float in [0, 1], which Ultralytics takes as is
+        batch = np.stack([img for img, _, _ in boxed])[..., ::-1].transpose(0, 3, 1, 2)
+        tensor = self._torch.from_numpy(np.ascontiguousarray(batch)).float() / 255
+        results = self.model(tensor, imgsz=self.input_size, conf=conf_threshold,
+                             classes=list(LABELS), verbose=False)
+
+        outputs = []
+        for result, (_, scale, pad), frame in zip(results, boxed, frames):
+            # boxes.data already is (x1, y1, x2, y2, confidence, class_id), one device copy per frame
+            detections = result.boxes.data.cpu().numpy().astype(np.float32)
+            unletterbox(detections[:, :4], scale, pad, frame.shape)
+            outputs.append(detections)
+        return outputs
+
+    def detect(self, frame, conf_threshold=0.5):
+        """Float32 (N, 6) array of detections, see DETECTION_COLUMNS"""
+        return self.detect_batch([frame], conf_threshold)[0]
+
+
+class KerasYoloV3Detector:
+    """
+    The Keras YOLOv3 of yolov3_keras.py, built from the darknet weights
+
+    The model only scores persons and phones, and drops boxes under
+    min_confidence, before its NMS.
+    """
+
+    backend = 'keras'
+
+    def __init__(self, weights=DEFAULT_WEIGHTS['keras'], input_size=DEFAULT_INPUT_SIZE, min_confidence=0.25):
+        # TensorFlow is only imported when this backend is used
+        from yolov3_keras import get_yolo_model
+        self.model = get_yolo_model(weights, keep_classes=list(LABELS), score_threshold=min_confidence)
+        self.input_size = input_size
+
+    def detect_batch(self, frames, conf_threshold=0.5):
+        """Per frame, a float32 (N, 6) array of detections, see DETECTION_COLUMNS"""
+        boxed = [letterbox(frame, self.input_size) for frame in frames]
+        batch = np.stack([img for img, _, _ in boxed])[..., ::-1].astype(np.float32) / 255
+        boxes, scores, classes, nums = self.model(batch)
+        # (batch, 100, 6) padded detections, boxes relative to the letterboxed square
+        detections = np.concatenate([np.asarray(boxes) * self.input_size,
+                                     np.asarray(scores)[..., np.newaxis],
+                                     np.asarray(classes)[..., np.newaxis]], axis=-1).astype(np.float32)
+        nums = np.asarray(nums)
+
+        outputs = []
+        for i, ((_, scale, pad), frame) in enumerate(zip(boxed, frames)):
+            frame_detections = detections[i, :int(nums[i])]
+            frame_detections = frame_detections[frame_detections[:, 4] > conf_threshold]
+            unletterbox(frame_detections[:, :4], scale, pad, frame.shape)
+            outputs.append(frame_detections)
+        return outputs
+
+    def detect(self, frame, conf_threshold=0.5):
+        """Float32 (N, 6) array of detections, see DETECTION_COLUMNS"""
+        return self.detect_batch([frame], conf_threshold)[0]
+
+
+def get_object_detector(backend=None, weights=None, input_size=None):
+    """
+    Get the person and phone detector
+
+    Unset options are read from the environment: OBJECT_DETECTOR_BACKEND,
+    OBJECT_DETECTOR_WEIGHTS and OBJECT_DETECTOR_INPUT_SIZE.
+
+    Parameters
+    ----------
+    backend : string, optional
+        'ultralytics' or 'keras'. The default is 'ultralytics'.
+    weights : string, optional
+        Model weights. The default is 'yolov8n.pt' for ultralytics and
+        'models/yolov3.weights' for keras.
+    input_size : int, optional
+        Side frames are resized to for detection. The default is 320.
+
+    Returns
+    -------
+    detector : UltralyticsDetector or KerasYoloV3Detector
+        detector.detect(frame, conf_threshold) returns the persons and
+        phones in the frame as a float32 (N, 6) array of
+        (x1, y1, x2, y2, confidence, class_id) in frame pixels,
+        detector.detect_batch(frames, conf_threshold) a list of them
+
+    """
+    if backend is None:
+        backend = os.environ.get('OBJECT_DETECTOR_BACKEND', 'ultralytics')
+    if backend not in OBJECT_BACKENDS:
+        raise ValueError(f"Unknown object detector backend '{backend}', expected one of {OBJECT_BACKENDS}")
+    if weights is None:
+        weights = os.environ.get('OBJECT_DETECTOR_WEIGHTS', DEFAULT_WEIGHTS[backend])
+    if input_size is None:
+        input_size = int(os.environ.get('OBJECT_DETECTOR_INPUT_SIZE', DEFAULT_INPUT_SIZE))
+
+    if backend == 'keras':
+        return KerasYoloV3Detector(weights, input_size)
+    return UltralyticsDetector(weights, input_size)
+
+register_model("object_detector", get_object_detector)
+
+
+def to_detections(frame_shape, detections):
+    """Detection dicts (see detect_objects) out of a detector's (N, 6) array for one frame"""
+    h, w = frame_shape[:2]
+    boxes = detections[:, :4].astype(int)
+    centers = (boxes[:, :2] + boxes[:, 2:]) / (2 * np.array([w, h]))
+    return [{
+        "type": LABELS[class_id],
+        "box": tuple(box),
+        "x": x,
+        "y": y,
+        "confidence": confidence
+    } for box, (x, y), confidence, class_id in zip(boxes.tolist(), centers.tolist(),
+                                                   detections[:, 4].tolist(), detections[:, 5].astype(int).tolist())]
+
+def detect_object_arrays(frames, conf_threshold=0.5, detector=None):
+    """
+    Find the persons and phones in many frames, as compact arrays
+
+    Parameters
+    ----------
+    frames : list of np.uint8
+        BGR frames
+    conf_threshold : float, optional
+        Minimum detection confidence. The default is 0.5.
+    detector : object detector, optional
+        See get_object_detector. The default is the shared registry model.
+
+    Returns
+    -------
+    detections : list of np.float32
+        Per frame, an (N, 6) array of (x1, y1, x2, y2, confidence, class_id)
+        in frame pixels
+
+    """
+    if not frames:
+        return []
+    if detector is None:
+        detector = get_model("object_detector")
+    return detector.detect_batch(frames, conf_threshold)
+
+def detect_objects_batch(frames, conf_threshold=0.5, detector=None):
+    """
+    Find the persons and phones in many frames with a single forward pass
+
+    The frames may come from different candidates and have different sizes;
+    they are letterboxed into one batch and the boxes mapped back to each
+    frame.
+
+    Parameters
+    ----------
+    frames : list of np.uint8
+        BGR frames
+    conf_threshold : float, optional
+        Minimum detection confidence. The default is 0.5.
+    detector : object detector, optional
+        See get_object_detector. The default is the shared registry model.
+
+    Returns
+    -------
+    detections : list of list of dict
+        The detections (see detect_objects) of each frame
+
+    """
+    arrays = detect_object_arrays(frames, conf_threshold, detector)
+    return [to_detections(frame.shape, detections) for frame, detections in zip(frames, arrays)]
+
+def detect_objects(frame, conf_threshold=0.5, detector=None):
+    """
+    Find the persons and phones in a frame
+
+    Parameters
+    ----------
+    frame : np.uint8
+        BGR frame
+    conf_threshold : float, optional
+        Minimum detection confidence. The default is 0.5.
+    detector : object detector, optional
+        See get_object_detector. The default is the shared registry model.
+
+    Returns
+    -------
+    detections : list of dict
+        'type' ('Person' or 'Phone'), 'box' (x1, y1, x2, y2) in pixels, the
+        box center 'x' and 'y' as fractions of the frame size, and
+        'confidence'
+
+    """
+    return detect_objects_batch([frame], conf_threshold, detector)[0]
+
+def get_object_batcher(detector=None, conf_threshold=0.5, max_batch_size=None, max_wait_ms=None,
+                       timeout=None):
+    """
+    Get a micro-batcher that groups frames from many sessions into batched
+    person and phone detections
+
+    Unset batch options are read from the environment: OBJECT_BATCH_SIZE,
+    OBJECT_BATCH_WAIT_MS and OBJECT_BATCH_TIMEOUT_S.
+
+    Parameters
+    ----------
+    detector : object detector, optional
+        See get_object_detector. The default is the shared registry model.
+    conf_threshold : float, optional
+        Minimum detection confidence. The default is 0.5.
+    max_batch_size : int, optional
+        Most frames per forward pass. The default is 16.
+    max_wait_ms : float, optional
+        How long the first frame waits for others to join its batch. The default is 5.
+    timeout : float, optional
+        Seconds a caller waits for its detections. The default is 30.
+
+    Returns
+    -------
+    batcher : MicroBatcher
+        batcher(frame) returns the frame's detections (see detect_objects)
+
+    """
+    if max_batch_size is None:
+        max_batch_size = int(os.environ.get('OBJECT_BATCH_SIZE', 16))
+    if max_wait_ms is None:
+        max_wait_ms = float(os.environ.get('OBJECT_BATCH_WAIT_MS', 5))
+    if timeout is None:
+        timeout = float(os.environ.get('OBJECT_BATCH_TIMEOUT_S', 30))
+    return MicroBatcher(lambda frames: detect_objects_batch(frames, conf_threshold, detector),
+                        max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, timeout=timeout)
+
+# Shared by the proctoring session workers, see app.analyze_proctoring_frame
+register_model("object_batcher", get_object_batcher)
@@ -0,0 +1,103 @@
+import cv2
+from face_landmarks import draw_marks
+
+font = cv2.FONT_HERSHEY_SIMPLEX
+
+# BGR colors of the annotations
+FACE_COLOR = (255, 0, 0)
+PUPIL_COLOR = (0, 0, 255)
+MARK_COLOR = (0, 255, 0)
+NOSE_COLOR = (0, 255, 255)
+STATUS_COLOR = (0, 255, 255)
+PHONE_COLOR = (0, 255, 0)
+PERSON_COLOR = (255, 0, 0)
+EMOTION_COLOR = (0, 0, 255)
+
+
+def draw_faces(frame, faces):
+    """Draw the face boxes (x, y, x1, y1)"""
+    for x, y, x1, y1 in faces:
+        cv2.rectangle(frame, (x, y), (x1, y1), FACE_COLOR, 2)
+
+def draw_eyes(frame, eyes):
+    """Draw the pupils found by eye_tracker.track_eye_marks"""
+    for x, y in eyes.get('pupils', []):
+        cv2.circle(frame, (x, y), 4, PUPIL_COLOR, 2)
+
+def draw_head_pose(frame, head_pose):
+    """Draw the nose directions of head_pose_estimation.head_pose_from_marks(annotate=True)"""
+    for p1, p2 in head_pose.get('nose_lines', []):
+        cv2.line(frame, tuple(p1), tuple(p2), NOSE_COLOR, 2)
+
+def draw_mouths(frame, marks_list):
+    """Draw the mouth landmarks of every face"""
+    for marks in marks_list:
+        draw_marks(frame, marks[48:], MARK_COLOR)
+
+def draw_objects(frame, detections):
+    """Draw person (blue) and phone (green) boxes with their confidence"""
+    for d in detections:
+        x1, y1, x2, y2 = d["box"]
+        color = PHONE_COLOR if d["type"] == 'Phone' else PERSON_COLOR
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(frame, f'{d["type"]} {d["confidence"]:.2f}',
+                    (x1, y1-10),
+                    font,
+                    0.6, color, 2)
+
+def draw_emotions(frame, emotions):
+    """Draw the face boxes (x, y, x1, y1) of emotion detections with their emotion"""
+    for d in emotions:
+        x, y, x1, y1 = d["box"]
+        cv2.rectangle(frame, (x, y), (x1, y1), EMOTION_COLOR, 2)
+        cv2.putText(frame, d["emotion"], (x, y - 10), font, 0.9, EMOTION_COLOR, 2)
+
+def status_lines(results):
+    """Short descriptions of what the results flag, e.g. 'Looking left' or 'Mouth open'"""
+    lines = []
+    eyes = results.get('eyes') or {}
+    for key, text in (('looking_left', 'Looking left'), ('looking_right', 'Looking right'),
+                      ('looking_up', 'Looking up')):
+        if eyes.get(key):
+            lines.append(text)
+    direction = (results.get('head_pose') or {}).get('direction')
+    if direction:
+        lines.append(direction)
+    if (results.get('mouth') or {}).get('mouth_open'):
+        lines.append('Mouth open')
+    return lines
+
+def render(frame, results, copy=True):
+    """
+    Draw the annotations of a results dict on a frame
+
+    Analyzers only return data; this is the one place drawing happens, for
+    demos and preview streams that ask for it.
+
+    Parameters
+    ----------
+    frame : np.uint8
+        Frame the results belong to
+    results : dict
+        Any of the keys 'faces', 'marks', 'eyes', 'head_pose', 'mouth'
+        (see frame_pipeline.analyze_frame), 'objects' (see
+        object_detector.detect_objects) and 'emotions'
+    copy : bool, optional
+        Draw on a copy, leaving frame untouched. The default is True.
+
+    Returns
+    -------
+    img : np.uint8
+        The annotated frame
+
+    """
+    img = frame.copy() if copy else frame
+    draw_faces(img, results.get('faces') or [])
+    draw_mouths(img, results.get('marks') or [])
+    draw_eyes(img, results.get('eyes') or {})
+    draw_head_pose(img, results.get('head_pose') or {})
+    draw_objects(img, results.get('objects') or [])
+    draw_emotions(img, results.get('emotions') or [])
+    for i, line in enumerate(status_lines(results)):
+        cv2.putText(img, line, (30, 30 + 35 * i), font, 1, STATUS_COLOR, 2, cv2.LINE_AA)
+    return img
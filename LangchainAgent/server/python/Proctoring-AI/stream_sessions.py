@@ -0,0 +1,399 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from frame_cache import FrameCache
+from frame_scheduler import AdaptiveScheduler, downsample
+
+logger = logging.getLogger(__name__)
+
+EYE_DIRECTIONS = ['looking_left', 'looking_right', 'looking_up', 'looking_normal']
+HEAD_DIRECTIONS = ['Head up', 'Head down', 'Head left', 'Head right', 'Normal']
+
+
+class ProctoringSession:
+    """
+    Frames and detection counters of one candidate
+
+    Parameters
+    ----------
+    session_id : string
+        Identifier of the candidate's session
+    max_queue : int, optional
+        Frames kept waiting for analysis. When the workers fall behind the
+        oldest frame is dropped, so analysis always runs on recent frames.
+        The default is 4.
+    scheduler : AdaptiveScheduler, optional
+        Decides which detectors run on each frame. The default is None,
+        which runs every detector on every frame.
+    frame_cache : FrameCache, optional
+        Reuses the results of the last analyzed frame for near identical
+        frames. The default is None, which analyzes every frame.
+
+    """
+
+    def __init__(self, session_id, max_queue=4, scheduler=None, frame_cache=None):
+        self.session_id = session_id
+        self.frames = deque(maxlen=max_queue)
+        self.scheduler = scheduler
+        self.frame_cache = frame_cache
+        # Per-session state of the analyzer, e.g. a face tracker
+        self.context = {}
+        # Results of detectors skipped by the scheduler are carried over from their last run
+        self.latest_results = {}
+        # Last analyzed frame, kept (not copied) for on demand previews
+        self.last_frame = None
+        self.detector_runs = {}
+        self.lock = threading.Lock()
+        # True while a worker is draining this session's queue
+        self.scheduled = False
+        self.started_at = time.time()
+        self.last_frame_at = None
+
+        self.total_frames = 0
+        self.cached_frames = 0
+        self.received_frames = 0
+        self.dropped_frames = 0
+        self.phone_detected_count = 0
+        self.mouth_open_count = 0
+        self.no_face_count = 0
+        self.multiple_faces_count = 0
+        self.eye_movement_counts = {k: 0 for k in EYE_DIRECTIONS}
+        self.head_pose_counts = {k: 0 for k in HEAD_DIRECTIONS}
+        self.detection_history = deque(maxlen=50)
+
+    def push(self, frame):
+        """Queue a frame, returns True if an older frame had to be dropped"""
+        with self.lock:
+            dropped = len(self.frames) == self.frames.maxlen
+            self.frames.append(frame)
+            self.received_frames += 1
+            self.last_frame_at = time.time()
+            if dropped:
+                self.dropped_frames += 1
+            return dropped
+
+    def pop(self):
+        """Take the oldest queued frame, or None when the queue is empty"""
+        with self.lock:
+            return self.frames.popleft() if self.frames else None
+
+    def record(self, results, detectors=None, frame=None, cached=False):
+        """
+        Update the counters from the results of one analyzed frame, or of
+        cached results reused for it, and return the combined results
+        """
+        events = []
+        with self.lock:
+            self.total_frames += 1
+            if cached:
+                self.cached_frames += 1
+            if frame is not None:
+                self.last_frame = frame
+            for name in detectors or []:
+                self.detector_runs[name] = self.detector_runs.get(name, 0) + 1
+            results = {**self.latest_results, **results}
+            self.latest_results = results
+
+            face_count = results.get('face_count', 0)
+            if face_count == 0:
+                self.no_face_count += 1
+                events.append('No face detected')
+            elif face_count > 1:
+                self.multiple_faces_count += 1
+                events.append('Multiple faces detected')
+
+            if face_count:
+                eyes = results.get('eyes') or {}
+                for direction in EYE_DIRECTIONS:
+                    if eyes.get(direction):
+                        self.eye_movement_counts[direction] += 1
+                        break
+
+                head_pose = results.get('head_pose') or {}
+                if head_pose.get('angles') is not None:
+                    direction = head_pose.get('direction') or 'Normal'
+                    self.head_pose_counts[direction] += 1
+                    if direction != 'Normal':
+                        events.append(direction)
+
+                if (results.get('mouth') or {}).get('mouth_open'):
+                    self.mouth_open_count += 1
+                    events.append('Mouth open')
+
+            if any(d.get('type') == 'Phone' for d in results.get('objects', [])):
+                self.phone_detected_count += 1
+                events.append('Phone detected')
+
+            if events:
+                self.detection_history.append({
+                    "frame": self.total_frames,
+                    "events": events,
+                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                })
+        return results
+
+    def preview(self):
+        """(last analyzed frame, its results), or None before the first frame is analyzed"""
+        with self.lock:
+            if self.last_frame is None:
+                return None
+            return self.last_frame, self.latest_results
+
+    def counts(self):
+        """Current detection counters"""
+        with self.lock:
+            return {
+                "session_id": self.session_id,
+                "total_frames": self.total_frames,
+                "cached_frames": self.cached_frames,
+                "received_frames": self.received_frames,
+                "dropped_frames": self.dropped_frames,
+                "queued_frames": len(self.frames),
+                "phone_detected_count": self.phone_detected_count,
+                "eye_movement_counts": dict(self.eye_movement_counts),
+                "head_pose_counts": dict(self.head_pose_counts),
+                "mouth_open_count": self.mouth_open_count,
+                "no_face_count": self.no_face_count,
+                "multiple_faces_count": self.multiple_faces_count,
+                "detector_runs": dict(self.detector_runs),
+                "detection_history": list(self.detection_history)[-10:],
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+
+    def summary(self):
+        """Final report with the counters as percentages of the analyzed frames"""
+        counts = self.counts()
+        total = counts["total_frames"]
+
+        def percentage(value):
+            return (value / total * 100) if total > 0 else 0
+
+        return {
+            "session_id": self.session_id,
+            "total_frames": total,
+            "dropped_frames": counts["dropped_frames"],
+            "phone_detection": {
+                "total_detections": counts["phone_detected_count"],
+                "percentage": percentage(counts["phone_detected_count"])
+            },
+            "eye_movements": {
+                "counts": counts["eye_movement_counts"],
+                "percentages": {k: percentage(v) for k, v in counts["eye_movement_counts"].items()}
+            },
+            "head_pose": {
+                "counts": counts["head_pose_counts"],
+                "percentages": {k: percentage(v) for k, v in counts["head_pose_counts"].items()}
+            },
+            "mouth_movements": {
+                "total_open_count": counts["mouth_open_count"],
+                "percentage": percentage(counts["mouth_open_count"])
+            },
+            "face_presence": {
+                "no_face_count": counts["no_face_count"],
+                "multiple_faces_count": counts["multiple_faces_count"]
+            },
+            "detection_history": list(self.detection_history),
+            "session_duration": time.time() - self.started_at,
+            "timestamp": counts["timestamp"]
+        }
+
+
+class SessionManager:
+    """
+    Schedule frame analysis for many concurrent proctoring sessions
+
+    Every session gets its own bounded queue. A session with queued frames is
+    drained by one worker at a time, so its frames are analyzed in order and
+    its counters need no cross-worker coordination, while different sessions
+    run in parallel on the pool.
+
+    Parameters
+    ----------
+    analyze : callable
+        Takes a BGR frame, the set of detectors to run (None for all) and the
+        session's context dict, and returns a results dict (see
+        ProctoringSession.record)
+    workers : int, optional
+        Size of the worker pool. The default is the number of CPU cores.
+    max_queue : int, optional
+        Frames queued per session before the oldest is dropped. The default is 4.
+    target_fps : float, optional
+        Frame rate a candidate should be analyzed at, used to express
+        throughput as candidates per core. The default is 5.
+    scheduler_factory : callable, optional
+        Creates the frame scheduler of each new session. The default is
+        AdaptiveScheduler; None runs every detector on every frame.
+    frame_cache_factory : callable, optional
+        Creates the result cache of each new session. The default is
+        FrameCache; None analyzes every frame.
+    idle_timeout : float, optional
+        Seconds without frames after which a session that was never ended,
+        e.g. of a candidate who closed the tab, is removed with its frames
+        and state. The default is 600; None keeps sessions until ended.
+
+    """
+
+    def __init__(self, analyze, workers=None, max_queue=4, target_fps=5,
+                 scheduler_factory=AdaptiveScheduler, frame_cache_factory=FrameCache,
+                 idle_timeout=600):
+        self.analyze = analyze
+        self.scheduler_factory = scheduler_factory
+        self.frame_cache_factory = frame_cache_factory
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.target_fps = target_fps
+        self.idle_timeout = idle_timeout
+        self.last_reaped_at = time.time()
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="proctoring")
+        self.started_at = time.time()
+        self.frames_processed = 0
+        # Frames that ran the detectors, and the worker time they took; cache
+        # hits are counted apart so they don't inflate the capacity estimate
+        self.frames_analyzed = 0
+        self.cache_hits = 0
+        self.busy_seconds = 0.0
+
+    def get_session(self, session_id, create=False):
+        """Get a session, optionally creating it"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None and create:
+                scheduler = self.scheduler_factory() if self.scheduler_factory else None
+                frame_cache = self.frame_cache_factory() if self.frame_cache_factory else None
+                session = self.sessions[session_id] = ProctoringSession(session_id, self.max_queue,
+                                                                        scheduler, frame_cache)
+            return session
+
+    def submit_frame(self, session_id, frame):
+        """
+        Queue a frame of a session for analysis
+
+        Returns
+        -------
+        dropped : bool
+            Whether an older queued frame of the session was dropped
+
+        """
+        self.reap_idle_sessions()
+        session = self.get_session(session_id, create=True)
+        dropped = session.push(frame)
+        with session.lock:
+            if session.scheduled:
+                return dropped
+            session.scheduled = True
+        self.executor.submit(self._drain, session)
+        return dropped
+
+    def _drain(self, session):
+        while True:
+            frame = session.pop()
+            if frame is None:
+                with session.lock:
+                    # A frame may have arrived between pop() and taking the lock
+                    if not session.frames:
+                        session.scheduled = False
+                        return
+                continue
+
+            start = time.perf_counter()
+            cached = None
+            try:
+                signature = (downsample(frame) if session.frame_cache is not None or session.scheduler is not None
+                             else None)
+                if session.frame_cache is not None:
+                    cached = session.frame_cache.lookup(signature)
+                if cached is None:
+                    # Detectors only count as run, for the scheduler, when they really run
+                    detectors = session.scheduler.due(frame, signature=signature) if session.scheduler else None
+                    results = self.analyze(frame, detectors, session.context)
+            except Exception as e:
+                logger.error(f"Error analyzing frame for session {session.session_id}: {str(e)}")
+                continue
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    self.frames_processed += 1
+                    if cached is not None:
+                        self.cache_hits += 1
+                    else:
+                        self.frames_analyzed += 1
+                        self.busy_seconds += elapsed
+            if cached is not None:
+                session.record(cached, frame=frame, cached=True)
+                continue
+            combined = session.record(results, detectors, frame)
+            if session.frame_cache is not None:
+                session.frame_cache.store(signature, combined)
+
+    def reap_idle_sessions(self, now=None):
+        """
+        Remove the sessions idle for longer than idle_timeout
+
+        Called as frames arrive, at most every tenth of the timeout, so no
+        thread is needed. Returns the ids of the removed sessions.
+        """
+        if self.idle_timeout is None:
+            return []
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if now - self.last_reaped_at < self.idle_timeout / 10:
+                return []
+            self.last_reaped_at = now
+            idle = [session_id for session_id, session in self.sessions.items()
+                    if not session.scheduled
+                    and now - (session.last_frame_at or session.started_at) > self.idle_timeout]
+            for session_id in idle:
+                del self.sessions[session_id]
+        for session_id in idle:
+            logger.info(f"Removed proctoring session {session_id} after {self.idle_timeout:.0f}s without frames")
+        return idle
+
+    def end_session(self, session_id):
+        """Remove a session and return its final summary, or None if it does not exist"""
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            return None
+        with session.lock:
+            session.frames.clear()
+        return session.summary()
+
+    def stats(self):
+        """Server wide throughput, including how many candidates a core can keep up with"""
+        with self.lock:
+            frames_processed = self.frames_processed
+            frames_analyzed = self.frames_analyzed
+            cache_hits = self.cache_hits
+            busy_seconds = self.busy_seconds
+            active_sessions = len(self.sessions)
+            dropped = sum(s.dropped_frames for s in self.sessions.values())
+        cores = os.cpu_count() or 1
+        elapsed = time.time() - self.started_at
+
+        # Frames one worker analyzes per busy second; with one worker per core
+        # this is what a core sustains. Only analyzed frames count: how many
+        # frames the cache absorbs depends on how still the candidates sit
+        frames_per_worker_second = frames_analyzed / busy_seconds if busy_seconds else 0.0
+        return {
+            "active_sessions": active_sessions,
+            "workers": self.workers,
+            "cores": cores,
+            "frames_processed": frames_processed,
+            "frames_analyzed": frames_analyzed,
+            "cache_hits": cache_hits,
+            "frames_dropped": dropped,
+            "processed_fps": frames_processed / elapsed if elapsed else 0.0,
+            "mean_analysis_ms": busy_seconds / frames_analyzed * 1000 if frames_analyzed else 0.0,
+            "target_fps": self.target_fps,
+            "candidates_per_core": frames_per_worker_second * self.workers / cores / self.target_fps,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -8,6 +8,7 @@ import os
 import time
 from dotenv import load_dotenv
 import base64
+import binascii
 import numpy as np
 import uuid
 import json
@@ -25,6 +26,8 @@ else:
     logger.error(f"Proctoring-AI directory not found at {proctoring_ai_path}")
     raise RuntimeError("Required Proctoring-AI directory not found")
 
+from stream_sessions import SessionManager
+
 
 
 
@@ -471,8 +474,9 @@ def get_api_keys():
     api_keys_str = os.environ.get('GEMINI_API_KEY', '')
     print(f"API keys found: {bool(api_keys_str)}")  # Debug output
     if not api_keys_str:
-        # Fallback to a default key for development
-    
+        # No key configured, the callers answer with an error
+        return []
+
     keys = api_keys_str.split(',')
     print(f"Number of API keys: {len(keys)}")  # Debug output
     return keys
@@ -806,5 +810,206 @@ def end_doctor_session():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+# Remote proctoring: candidates stream webcam frames, analysis runs on a shared worker pool
+def analyze_proctoring_frame(frame, detectors=None, context=None):
+    """Run the detectors due for this frame (all when detectors is None)"""
+    # Imported on first use so the doctor routes don't load the vision models
+    from frame_pipeline import analyze_frame
+    from face_tracker import FaceTracker
+    from mouth_opening_detector import MouthSession
+    from head_pose_estimation import HeadPoseEstimator
+    from eye_tracker import EyeSession
+    from model_registry import get_model
+    from person_and_phone import find_phone_and_person
+    from facemotion import find_emotions
+    from face_detector import find_faces
+    results = {}
+    if detectors is None or 'landmarks' in detectors:
+        tracker = mouth_session = head_pose_estimator = eye_session = None
+        if context is not None:
+            # Created on the session's first frame only, setdefault would build them every frame
+            if 'face_tracker' not in context:
+                context['face_tracker'] = FaceTracker(get_model("face_detector"))
+                context['mouth_session'] = MouthSession()
+                context['head_pose_estimator'] = HeadPoseEstimator()
+                context['eye_session'] = EyeSession()
+            tracker = context['face_tracker']
+            mouth_session = context['mouth_session']
+            head_pose_estimator = context['head_pose_estimator']
+            eye_session = context['eye_session']
+        _, results = analyze_frame(frame, tracker=tracker, mouth_session=mouth_session,
+                                   head_pose_estimator=head_pose_estimator, eye_session=eye_session)
+    if detectors is None or 'objects' in detectors:
+        # Frames of concurrent sessions share one detector forward pass
+        results['objects'] = find_phone_and_person(frame)
+    if detectors is None or 'emotion' in detectors:
+        # Reuse the faces of the landmark pass; on frames it skipped, the boxes the session's
+        # tracker last followed. Asking the tracker again would advance its detection schedule
+        faces = results.get('faces')
+        if faces is None:
+            if context is not None and 'face_tracker' in context:
+                faces = list(context['face_tracker'].faces)
+            else:
+                faces = find_faces(frame, get_model("face_detector"))
+        # Frames of concurrent sessions share one emotion model forward pass
+        results['emotions'] = find_emotions(frame, faces)
+    return results
+
+proctoring_sessions = SessionManager(
+    analyze_proctoring_frame,
+    workers=int(os.environ.get('PROCTORING_WORKERS', 0)) or None,
+    max_queue=int(os.environ.get('PROCTORING_QUEUE_SIZE', 4)),
+    idle_timeout=float(os.environ.get('PROCTORING_IDLE_TIMEOUT', 600)) or None
+)
+
+# Largest JPEG accepted for one frame; a webcam frame is far below it
+MAX_FRAME_BYTES = int(os.environ.get('PROCTORING_MAX_FRAME_BYTES', 2 * 1024 * 1024))
+
+class FrameTooLarge(ValueError):
+    """A frame above MAX_FRAME_BYTES, answered with 413"""
+
+def decode_frame(data):
+    """
+    Decode JPEG bytes, or a base64 (data URL) string, into a BGR image
+
+    Raises FrameTooLarge for frames above MAX_FRAME_BYTES and ValueError for
+    anything that is not an image, so the routes answer 413 or 400.
+    """
+    if isinstance(data, str):
+        if data.startswith('data:image'):
+            data = data.split(',', 1)[1]
+        # Checked before decoding, base64 takes 4 characters per 3 bytes
+        if len(data) * 3 // 4 > MAX_FRAME_BYTES:
+            raise FrameTooLarge(f"Frame larger than {MAX_FRAME_BYTES} bytes")
+        try:
+            data = base64.b64decode(data)
+        except binascii.Error as e:
+            raise ValueError(f"Invalid base64 frame: {e}")
+    if len(data) > MAX_FRAME_BYTES:
+        raise FrameTooLarge(f"Frame larger than {MAX_FRAME_BYTES} bytes")
+    if not data:
+        raise ValueError("Empty frame")
+    try:
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    except cv2.error as e:
+        raise ValueError(f"Could not decode frame: {e}")
+    if frame is None:
+        raise ValueError("Could not decode frame")
+    return frame
+
+def read_length_prefixed_frames(stream):
+    """
+    Yield the JPEGs of a stream where each frame is a 4 byte big-endian length followed by the JPEG
+
+    A length above MAX_FRAME_BYTES raises FrameTooLarge before anything is read for it.
+    """
+    while True:
+        header = stream.read(4)
+        if len(header) < 4:
+            return
+        size = int.from_bytes(header, 'big')
+        if size > MAX_FRAME_BYTES:
+            raise FrameTooLarge(f"Frame of {size} bytes, the limit is {MAX_FRAME_BYTES}")
+        data = stream.read(size)
+        if len(data) < size:
+            return
+        yield data
+
+@app.route('/api/proctoring/<session_id>/frame', methods=['POST'])
+def submit_proctoring_frame(session_id):
+    """
+    Queue one webcam frame of a candidate for analysis.
+
+    Accepts a raw JPEG body (Content-Type: image/jpeg) or JSON {"frameData": "data:image/jpeg;base64,..."}.
+    Returns immediately; the results are aggregated into the session counters.
+    Frames above MAX_FRAME_BYTES get 413, bodies that are not an image 400.
+    """
+    try:
+        # Base64 in JSON takes a third more than the JPEG, plus the field name
+        limit = MAX_FRAME_BYTES * 4 // 3 + 1024 if request.is_json else MAX_FRAME_BYTES
+        if request.content_length is not None and request.content_length > limit:
+            return jsonify({"success": False, "error": f"Frame larger than {MAX_FRAME_BYTES} bytes"}), 413
+
+        if request.is_json:
+            frame_data = (request.get_json(silent=True) or {}).get('frameData')
+            if not frame_data or not isinstance(frame_data, str):
+                return jsonify({"success": False, "error": "Missing frameData field"}), 400
+            frame = decode_frame(frame_data)
+        else:
+            # One byte past the limit is enough to reject bodies sent without a length
+            frame = decode_frame(request.stream.read(MAX_FRAME_BYTES + 1))
+
+        dropped = proctoring_sessions.submit_frame(session_id, frame)
+        return jsonify({"success": True, "dropped": dropped}), 202
+    except FrameTooLarge as e:
+        return jsonify({"success": False, "error": str(e)}), 413
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error queueing proctoring frame: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/proctoring/<session_id>/stream', methods=['POST'])
+def stream_proctoring_frames(session_id):
+    """
+    Queue frames from a long-lived chunked upload.
+
+    The body is a sequence of length-prefixed JPEGs (4 byte big-endian length, then the JPEG bytes),
+    so a candidate can keep one HTTP request open instead of sending a request per frame.
+    A frame above MAX_FRAME_BYTES ends the upload with 413 and one that is not an image,
+    usually a client that lost track of the lengths, with 400; the frames before it are kept.
+    """
+    received = 0
+    dropped = 0
+    try:
+        for data in read_length_prefixed_frames(request.stream):
+            frame = decode_frame(data)
+            received += 1
+            dropped += proctoring_sessions.submit_frame(session_id, frame)
+        return jsonify({"success": True, "received": received, "dropped": dropped})
+    except FrameTooLarge as e:
+        return jsonify({"success": False, "error": str(e), "received": received, "dropped": dropped}), 413
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e), "received": received, "dropped": dropped}), 400
+    except Exception as e:
+        logger.error(f"Error reading proctoring stream: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/proctoring/<session_id>/counts', methods=['GET'])
+def get_proctoring_counts(session_id):
+    """Get the detection counters of a proctoring session"""
+    session = proctoring_sessions.get_session(session_id)
+    if session is None:
+        return jsonify({"success": False, "error": "No active proctoring session"}), 404
+    return jsonify(session.counts())
+
+@app.route('/api/proctoring/<session_id>/preview', methods=['GET'])
+def get_proctoring_preview(session_id):
+    """The session's last analyzed frame as a JPEG, with its detections drawn on it"""
+    from overlay import render
+    session = proctoring_sessions.get_session(session_id)
+    preview = session.preview() if session is not None else None
+    if preview is None:
+        return jsonify({"success": False, "error": "No analyzed frame for this session"}), 404
+    frame, results = preview
+    ok, jpeg = cv2.imencode('.jpg', render(frame, results))
+    if not ok:
+        return jsonify({"success": False, "error": "Could not encode preview"}), 500
+    return Response(jpeg.tobytes(), mimetype='image/jpeg')
+
+@app.route('/api/proctoring/<session_id>/end', methods=['POST'])
+def end_proctoring_session(session_id):
+    """End a proctoring session and return its final report"""
+    summary = proctoring_sessions.end_session(session_id)
+    if summary is None:
+        return jsonify({"success": False, "error": "No active proctoring session"}), 404
+    return jsonify(summary)
+
+@app.route('/api/proctoring/stats', methods=['GET'])
+def get_proctoring_stats():
+    """Server wide proctoring throughput, including concurrent candidates per core"""
+    return jsonify(proctoring_sessions.stats())
+
+
 if __name__ == '__main__':
     app.run(threaded=True, host="0.0.0.0", port=6500)
@@ -219,7 +219,7 @@ class MedicalImageAnalysisTool(BaseTool):
 
 # Main Doctor Agent Class
 class DoctorAgent:
-    def __init__(self, gemini_api_keys: List[str], config: Dict[str, Any] = None):
+    def __init__(self, gemini_api_keys: List[str], config: Dict[str, Any] = None, llm=None):
         self.api_key_manager = APIKeyManager(gemini_api_keys)
         self.config = config or {}
         self.user_id = config.get("user_id", "anonymous")
@@ -231,7 +231,8 @@ class DoctorAgent:
         api_key = self.api_key_manager.get_current_key()
         os.environ["GOOGLE_API_KEY"] = api_key
         
-        self.llm = ChatGoogleGenerativeAI(
+        # A pre-built chat model can be injected, e.g. a scripted stand-in for benchmarks
+        self.llm = llm or ChatGoogleGenerativeAI(
             model="gemini-1.5-flash",
             temperature=0.7,
             google_api_key=api_key,
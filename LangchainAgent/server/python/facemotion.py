@@ -1,48 +1,194 @@
 import cv2
-from deepface import DeepFace
+import numpy as np
+import os
+import sys
 
-# Load face cascade classifier
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+# The shared model registry lives in the Proctoring-AI folder
+proctoring_ai_path = os.path.join(os.path.dirname(__file__), 'Proctoring-AI')
+if proctoring_ai_path not in sys.path:
+    sys.path.append(proctoring_ai_path)
+from face_detector import find_faces
+from micro_batch import MicroBatcher
+from model_registry import register_model, get_model
+from overlay import render
 
-def detect_emotion(frame):
+# Outputs of the DeepFace emotion model, in order
+EMOTIONS = ('angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral')
+# It takes 48x48 gray faces scaled to [0, 1]
+EMOTION_INPUT_SIZE = 48
+
+def load_deepface():
+    """Import DeepFace only when emotions are first analyzed, it pulls in TensorFlow"""
+    from deepface import DeepFace
+    return DeepFace
+
+register_model("deepface", load_deepface)
+
+def load_emotion_model():
+    """
+    Build DeepFace's emotion CNN once and keep it resident
+
+    DeepFace.analyze looks the model up, detects and aligns the face again
+    and runs Keras' predict for every single face; the Keras model is
+    called directly on batches of crops instead.
+    """
+    DeepFace = get_model("deepface")
     try:
-        emotion = None
-        processed_frame = frame.copy()
-        # Convert frame to grayscale
-        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        # Convert grayscale frame to RGB format
-        rgb_frame = cv2.cvtColor(gray_frame, cv2.COLOR_GRAY2RGB)
-        
-        # Detect faces in the frame
-        faces = face_cascade.detectMultiScale(gray_frame, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-        
-        detections = []
-        for (x, y, w, h) in faces:
-            # Extract the face ROI
-            face_roi = rgb_frame[y:y + h, x:x + w]
-            
-            # Analyze emotion
-            result = DeepFace.analyze(face_roi, actions=['emotion'], enforce_detection=False)
-            emotion = result[0]['dominant_emotion']
-            
-            # Draw rectangle and emotion
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 0, 255), 2)
-            cv2.putText(frame, emotion, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
-            
-            detections.append({
-                "emotion": emotion,
-                "x": (x + w/2) / frame.shape[1],
-                "y": (y + h/2) / frame.shape[0]
+        client = DeepFace.build_model("Emotion", task="facial_attribute")
+    except TypeError:
+        # deepface < 0.0.93 has no task argument
+        client = DeepFace.build_model("Emotion")
+    # EmotionClient wraps the Keras model, older releases return the model itself
+    return getattr(client, 'model', client)
+
+register_model("emotion_model", load_emotion_model)
+
+def emotion_crops(frame, faces):
+    """
+    Get the emotion model inputs of the faces of a frame
+
+    Parameters
+    ----------
+    frame : np.uint8
+        BGR frame
+    faces : list
+        Face coordinates (x, y, x1, y1), as returned by find_faces
+
+    Returns
+    -------
+    faces : list
+        The faces with a non empty crop
+    crops : np.float32
+        (N, 48, 48, 1) gray crops scaled to [0, 1]
+
+    """
+    h, w = frame.shape[:2]
+    faces = [(x, y, x1, y1) for x, y, x1, y1 in faces
+             if min(x1, w) > max(x, 0) and min(y1, h) > max(y, 0)]
+    crops = np.empty((len(faces), EMOTION_INPUT_SIZE, EMOTION_INPUT_SIZE, 1), dtype=np.float32)
+    for i, (x, y, x1, y1) in enumerate(faces):
+        # Only the face is converted to gray, not the whole frame
+        gray = cv2.cvtColor(frame[max(y, 0):y1, max(x, 0):x1], cv2.COLOR_BGR2GRAY)
+        crops[i, :, :, 0] = cv2.resize(gray, (EMOTION_INPUT_SIZE, EMOTION_INPUT_SIZE))
+    crops /= 255
+    return faces, crops
+
+def score_emotions(crops, model=None):
+    """Probabilities of EMOTIONS, shape (N, 7), of (N, 48, 48, 1) crops in one forward pass"""
+    if model is None:
+        model = get_model("emotion_model")
+    if not len(crops):
+        return np.zeros((0, len(EMOTIONS)), dtype=np.float32)
+    return np.asarray(model(crops, training=False))
+
+def detect_emotions_batch(items, model=None):
+    """
+    Find the emotions of the faces of many frames with a single forward pass
+
+    Parameters
+    ----------
+    items : list of tuple
+        (frame, faces) pairs, faces being face coordinates (x, y, x1, y1),
+        e.g. from the shared face detector or frame_pipeline.analyze_frame
+    model : Keras model, optional
+        Emotion model. The default is the shared registry model.
+
+    Returns
+    -------
+    emotions : list of list of dict
+        For every frame, 'box', dominant 'emotion', 'probabilities' of all
+        EMOTIONS and the box center 'x' and 'y' as fractions of the frame
+        size of each face
+
+    """
+    crops_list = [emotion_crops(frame, faces) for frame, faces in items]
+    crops = [crops for _, crops in crops_list]
+    probabilities = score_emotions(np.concatenate(crops) if crops else crops, model)
+
+    emotions = []
+    start = 0
+    for (frame, _), (faces, frame_crops) in zip(items, crops_list):
+        h, w = frame.shape[:2]
+        frame_emotions = []
+        for (x, y, x1, y1), p in zip(faces, probabilities[start:start + len(frame_crops)].tolist()):
+            frame_emotions.append({
+                "box": (x, y, x1, y1),
+                "emotion": EMOTIONS[int(np.argmax(p))],
+                "probabilities": dict(zip(EMOTIONS, p)),
+                "x": (x + x1) / (2 * w),
+                "y": (y + y1) / (2 * h)
             })
-            if emotion:
-              cv2.putText(processed_frame, f"Emotion: {emotion}", (10, 60), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-              return processed_frame, emotion
-        
-        # Return None if no emotion detected
-        return processed_frame, None
-        
+        emotions.append(frame_emotions)
+        start += len(frame_crops)
+    return emotions
+
+def detect_emotions(frame, faces=None, model=None):
+    """
+    Find the emotions of the faces of a frame
+
+    Parameters
+    ----------
+    frame : np.uint8
+        BGR frame
+    faces : list, optional
+        Face coordinates (x, y, x1, y1). The default is None, which runs the
+        shared face detector.
+    model : Keras model, optional
+        Emotion model. The default is the shared registry model.
+
+    Returns
+    -------
+    emotions : list of dict
+        See detect_emotions_batch
+
+    """
+    if faces is None:
+        faces = find_faces(frame, get_model("face_detector"))
+    return detect_emotions_batch([(frame, faces)], model)[0]
+
+def get_emotion_batcher(model=None, max_batch_size=None, max_wait_ms=None, timeout=None):
+    """
+    Get a micro-batcher that scores the faces of frames from many streams together
+
+    Unset batch options are read from the environment: EMOTION_BATCH_SIZE
+    (default 16 frames), EMOTION_BATCH_WAIT_MS (default 5) and
+    EMOTION_BATCH_TIMEOUT_S, how long a caller waits for its result (default 30).
+    batcher((frame, faces)) returns the frame's emotions, see detect_emotions_batch.
+    """
+    if max_batch_size is None:
+        max_batch_size = int(os.environ.get('EMOTION_BATCH_SIZE', 16))
+    if max_wait_ms is None:
+        max_wait_ms = float(os.environ.get('EMOTION_BATCH_WAIT_MS', 5))
+    if timeout is None:
+        timeout = float(os.environ.get('EMOTION_BATCH_TIMEOUT_S', 30))
+    return MicroBatcher(lambda items: detect_emotions_batch(items, model),
+                        max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, timeout=timeout)
+
+register_model("emotion_batcher", get_emotion_batcher)
+
+def find_emotions(frame, faces):
+    """
+    Emotions of already detected faces, scored together with the faces other
+    proctoring sessions submit at the same time. Nothing is drawn.
+    """
+    if not faces:
+        return []
+    try:
+        return get_model("emotion_batcher")((frame, faces))
+
+    except Exception as e:
+        print(f"Error in find_emotions: {str(e)}")
+        return []
+
+def detect_emotion(frame, annotate=False):
+    """Dominant emotion of the first face, and the frame, or an annotated copy of it when annotate is set"""
+    try:
+        emotions = detect_emotions(frame)
+        emotion = emotions[0]["emotion"] if emotions else None
+        if annotate:
+            return render(frame, {'emotions': emotions}), emotion
+        return frame, emotion
+
     except Exception as e:
         print(f"Error in detect_emotion: {str(e)}")
-        return frame, []
\ No newline at end of file
+        return frame, []
@@ -1,42 +1,46 @@
-import cv2
-import torch
-from ultralytics import YOLO
+import os
+import sys
 
-# Load YOLOv8 model
-model = YOLO("yolov8s.pt")
+# The shared model registry and object detector live in the Proctoring-AI folder
+proctoring_ai_path = os.path.join(os.path.dirname(__file__), 'Proctoring-AI')
+if proctoring_ai_path not in sys.path:
+    sys.path.append(proctoring_ai_path)
+from model_registry import get_model
+from object_detector import detect_objects, detect_objects_batch
+from overlay import render
 
-def detect_phone_and_person(frame, conf_threshold=0.5):
+def detect_phone_and_person(frame, conf_threshold=0.5, annotate=False):
+    """Detections of a frame, and the frame, or an annotated copy of it when annotate is set"""
     try:
-        results = model(frame)[0]
-        detections = []
-        
-        for r in results.boxes:
-            class_id = int(r.cls.item())
-            confidence = float(r.conf.item())
-            
-            # Check if object is person (0) or phone (67)
-            if class_id in [0, 67] and confidence > conf_threshold:
-                x1, y1, x2, y2 = map(int, r.xyxy[0].tolist())
-                
-                # Green for phone, Blue for person
-                color = (0, 255, 0) if class_id == 67 else (255, 0, 0)
-                label = 'Phone' if class_id == 67 else 'Person'
-                
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                cv2.putText(frame, f'{label} {confidence:.2f}', 
-                           (x1, y1-10),
-                           cv2.FONT_HERSHEY_SIMPLEX, 
-                           0.6, color, 2)
-                
-                detections.append({
-                    "type": label,
-                    "x": (x1 + x2) / (2 * frame.shape[1]),
-                    "y": (y1 + y2) / (2 * frame.shape[0]),
-                    "confidence": confidence
-                })
-
+        detections = detect_objects(frame, conf_threshold)
+        if annotate:
+            return render(frame, {'objects': detections}), detections
         return frame, detections
 
     except Exception as e:
         print(f"Error in detect_phone_and_person: {str(e)}")
-        return frame, []
\ No newline at end of file
+        return frame, []
+
+def detect_phone_and_person_batch(frames, conf_threshold=0.5, annotate=False):
+    """Detections of many frames with one forward pass, and the frames, or annotated copies when annotate is set"""
+    try:
+        detections = detect_objects_batch(frames, conf_threshold)
+        if annotate:
+            frames = [render(frame, {'objects': d}) for frame, d in zip(frames, detections)]
+        return frames, detections
+
+    except Exception as e:
+        print(f"Error in detect_phone_and_person_batch: {str(e)}")
+        return frames, [[] for _ in frames]
+
+def find_phone_and_person(frame):
+    """
+    Detections of a frame, batched with the frames other proctoring sessions
+    submit at the same time. Nothing is drawn.
+    """
+    try:
+        return get_model("object_batcher")(frame)
+
+    except Exception as e:
+        print(f"Error in find_phone_and_person: {str(e)}")
+        return []
@@ -0,0 +1,86 @@
+"""
+Parity of the ONNX landmark backends with the TensorFlow SavedModel.
+
+The OpenCV and ONNX Runtime backends run the export of convert_landmark_model.py, so
+they must find the same landmarks as TensorFlow on the same face crops. Backends and
+exported models that are not available here are skipped:
+
+    python -m pytest tests/test_landmark_parity.py
+"""
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+PROCTORING_DIR = Path(__file__).resolve().parent.parent / "python" / "Proctoring-AI"
+sys.path.insert(0, str(PROCTORING_DIR))
+
+cv2 = pytest.importorskip("cv2")
+
+from face_landmarks import crop_face, get_landmark_model, pose_model
+
+# Largest landmark difference to TensorFlow, in pixels of the 128x128 crop,
+# the same tolerances as benchmarks/bench_landmarks.py
+FP32_TOLERANCE = 0.5
+INT8_TOLERANCE = 3.0
+
+
+def landmarks(model, crops):
+    """Landmarks of the crops in crop pixels, shape (N, 68, 2)"""
+    return np.asarray(model.predict(crops)).reshape(len(crops), -1)[:, :136].reshape(len(crops), 68, 2) * 128
+
+
+@pytest.fixture(scope="module")
+def crops():
+    from face_detector import find_faces, get_face_detector
+
+    face_model = get_face_detector()
+    crops = []
+    for path in sorted((PROCTORING_DIR / "face_detection" / "faces").glob("*")):
+        img = cv2.imread(str(path))
+        if img is not None:
+            crops.extend(crop_face(img, face)[0] for face in find_faces(img, face_model))
+    if not crops:
+        pytest.skip("No faces found in the sample images")
+    return np.stack(crops)
+
+
+@pytest.fixture(scope="module")
+def reference(crops):
+    pytest.importorskip("tensorflow")
+    return landmarks(get_landmark_model(backend="tensorflow"), crops)
+
+
+@pytest.mark.parametrize("backend, quantized", [
+    ("opencv", False),
+    ("onnxruntime", False),
+    ("opencv", True),
+    ("onnxruntime", True),
+])
+def test_matches_tensorflow(crops, reference, backend, quantized):
+    if backend == "onnxruntime":
+        pytest.importorskip("onnxruntime")
+    onnx_file = os.path.normpath(pose_model) + ("_int8.onnx" if quantized else ".onnx")
+    if not os.path.exists(onnx_file):
+        pytest.skip(f"{onnx_file} not exported, see convert_landmark_model.py")
+
+    marks = landmarks(get_landmark_model(backend=backend, quantized=quantized), crops)
+
+    tolerance = INT8_TOLERANCE if quantized else FP32_TOLERANCE
+    assert marks.shape == reference.shape
+    assert np.abs(marks - reference).max() <= tolerance
+
+
+@pytest.mark.parametrize("backend", ["opencv", "onnxruntime"])
+def test_batched_matches_single(crops, backend):
+    if backend == "onnxruntime":
+        pytest.importorskip("onnxruntime")
+    if not os.path.exists(os.path.normpath(pose_model) + ".onnx"):
+        pytest.skip("pose_model.onnx not exported, see convert_landmark_model.py")
+
+    model = get_landmark_model(backend=backend)
+    batched = landmarks(model, crops)
+    single = np.concatenate([landmarks(model, crops[i:i + 1]) for i in range(len(crops))])
+    np.testing.assert_allclose(batched, single, atol=1e-3)
@@ -0,0 +1,140 @@
+"""
+Smoke test of the proctoring routes of app.py with the Flask test client.
+
+The detectors are replaced by a stand-in, so only the HTTP layer, frame decoding
+and the session bookkeeping run. Skipped when the web dependencies of the server
+are not installed:
+
+    python -m pytest tests/test_proctoring_routes.py
+"""
+import base64
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / "python"
+sys.path.insert(0, str(SERVER_DIR))
+
+cv2 = pytest.importorskip("cv2")
+for module in ("flask", "flask_cors", "dotenv", "langchain_google_genai", "PIL"):
+    pytest.importorskip(module)
+
+import app as server
+from stream_sessions import SessionManager
+
+
+def jpeg(value=128):
+    ok, data = cv2.imencode(".jpg", np.full((48, 64, 3), value, np.uint8))
+    assert ok
+    return data.tobytes()
+
+
+def wait_for_frames(client, session_id, total, timeout=5):
+    """Counters of a session once its workers analyzed total frames"""
+    deadline = time.monotonic() + timeout
+    while True:
+        counts = client.get(f"/api/proctoring/{session_id}/counts").get_json()
+        if counts["total_frames"] >= total or time.monotonic() > deadline:
+            return counts
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    def analyze(frame, detectors=None, context=None):
+        return {"face_count": 1}
+
+    sessions = SessionManager(analyze, workers=1, scheduler_factory=None, frame_cache_factory=None)
+    monkeypatch.setattr(server, "proctoring_sessions", sessions)
+    yield server.app.test_client()
+    sessions.shutdown()
+
+
+def test_get_api_keys_without_keys(monkeypatch):
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    assert server.get_api_keys() == []
+
+
+def test_frame_routes(client):
+    response = client.post("/api/proctoring/s1/frame", data=jpeg(), content_type="image/jpeg")
+    assert response.status_code == 202
+    assert response.get_json()["success"]
+
+    data_url = "data:image/jpeg;base64," + base64.b64encode(jpeg(200)).decode()
+    response = client.post("/api/proctoring/s1/frame", json={"frameData": data_url})
+    assert response.status_code == 202
+
+    counts = wait_for_frames(client, "s1", 2)
+    assert counts["total_frames"] == 2
+    assert counts["no_face_count"] == 0
+
+    summary = client.post("/api/proctoring/s1/end").get_json()
+    assert summary["session_id"] == "s1"
+    assert summary["total_frames"] == 2
+    assert client.post("/api/proctoring/s1/end").status_code == 404
+    assert client.get("/api/proctoring/s1/counts").status_code == 404
+
+
+def test_stream_route(client):
+    frames = [jpeg(value) for value in (0, 100, 200)]
+    body = b"".join(len(data).to_bytes(4, "big") + data for data in frames)
+    response = client.post("/api/proctoring/s2/stream", data=body, content_type="application/octet-stream")
+    assert response.status_code == 200
+    assert response.get_json()["received"] == 3
+    assert wait_for_frames(client, "s2", 3)["total_frames"] == 3
+
+
+def test_missing_frame_data(client):
+    response = client.post("/api/proctoring/s3/frame", json={})
+    assert response.status_code == 400
+
+
+def test_stats(client):
+    client.post("/api/proctoring/s4/frame", data=jpeg(), content_type="image/jpeg")
+    wait_for_frames(client, "s4", 1)
+    stats = client.get("/api/proctoring/stats").get_json()
+    assert stats["active_sessions"] == 1
+    assert stats["frames_analyzed"] == 1
+
+
+@pytest.mark.parametrize("body, content_type", [
+    (b"not a jpeg", "image/jpeg"),
+    (b"", "image/jpeg"),
+    ({"frameData": "data:image/jpeg;base64,@@@"}, None),
+    ({"frameData": "data:image/jpeg;base64," + base64.b64encode(b"not a jpeg").decode()}, None),
+])
+def test_malformed_frame(client, body, content_type):
+    if isinstance(body, dict):
+        response = client.post("/api/proctoring/s5/frame", json=body)
+    else:
+        response = client.post("/api/proctoring/s5/frame", data=body, content_type=content_type)
+    assert response.status_code == 400
+    assert not response.get_json()["success"]
+
+
+def test_frame_too_large(client, monkeypatch):
+    monkeypatch.setattr(server, "MAX_FRAME_BYTES", 1000)
+    response = client.post("/api/proctoring/s6/frame", data=b"\xff" * 1001, content_type="image/jpeg")
+    assert response.status_code == 413
+
+    data_url = "data:image/jpeg;base64," + base64.b64encode(b"\xff" * 1001).decode()
+    response = client.post("/api/proctoring/s6/frame", json={"frameData": data_url})
+    assert response.status_code == 413
+
+
+def test_stream_limits(client, monkeypatch):
+    data = jpeg()
+    monkeypatch.setattr(server, "MAX_FRAME_BYTES", len(data))
+    # The length is checked before the frame is read, so nothing has to follow it
+    body = len(data).to_bytes(4, "big") + data + (2 ** 31).to_bytes(4, "big")
+    response = client.post("/api/proctoring/s7/stream", data=body, content_type="application/octet-stream")
+    assert response.status_code == 413
+    assert response.get_json()["received"] == 1
+
+    body = len(data).to_bytes(4, "big") + data + (4).to_bytes(4, "big") + b"junk"
+    response = client.post("/api/proctoring/s7/stream", data=body, content_type="application/octet-stream")
+    assert response.status_code == 400
+    assert response.get_json()["received"] == 1